@@ -0,0 +1,119 @@
+"""Measure per-chunk latency and prompt size for different context policies.
+
+Run with
+
+    python benchmarks/bench_context_window.py --chunks 40
+
+Every chunk of a synthetic file is converted by a FileProcessor talking to
+the local mock OpenRouter server, whose latency grows with the prompt size.
+"""
+
+import argparse
+import asyncio
+import sys
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from attrs import Factory, define
+
+from loguru import logger
+
+from plc.context_policy import ContextPolicy
+from plc.database import create_tables
+from plc.file_processor import FileProcessor
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.mock_open_router import MockOpenRouterServer
+from plc.model import Model
+from plc.open_router_provider import OpenRouterProvider
+from plc.token_estimator import estimate_message_tokens
+
+MODEL = Model("mock/model", "mock")
+
+
+def make_notebook(num_chunks: int, chunk_size: int) -> str:
+    cells = []
+    for i in range(num_chunks):
+        body = f"    // Method {i}\n" * (chunk_size // 20)
+        cells.append(f"// %%\nclass Class{i} {{\n{body}}}\n\n")
+    return "".join(cells)
+
+
+@define
+class MeasuringProvider(LlmProvider):
+    provider: LlmProvider
+    samples: list[tuple[int, float]] = Factory(list)
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        start = time.perf_counter()
+        reply = await self.provider.send_message(messages, model)
+        self.samples.append(
+            (estimate_message_tokens(messages), time.perf_counter() - start)
+        )
+        return reply
+
+
+async def measure(
+    policy: ContextPolicy, file_path: Path, server: MockOpenRouterServer
+) -> list[tuple[int, float]]:
+    provider = MeasuringProvider(
+        OpenRouterProvider(api_key="bench", api_url=server.url)
+    )
+    conn = sqlite3.connect(":memory:")
+    create_tables(conn)
+    processor = FileProcessor(
+        file_path=file_path,
+        llm_provider=provider,
+        model=MODEL,
+        from_slug="java",
+        to_slug="csharp",
+        conn=conn,
+        max_chunk_size=len(file_path.read_text()) // 40,
+        context_policy=policy,
+    )
+    async with provider.provider:
+        await processor.process()
+    # The first request is the acknowledgement of the initial prompt.
+    return provider.samples[1:]
+
+
+async def run_benchmark(num_chunks: int, chunk_size: int, policies: list[str]):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = Path(tmp_dir) / "notebook.java"
+        file_path.write_text(make_notebook(num_chunks, chunk_size))
+        async with MockOpenRouterServer(latency_per_1k_tokens=0.01) as server:
+            for spec in policies:
+                samples = await measure(ContextPolicy.parse(spec), file_path, server)
+                tokens = [t for t, _ in samples]
+                latencies = [l for _, l in samples]
+                print(f"Context policy {spec!r}: {len(samples)} chunks")
+                for index in (0, len(samples) // 2, len(samples) - 1):
+                    print(
+                        f"  chunk {index + 1:3}: {tokens[index]:7} prompt tokens, "
+                        f"{latencies[index] * 1000:7.1f} ms"
+                    )
+                print(
+                    f"  total:     {sum(tokens):7} prompt tokens, "
+                    f"{sum(latencies) * 1000:7.1f} ms"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument(
+        "--policies", default="full,last:4,tokens:8000", help="Comma-separated"
+    )
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    asyncio.run(
+        run_benchmark(args.chunks, args.chunk_size, args.policies.split(","))
+    )
+
+
+if __name__ == "__main__":
+    main()
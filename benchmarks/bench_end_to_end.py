@@ -0,0 +1,258 @@
+"""Measure the throughput of complete conversion runs against a mock server.
+
+Run with
+
+    python benchmarks/bench_end_to_end.py --files 200 --scenario all
+
+Every scenario converts a synthetic corpus with
+`PolyglotLanguageConverter.process_files` against a local mock of the
+OpenRouter API with the scenario's latency distribution, error rate and
+rate-limit bursts. It reports files per minute, the p50 and p95 latency of
+successful requests and the peak RSS of the process that ran the scenario.
+Each scenario runs in a fresh process so that peak RSS is not shared between
+scenarios.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from attrs import Factory, define
+from loguru import logger
+
+from plc.errors import LlmProviderError
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.mock_open_router import (
+    MockOpenRouterServer,
+    exponential_latency,
+    lognormal_latency,
+    uniform_latency,
+)
+from plc.model import Model
+from plc.open_router_provider import OpenRouterProvider
+from plc.polyglot_language_converter import PolyglotLanguageConverter
+from plc.rate_limiter import RateLimitedProvider
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+SCENARIOS = {
+    "steady": {"latency": "lognormal:0.05,0.5"},
+    "heavy-tail": {"latency": "lognormal:0.05,1.2"},
+    "errors": {"latency": "lognormal:0.05,0.5", "error_rate": 0.05},
+    "bursts": {
+        "latency": "lognormal:0.05,0.5",
+        "rate_limit_burst_interval": 2.0,
+        "rate_limit_burst_duration": 0.4,
+    },
+}
+
+CELL = """\
+// %%
+public class Example{index} {{
+    public static int compute(int value) {{
+        return value * {index} + {padding};
+    }}
+}}
+
+"""
+
+
+def parse_latency(spec: str):
+    """Parse `fixed:S`, `uniform:LOW,HIGH`, `exponential:MEAN` or
+    `lognormal:MEDIAN,SIGMA` into a latency distribution."""
+    kind, _, args = spec.partition(":")
+    values = [float(arg) for arg in args.split(",") if arg]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return uniform_latency(*values)
+    if kind == "exponential" and len(values) == 1:
+        return exponential_latency(*values)
+    if kind == "lognormal" and len(values) == 2:
+        return lognormal_latency(*values)
+    raise ValueError(f"Invalid latency distribution: {spec!r}")
+
+
+def scaled_reply(scale: float):
+    """Reply with `scale` times as many characters as the last message."""
+
+    def reply(messages: list[dict]) -> str:
+        content = messages[-1]["content"] if messages else ""
+        size = int(len(content) * scale)
+        return (content * (int(scale) + 1))[:size]
+
+    return reply
+
+
+@define
+class TimedProvider(LlmProvider):
+    """Record the latency of every successful request of `provider`."""
+
+    provider: LlmProvider
+    latencies: list[float] = Factory(list)
+    num_errors: int = 0
+
+    async def open(self):
+        await self.provider.open()
+
+    async def close(self):
+        await self.provider.close()
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        start = time.perf_counter()
+        try:
+            result = await self.provider.send_message(messages, model)
+        except LlmProviderError:
+            self.num_errors += 1
+            raise
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+
+def write_corpus(directory: Path, num_files: int, num_cells: int, cell_size: int):
+    for file_index in range(num_files):
+        cells = [
+            CELL.format(index=index, padding="0" * cell_size)
+            for index in range(num_cells)
+        ]
+        (directory / f"slides_{file_index:05}.java").write_text("".join(cells))
+
+
+def peak_rss_mib() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+async def run_scenario(options: dict, server_options: dict) -> dict:
+    server_options = dict(server_options)
+    latency = parse_latency(server_options.pop("latency"))
+    models = [Model(f"mock/model-{i}", f"mock{i}") for i in range(options["models"])]
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        corpus = directory / "corpus"
+        corpus.mkdir()
+        write_corpus(corpus, options["files"], options["cells"], options["cell_size"])
+        async with MockOpenRouterServer(
+            latency_distribution=latency,
+            reply=scaled_reply(options["reply_scale"]),
+            seed=options["seed"],
+            **server_options,
+        ) as server:
+            timed_provider = TimedProvider(
+                OpenRouterProvider(
+                    api_key="bench",
+                    api_url=server.url,
+                    max_connections_per_host=options["concurrency"],
+                )
+            )
+            converter = PolyglotLanguageConverter(
+                llm_provider=RateLimitedProvider(
+                    timed_provider, base_delay=0.05, max_delay=2.0
+                ),
+                models=models,
+                db_path=directory / "processed.sqlite3",
+                directory_path=corpus,
+                max_chunk_size=options["max_chunk_size"],
+                concurrency=options["concurrency"],
+            )
+            start = time.perf_counter()
+            await converter.process_files()
+            elapsed = time.perf_counter() - start
+        num_converted = sum(1 for _ in corpus.glob("*.cs"))
+
+    latencies = sorted(timed_provider.latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+    return {
+        "elapsed": elapsed,
+        "files_per_minute": options["files"] / elapsed * 60,
+        "converted": num_converted,
+        "expected": options["files"] * len(models),
+        "requests": len(latencies),
+        "errors": timed_provider.num_errors,
+        "p50": quantiles[49] if quantiles else None,
+        "p95": quantiles[94] if quantiles else None,
+        "peak_rss": peak_rss_mib(),
+    }
+
+
+def run_scenario_in_process(options: dict, server_options: dict) -> dict:
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    return asyncio.run(run_scenario(options, server_options))
+
+
+def format_seconds(value: float | None) -> str:
+    return "n/a" if value is None else f"{value * 1000:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario", default="all", choices=["all", *SCENARIOS.keys()]
+    )
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--cells", type=int, default=20)
+    parser.add_argument("--cell-size", type=int, default=200)
+    parser.add_argument("--max-chunk-size", type=int, default=2048)
+    parser.add_argument("--models", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--reply-scale", type=float, default=1.0)
+    parser.add_argument(
+        "--latency", default=None, help="Override the latency of the scenarios"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    options = {
+        "files": args.files,
+        "cells": args.cells,
+        "cell_size": args.cell_size,
+        "max_chunk_size": args.max_chunk_size,
+        "models": args.models,
+        "concurrency": args.concurrency,
+        "reply_scale": args.reply_scale,
+        "seed": args.seed,
+    }
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    print(
+        f"{args.files} files x {args.models} models, {args.cells} cells per file, "
+        f"concurrency {args.concurrency}"
+    )
+    print(
+        f"  {'scenario':<12} {'files/min':>10} {'p50':>8} {'p95':>8} "
+        f"{'requests':>9} {'errors':>7} {'converted':>10} {'peak RSS':>10}"
+    )
+    for name in names:
+        server_options = dict(SCENARIOS[name])
+        if args.latency:
+            server_options["latency"] = args.latency
+        # A fresh process per scenario keeps the peak RSS of scenarios apart.
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(
+                run_scenario_in_process, options, server_options
+            ).result()
+        peak_rss = result["peak_rss"]
+        print(
+            f"  {name:<12} {result['files_per_minute']:10.0f} "
+            f"{format_seconds(result['p50']):>8} {format_seconds(result['p95']):>8} "
+            f"{result['requests']:9} {result['errors']:7} "
+            f"{result['converted']:>4}/{result['expected']:<5} "
+            f"{'n/a' if peak_rss is None else f'{peak_rss:.0f} MiB':>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
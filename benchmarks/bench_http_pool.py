@@ -0,0 +1,82 @@
+"""Compare per-request sessions with the pooled session of OpenRouterProvider.
+
+Run with
+
+    python benchmarks/bench_http_pool.py --requests 2000 --concurrency 32
+
+The mock endpoint is plain HTTP on localhost, so the numbers only show the
+cost of session creation and TCP connects; against the real API every
+avoided connection also saves a DNS lookup and a TLS handshake.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from loguru import logger
+
+from plc.message import Message
+from plc.mock_open_router import MockOpenRouterServer
+from plc.model import Model
+from plc.open_router_provider import OpenRouterProvider
+
+MODEL = Model("mock/model", "mock")
+MESSAGES = [Message("user", "// %%\nclass Foo {}\n")]
+
+
+async def send_requests(
+    provider: OpenRouterProvider, num_requests: int, concurrency: int
+) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one():
+        async with semaphore:
+            await provider.send_message(MESSAGES, MODEL)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send_one() for _ in range(num_requests)))
+    return time.perf_counter() - start
+
+
+async def run_benchmark(num_requests: int, concurrency: int, latency: float):
+    async with MockOpenRouterServer(latency=latency) as server:
+        unpooled = OpenRouterProvider(api_key="bench", api_url=server.url)
+        unpooled_time = await send_requests(unpooled, num_requests, concurrency)
+        unpooled_connections = len(server.client_connections)
+
+        server.client_connections.clear()
+        async with OpenRouterProvider(
+            api_key="bench",
+            api_url=server.url,
+            max_connections_per_host=concurrency,
+            warm_up_connections=concurrency,
+        ) as pooled:
+            pooled_time = await send_requests(pooled, num_requests, concurrency)
+        pooled_connections = len(server.client_connections)
+
+    print(f"{num_requests} requests, concurrency {concurrency}, latency {latency}s")
+    print(
+        f"  per-request session: {num_requests / unpooled_time:8.1f} req/s "
+        f"({unpooled_connections} connections)"
+    )
+    print(
+        f"  pooled session:      {num_requests / pooled_time:8.1f} req/s "
+        f"({pooled_connections} connections)"
+    )
+    print(f"  speedup:             {unpooled_time / pooled_time:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    asyncio.run(run_benchmark(args.requests, args.concurrency, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Measure the CPU time to encode the requests of a growing conversation.
+
+Run with
+
+    python benchmarks/bench_payload.py --chunks 60 --chunk-size 4000
+
+Every chunk of a file is sent with the whole conversation before it. The old
+encoding serialized all messages again for each request, so the time for a
+file grew quadratically with its number of chunks; the current encoding only
+encodes the messages that were added since the previous request. The
+benchmark reports the total time to encode all requests of one file, and the
+time for its last request, with and without orjson and gzip.
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+from plc import open_router_provider
+from plc.message import Message
+from plc.model import Model
+from plc.open_router_provider import OpenRouterProvider, message_json
+
+MODEL = Model("mock/model", "mock")
+
+
+def legacy_build_request_data(messages: list[Message], model: Model) -> str:
+    return json.dumps(
+        {
+            "model": model.id,
+            "messages": [message_json(m) for m in messages],
+            "usage": {"include": True},
+        }
+    )
+
+
+def make_messages(num_chunks: int, chunk_size: int) -> list[Message]:
+    line = "    System.out.println(\"Größe: \" + size); // ünïcödé\n"
+    chunk = line * (chunk_size // len(line))
+    messages = [Message("user", "Convert the notebook. " * 50)]
+    for i in range(num_chunks):
+        messages.append(Message("user", f"// %% chunk {i}\n{chunk}"))
+        messages.append(Message("assistant", f"// %% chunk {i}\n{chunk}"))
+    return messages
+
+
+def measure(name: str, encode, messages, baseline: float | None = None) -> float:
+    # Fresh messages, so that no encodings are cached from an earlier run.
+    messages = [Message(m.role, m.content, m.cache) for m in messages]
+    times = []
+    for end in range(2, len(messages) + 1, 2):
+        start = time.perf_counter()
+        encode(messages[:end])
+        times.append(time.perf_counter() - start)
+    total = sum(times)
+    speedup = f"{baseline / total:7.1f}x" if baseline else ""
+    print(
+        f"  {name:<24} {total * 1000:9.1f} ms total "
+        f"{times[-1] * 1000:8.2f} ms last request {speedup}"
+    )
+    return total
+
+
+def run_benchmark(num_chunks: int, chunk_size: int):
+    messages = make_messages(num_chunks, chunk_size)
+    size = len(OpenRouterProvider.build_request_data(messages, MODEL))
+    print(
+        f"{num_chunks} chunks of {chunk_size} characters, last request "
+        f"{size / 2**20:.1f} MiB"
+    )
+    build = OpenRouterProvider.build_request_data
+    baseline = measure(
+        "json, all messages (old)",
+        lambda ms: legacy_build_request_data(ms, MODEL),
+        messages,
+    )
+    orjson = open_router_provider.orjson
+    open_router_provider.orjson = None
+    try:
+        measure("json, new messages", lambda ms: build(ms, MODEL), messages, baseline)
+    finally:
+        open_router_provider.orjson = orjson
+    if orjson is None:
+        print("  (orjson is not installed)")
+    else:
+        measure(
+            "orjson, new messages", lambda ms: build(ms, MODEL), messages, baseline
+        )
+    measure(
+        "new messages + gzip",
+        lambda ms: gzip.compress(build(ms, MODEL), compresslevel=1),
+        messages,
+        baseline,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=60)
+    parser.add_argument("--chunk-size", type=int, default=4000)
+    args = parser.parse_args()
+    run_benchmark(args.chunks, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Compare the line-based splitter with the offset-based splitter.
+
+Run with
+
+    python benchmarks/bench_splitter.py --megabytes 32
+
+The line-based splitter is the implementation that `split_into_chunks` used
+before it was based on cell spans. Besides the time to split a synthetic
+notebook, the benchmark reports the peak memory allocated while splitting,
+which for the span-based versions excludes the chunk texts because they are
+only extracted when a chunk is sent.
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from plc.file_utils import Chunks, mapped_file, split_into_chunks
+
+CELL = """\
+# %%
+def function_{index}(argument):
+    # Compute something moderately interesting.
+    result = [value * {index} for value in range(argument)]
+    return sum(result)
+
+"""
+HUGE_CELL_LINE = "    value = value + 1  # a long cell without markers\n"
+
+
+def legacy_split_into_chunks(content: str, max_chunk_size: int) -> list[str]:
+    possible_chunks: list = []
+    current_chunk = ""
+    for line in content.splitlines(keepends=True):
+        if line.strip().startswith("# %%") or line.strip().startswith("// %%"):
+            if current_chunk:
+                possible_chunks.append(current_chunk)
+            current_chunk = line
+        else:
+            current_chunk += line
+    if current_chunk:
+        possible_chunks.append(current_chunk)
+
+    final_chunks = []
+    current_chunk = ""
+    for chunk in possible_chunks:
+        if len(chunk) > max_chunk_size:
+            if current_chunk:
+                final_chunks.append(current_chunk)
+                current_chunk = ""
+            final_chunks.append(chunk)
+        elif len(current_chunk) + len(chunk) <= max_chunk_size:
+            current_chunk += chunk
+        else:
+            final_chunks.append(current_chunk)
+            current_chunk = chunk
+    if current_chunk:
+        final_chunks.append(current_chunk)
+    return final_chunks
+
+
+def make_notebook(num_bytes: int) -> str:
+    cells = []
+    size = 0
+    index = 0
+    while size < num_bytes:
+        if index % 1000 == 999:
+            # Occasional huge cells are the worst case for string concatenation.
+            cell = "# %%\n" + HUGE_CELL_LINE * 2000
+        else:
+            cell = CELL.format(index=index)
+        cells.append(cell)
+        size += len(cell)
+        index += 1
+    return "".join(cells)
+
+
+def measure(name: str, split, baseline: float | None = None) -> float:
+    start = time.perf_counter()
+    num_chunks = len(split())
+    elapsed = time.perf_counter() - start
+    # Tracing allocations slows down the splitters, so it gets a separate run.
+    tracemalloc.start()
+    split()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    speedup = f"{baseline / elapsed:6.2f}x" if baseline else ""
+    print(
+        f"  {name:<20} {elapsed * 1000:9.1f} ms {peak / 2**20:8.1f} MiB peak "
+        f"{num_chunks:7} chunks {speedup}"
+    )
+    return elapsed
+
+
+def run_benchmark(megabytes: float, max_chunk_size: int):
+    content = make_notebook(int(megabytes * 2**20))
+    print(f"{len(content) / 2**20:.1f} MiB notebook, max chunk size {max_chunk_size}")
+
+    assert legacy_split_into_chunks(content, max_chunk_size) == split_into_chunks(
+        content, max_chunk_size
+    )
+    baseline = measure(
+        "line-based (old)", lambda: legacy_split_into_chunks(content, max_chunk_size)
+    )
+    measure(
+        "split_into_chunks",
+        lambda: split_into_chunks(content, max_chunk_size),
+        baseline,
+    )
+    measure(
+        "spans over str",
+        lambda: Chunks.split(content, max_chunk_size),
+        baseline,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "notebook.py"
+        path.write_text(content, encoding="utf-8")
+        with mapped_file(path) as mapped:
+            measure(
+                "spans over mmap",
+                lambda: Chunks.split(mapped, max_chunk_size),
+                baseline,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=32)
+    parser.add_argument("--max-chunk-size", type=int, default=8192)
+    args = parser.parse_args()
+    run_benchmark(args.megabytes, args.max_chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,24 +5,63 @@ from pathlib import Path
 import click
 from loguru import logger
 
-from plc.defaults import default_models
+from plc.cassette import CASSETTE_MODES, CassetteProvider
+from plc.context_policy import ContextPolicy
+from plc.defaults import all_models, default_models
+from plc.file_processor import ACK_MODES
+from plc.hedging import HedgingProvider
+from plc.metrics import RunMetrics
+from plc.model import Model
+from plc.model_profile import ModelProfiles
 from plc.open_router_provider import OpenRouterProvider
+from plc.planner import ConversionPlanner
+from plc.rate_limiter import RateLimitedProvider
 from .polyglot_language_converter import PolyglotLanguageConverter
 
 
+LANGUAGES = ["cpp", "csharp", "java", "python", "typescript"]
+
+
+def parse_languages(ctx, param, value: str) -> list[str]:
+    slugs = [slug.strip() for slug in value.split(",") if slug.strip()]
+    invalid = [slug for slug in slugs if slug not in LANGUAGES]
+    if invalid or not slugs:
+        raise click.BadParameter(
+            f"{', '.join(invalid) or repr(value)} is not one of {', '.join(LANGUAGES)}"
+        )
+    return list(dict.fromkeys(slugs))
+
+
+def parse_fallback_models(spec: str | None) -> dict[str, Model]:
+    """Parse `slug=fallback_slug,...` into fallback models by model id."""
+    models_by_slug = {model.slug: model for model in all_models}
+    fallback_models = {}
+    for pair in (spec or "").split(","):
+        if not pair.strip():
+            continue
+        slug, _, fallback_slug = (part.strip() for part in pair.partition("="))
+        if slug not in models_by_slug or fallback_slug not in models_by_slug:
+            raise click.BadParameter(
+                f"Invalid fallback {pair!r}", param_hint="--hedge-fallback"
+            )
+        fallback_models[models_by_slug[slug].id] = models_by_slug[fallback_slug]
+    return fallback_models
+
+
 @click.command()
 @click.option(
     "--from",
     "from_",
     default="java",
-    type=click.Choice(["cpp", "csharp", "java", "python", "typescript"]),
+    type=click.Choice(LANGUAGES),
     help="The source language",
 )
 @click.option(
     "--to",
     default="csharp",
-    type=click.Choice(["cpp", "csharp", "java", "python", "typescript"]),
-    help="The target language",
+    callback=parse_languages,
+    help="The target language, or a comma-separated list of target languages "
+    "that are converted in a single run (e.g., csharp,typescript,cpp)",
 )
 @click.option(
     "--max-files", default=None, type=int, help="Maximum number of files to process"
@@ -63,9 +102,241 @@ from .polyglot_language_converter import PolyglotLanguageConverter
     type=str,
     help="Comma-separated list of model slugs to use (e.g., claude,qwen)",
 )
+@click.option(
+    "--max-connections",
+    default=32,
+    type=int,
+    help="Maximum number of pooled connections to the LLM API host",
+)
+@click.option(
+    "--compress-requests",
+    is_flag=True,
+    help="Send gzip-compressed request bodies",
+)
+@click.option(
+    "--warm-up",
+    default=0,
+    type=int,
+    help="Number of connections to open before the first request",
+)
+@click.option(
+    "--concurrency",
+    default=8,
+    type=int,
+    help="Maximum number of (file, model) jobs processed at the same time",
+)
+@click.option(
+    "--per-model",
+    default=None,
+    type=int,
+    help="Maximum number of concurrent jobs for each model",
+)
+@click.option(
+    "--model-profiles",
+    "model_profiles_path",
+    default=None,
+    type=click.Path(
+        dir_okay=False, file_okay=True, exists=True, resolve_path=True, path_type=Path
+    ),
+    help="TOML file with the context window, output limit, concurrency and "
+    "prices of models, overriding the built-in profiles",
+)
+@click.option(
+    "--prefetch",
+    default=16,
+    type=int,
+    help="Number of files read and split ahead of the LLM requests",
+)
+@click.option(
+    "--requests-per-minute",
+    default=None,
+    type=float,
+    help="Maximum number of requests per minute for each model; without it, "
+    "the limit is learned from the rate at which requests are rate limited",
+)
+@click.option(
+    "--tokens-per-minute",
+    default=None,
+    type=float,
+    help="Maximum number of (estimated) input tokens per minute for each model",
+)
+@click.option(
+    "--max-retries",
+    default=5,
+    type=int,
+    help="Number of retries for rate-limited or failed requests",
+)
+@click.option(
+    "--chunk-retries",
+    default=2,
+    type=int,
+    help="Number of times a chunk is sent again after a transient failure "
+    "(including timeouts and stalled streams) before its file fails",
+)
+@click.option(
+    "--independent-chunks",
+    is_flag=True,
+    help="Convert the chunks of a file concurrently, each with only the prompt, "
+    "the examples and the declarations of earlier chunks instead of the "
+    "conversation so far; for notebooks whose cells are mostly self-contained",
+)
+@click.option(
+    "--chunk-concurrency",
+    default=4,
+    type=int,
+    help="Maximum number of chunks of a file converted at the same time with "
+    "--independent-chunks; every chunk request takes one of the --concurrency "
+    "slots",
+)
+@click.option(
+    "--pack-small-files",
+    is_flag=True,
+    help="Convert small files in packs, one request per pack, and each file on "
+    "its own if the reply for its pack cannot be split",
+)
+@click.option(
+    "--pack-token-budget",
+    default=2000,
+    type=int,
+    help="Maximum (estimated) tokens of the files in a pack",
+)
+@click.option(
+    "--pack-max-file-tokens",
+    default=500,
+    type=int,
+    help="Maximum (estimated) tokens of a file that is packed",
+)
+@click.option(
+    "--cassette",
+    default=None,
+    type=click.Path(dir_okay=False, file_okay=True, resolve_path=True, path_type=Path),
+    help="Path to a cassette for recording and replaying LLM responses",
+)
+@click.option(
+    "--cassette-mode",
+    default="replay",
+    type=click.Choice(CASSETTE_MODES),
+    help="record: always call the LLM; replay: call it only for unrecorded "
+    "requests; strict: never call it and fail on unrecorded requests",
+)
+@click.option(
+    "--cassette-max-mb",
+    default=None,
+    type=float,
+    help="Evict least recently used responses when the cassette exceeds this size",
+)
+@click.option(
+    "--context",
+    "context_spec",
+    default="full",
+    help="History sent with each chunk: 'full', 'last:N' for the last N "
+    "exchanges or 'tokens:N' for a budget of N tokens",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Stream replies and write them to the output file while they arrive",
+)
+@click.option(
+    "--stream-idle-timeout",
+    default=60.0,
+    type=float,
+    help="Seconds without streamed data after which a reply counts as stalled",
+)
+@click.option(
+    "--chunk-tokens",
+    default=None,
+    type=int,
+    help="Size chunks by estimated tokens instead of --max-chunk-size characters",
+)
+@click.option(
+    "--accurate-token-estimates",
+    is_flag=True,
+    help="Use the slower, word-based token estimator for --chunk-tokens",
+)
+@click.option(
+    "--metrics-json",
+    default=None,
+    type=click.Path(dir_okay=False, file_okay=True, resolve_path=True, path_type=Path),
+    help="Write a JSON summary of requests, latencies, tokens and cost to this file",
+)
+@click.option(
+    "--metrics-prom",
+    default=None,
+    type=click.Path(dir_okay=False, file_okay=True, resolve_path=True, path_type=Path),
+    help="Write the metrics in the Prometheus textfile format to this file",
+)
+@click.option(
+    "--metrics-interval",
+    default=None,
+    type=float,
+    help="Also write the metrics every this many seconds during the run",
+)
+@click.option(
+    "--ack",
+    "ack_mode",
+    default=None,
+    type=click.Choice(ACK_MODES),
+    help="request: ask the LLM to acknowledge the prompt for every file; "
+    "synthesize: skip that request; cache: ask once per model and reuse the reply "
+    "[default: cache with --prompt-caching, else request]",
+)
+@click.option(
+    "--prompt-caching",
+    is_flag=True,
+    help="Mark the prompt and conversion examples for provider-side caching",
+)
+@click.option(
+    "--translation-memory",
+    is_flag=True,
+    help="Reuse the conversions of identical chunks across files and runs",
+)
+@click.option(
+    "--hedge-quantile",
+    default=None,
+    type=click.FloatRange(0, 1),
+    help="Send a duplicate of requests that take longer than this quantile of "
+    "the model's recent latencies (e.g., 0.95); the first reply wins",
+)
+@click.option(
+    "--hedge-min-delay",
+    default=10.0,
+    type=float,
+    help="Never hedge requests before they have taken this many seconds",
+)
+@click.option(
+    "--hedge-fallback",
+    default=None,
+    type=str,
+    help="Send the hedges for some models to other models, as comma-separated "
+    "model=fallback slugs (e.g., claude=qwen)",
+)
+@click.option(
+    "--plan",
+    is_flag=True,
+    help="Only estimate the requests, tokens and wall time of the run",
+)
+@click.option(
+    "--plan-output-ratio",
+    default=1.0,
+    type=float,
+    help="Assumed length of a reply relative to its chunk for --plan",
+)
+@click.option(
+    "--plan-request-overhead",
+    default=2.0,
+    type=float,
+    help="Assumed seconds per request before the first token for --plan",
+)
+@click.option(
+    "--plan-tokens-per-second",
+    default=50.0,
+    type=float,
+    help="Assumed output tokens per second of a request for --plan",
+)
 def main(
     from_: str,
-    to: str,
+    to: list[str],
     max_files: int | None,
     reprocess: bool,
     db_path: Path | None,
@@ -73,6 +344,43 @@ def main(
     log_level: str,
     max_chunk_size: int,
     models: str | None,
+    max_connections: int,
+    compress_requests: bool,
+    warm_up: int,
+    concurrency: int,
+    per_model: int | None,
+    model_profiles_path: Path | None,
+    prefetch: int,
+    requests_per_minute: float | None,
+    tokens_per_minute: float | None,
+    max_retries: int,
+    chunk_retries: int,
+    independent_chunks: bool,
+    chunk_concurrency: int,
+    pack_small_files: bool,
+    pack_token_budget: int,
+    pack_max_file_tokens: int,
+    cassette: Path | None,
+    cassette_mode: str,
+    cassette_max_mb: float | None,
+    context_spec: str,
+    stream: bool,
+    stream_idle_timeout: float,
+    chunk_tokens: int | None,
+    accurate_token_estimates: bool,
+    metrics_json: Path | None,
+    metrics_prom: Path | None,
+    metrics_interval: float | None,
+    ack_mode: str | None,
+    prompt_caching: bool,
+    translation_memory: bool,
+    hedge_quantile: float | None,
+    hedge_min_delay: float,
+    hedge_fallback: str | None,
+    plan: bool,
+    plan_output_ratio: float,
+    plan_request_overhead: float,
+    plan_tokens_per_second: float,
 ):
     """Convert slides between programming languages using various AI models."""
 
@@ -86,6 +394,11 @@ def main(
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
 
+    try:
+        context_policy = ContextPolicy.parse(context_spec)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--context")
+
     if db_path is None:
         db_path = Path.cwd() / "processed-files.sqlite3"
     if dir_path is None:
@@ -101,16 +414,98 @@ def main(
     else:
         selected_models = default_models
 
+    if ack_mode is None:
+        # Only a shared acknowledgement keeps the whole prefix the same for
+        # all files, so that the cached prefix matches.
+        ack_mode = "cache" if prompt_caching else "request"
+    elif prompt_caching and ack_mode == "request":
+        logger.warning(
+            "With --ack request the acknowledgement differs between files, so "
+            "only the initial prompt is cached; use --ack cache or synthesize"
+        )
+
+    model_profiles = ModelProfiles()
+    if model_profiles_path is not None:
+        try:
+            model_profiles = ModelProfiles.load(model_profiles_path)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--model-profiles")
+
+    llm_provider = OpenRouterProvider(
+        max_connections_per_host=max_connections,
+        warm_up_connections=warm_up,
+        stream_idle_timeout=stream_idle_timeout,
+        compress_requests=compress_requests,
+    )
+    metrics = RunMetrics(json_path=metrics_json, prometheus_path=metrics_prom)
+    hedging_provider = None
+    if hedge_quantile is not None:
+        # Below the rate limiter, so that only the HTTP requests are timed.
+        llm_provider = hedging_provider = HedgingProvider(
+            llm_provider,
+            quantile=hedge_quantile,
+            min_delay=hedge_min_delay,
+            fallback_models=parse_fallback_models(hedge_fallback),
+            metrics=metrics,
+        )
+    llm_provider = RateLimitedProvider(
+        llm_provider,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        max_retries=max_retries,
+    )
+    if hedging_provider is not None:
+        # Hedges use the budget and see the rate limits of their model.
+        hedging_provider.limiter_for = llm_provider.limiter_for
+    if cassette is not None:
+        llm_provider = CassetteProvider(
+            path=cassette,
+            provider=llm_provider,
+            mode=cassette_mode,
+            max_bytes=int(cassette_max_mb * 2**20) if cassette_max_mb else None,
+        )
+
     converter = PolyglotLanguageConverter(
-        llm_provider=OpenRouterProvider(),
+        llm_provider=llm_provider,
         models=selected_models,
         from_slug=from_,
-        to_slug=to,
+        to_slugs=to,
         max_chunk_size=max_chunk_size,
+        chunk_token_budget=chunk_tokens,
+        accurate_token_estimates=accurate_token_estimates,
         db_path=db_path,
         directory_path=dir_path,
+        concurrency=concurrency,
+        per_model_concurrency=per_model,
+        model_profiles=model_profiles,
+        prefetch_files=prefetch,
+        metrics=metrics,
+        metrics_interval=metrics_interval,
+        ack_mode=ack_mode,
+        prompt_caching=prompt_caching,
+        use_translation_memory=translation_memory,
+        chunk_retries=chunk_retries,
+        independent_chunks=independent_chunks,
+        chunk_concurrency=chunk_concurrency,
+        pack_small_files=pack_small_files,
+        pack_token_budget=pack_token_budget,
+        pack_max_file_tokens=pack_max_file_tokens,
+        context_policy=context_policy,
+        streaming=stream,
     )
 
+    if plan:
+        planner = ConversionPlanner(
+            converter,
+            output_ratio=plan_output_ratio,
+            request_overhead=plan_request_overhead,
+            output_tokens_per_second=plan_tokens_per_second,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+        )
+        print(planner.plan(max_files=max_files, reprocess=reprocess).format())
+        return
+
     loop.run_until_complete(
         converter.process_files(max_files=max_files, reprocess=reprocess)
     )
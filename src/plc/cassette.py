@@ -0,0 +1,250 @@
+import hashlib
+import json
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import Callable
+
+from attrs import asdict, define, evolve, field
+from loguru import logger
+
+from plc.completion import Completion, Usage
+from plc.database import add_missing_columns
+from plc.errors import CassetteMissError
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.model import Model
+
+RECORD = "record"
+REPLAY = "replay"
+STRICT = "strict"
+CASSETTE_MODES = (RECORD, REPLAY, STRICT)
+
+
+def request_key(
+    messages: list[Message], model: Model, max_tokens: int | None = None
+) -> str:
+    """The key of a request; requests without `max_tokens` keep the keys of
+    cassettes recorded before it was part of the key."""
+    request = [model.id, [[m.role, m.content] for m in messages]]
+    if max_tokens is not None:
+        request.append(max_tokens)
+    serialized = json.dumps(request, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+@define
+class CassetteProvider(LlmProvider):
+    """Record the responses of an `LlmProvider` and replay them later.
+
+    - In `record` mode every request is sent and its response stored.
+    - In `replay` mode stored responses are returned; misses are sent and
+      recorded.
+    - In `strict` mode only stored responses are returned and a miss raises
+      `CassetteMissError`; the wrapped provider is never used.
+
+    Responses are stored zlib-compressed in SQLite. If `max_entries` or
+    `max_bytes` is given, the least recently used responses are evicted.
+    Replays only note their use in memory; the notes are written together
+    with the next stored response or when the cassette is closed, so that
+    replaying does not commit to the database for every request."""
+
+    path: Path | str
+    provider: LlmProvider | None = None
+    mode: str = REPLAY
+    max_entries: int | None = None
+    max_bytes: int | None = None
+    hits: int = 0
+    misses: int = 0
+    _conn: sqlite3.Connection | None = field(default=None, init=False, repr=False)
+    _num_entries: int = field(default=0, init=False)
+    _num_bytes: int = field(default=0, init=False)
+    # Logical clock for the LRU order; wall-clock time is too coarse on some
+    # platforms to order requests that are only milliseconds apart.
+    _last_used: int = field(default=0, init=False)
+    # Keys replayed since the last write, with their logical time of use.
+    _touched: dict[str, int] = field(factory=dict, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        if self.mode not in CASSETTE_MODES:
+            raise ValueError(f"Invalid cassette mode: {self.mode}")
+        if self.mode != STRICT and self.provider is None:
+            raise ValueError(f"Cassette mode {self.mode} needs a provider.")
+
+    async def open(self):
+        self.connect()
+        if self.mode != STRICT:
+            await self.provider.open()
+
+    async def close(self):
+        if self._conn is not None:
+            self.write_touches()
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+        if self.mode != STRICT:
+            await self.provider.close()
+        logger.info(
+            f"Cassette {self.path}: {self.hits} hit(s), {self.misses} miss(es)"
+        )
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cassette (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response BLOB,
+                    size INTEGER,
+                    last_used INTEGER,
+                    finish_reason TEXT,
+                    usage TEXT
+                )
+                """
+            )
+            add_missing_columns(
+                self._conn, "cassette", {"finish_reason": "TEXT", "usage": "TEXT"}
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS cassette_last_used "
+                "ON cassette (last_used)"
+            )
+            self._num_entries, self._num_bytes, self._last_used = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(MAX(last_used), 0)"
+                " FROM cassette"
+            ).fetchone()
+        return self._conn
+
+    def tick(self) -> int:
+        self._last_used += 1
+        return self._last_used
+
+    def lookup(self, key: str) -> Completion | None:
+        """The recorded completion for `key`, marked as cached.
+
+        Nothing is paid for a replayed reply, so its usage has no cost."""
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT response, finish_reason, usage FROM cassette WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        self._touched[key] = self.tick()
+        response, finish_reason, usage = row
+        if usage is not None:
+            usage = evolve(Usage(**json.loads(usage)), cost=None)
+        return Completion(
+            zlib.decompress(response).decode("utf-8"),
+            usage=usage,
+            finish_reason=finish_reason,
+            cached=True,
+        )
+
+    def write_touches(self):
+        if self._touched:
+            self.connect().executemany(
+                "UPDATE cassette SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def store(self, key: str, model: Model, completion: Completion):
+        conn = self.connect()
+        # Evicting needs the current order of use.
+        self.write_touches()
+        compressed = zlib.compress(completion.content.encode("utf-8"))
+        usage = None
+        if completion.usage is not None:
+            usage = json.dumps(asdict(completion.usage))
+        old_row = conn.execute(
+            "SELECT size FROM cassette WHERE key = ?", (key,)
+        ).fetchone()
+        if old_row is not None:
+            self._num_entries -= 1
+            self._num_bytes -= old_row[0]
+        conn.execute(
+            "INSERT OR REPLACE INTO cassette "
+            "(key, model, response, size, last_used, finish_reason, usage) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                model.id,
+                compressed,
+                len(compressed),
+                self.tick(),
+                completion.finish_reason,
+                usage,
+            ),
+        )
+        self._num_entries += 1
+        self._num_bytes += len(compressed)
+        self.evict()
+        conn.commit()
+
+    def evict(self):
+        conn = self.connect()
+        evicted = False
+        if self.max_entries is not None and self._num_entries > self.max_entries:
+            evicted = True
+            conn.execute(
+                "DELETE FROM cassette WHERE key NOT IN "
+                "(SELECT key FROM cassette ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+        if self.max_bytes is not None and self._num_bytes > self.max_bytes:
+            evicted = True
+            conn.execute(
+                "DELETE FROM cassette WHERE key IN ("
+                " SELECT key FROM ("
+                "  SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS total"
+                "  FROM cassette"
+                " ) WHERE total > ?"
+                ")",
+                (self.max_bytes,),
+            )
+        if evicted:
+            self._num_entries, self._num_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cassette"
+            ).fetchone()
+            logger.debug(f"Evicted responses from cassette {self.path}")
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        return (await self.complete(messages, model)).content
+
+    async def stream_message(
+        self, messages: list[Message], model: Model, on_delta: Callable[[str], None]
+    ) -> str:
+        return (await self.complete(messages, model, on_delta)).content
+
+    async def complete(
+        self,
+        messages: list[Message],
+        model: Model,
+        on_delta: Callable[[str], None] | None = None,
+        max_tokens: int | None = None,
+    ) -> Completion:
+        key = request_key(messages, model, max_tokens)
+        if self.mode != RECORD:
+            completion = self.lookup(key)
+            if completion is not None:
+                self.hits += 1
+                logger.trace(f"Replaying recorded response for {model.slug}")
+                if on_delta is not None:
+                    on_delta(completion.content)
+                return completion
+        self.misses += 1
+        if self.mode == STRICT:
+            raise CassetteMissError(
+                f"No recorded response for request to {model.slug} (key {key})"
+            )
+        completion = await self.provider.complete(
+            messages, model, on_delta, max_tokens=max_tokens
+        )
+        if completion.model is not None and completion.model != model:
+            # A reply of another model, e.g., a hedge, belongs to its request.
+            key = request_key(messages, completion.model, max_tokens)
+        self.store(key, completion.model or model, completion)
+        return completion
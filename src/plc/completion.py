@@ -0,0 +1,46 @@
+from attrs import frozen
+
+from plc.model import Model
+
+
+@frozen
+class Usage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens that were read from the provider's prompt cache.
+    cached_prompt_tokens: int = 0
+    # Cost in USD, if the provider reports it.
+    cost: float | None = None
+
+    @classmethod
+    def from_json(cls, data: dict | None) -> "Usage | None":
+        """Parse the `usage` block of an OpenAI-style response."""
+        if not data:
+            return None
+        return cls(
+            prompt_tokens=data.get("prompt_tokens", 0),
+            completion_tokens=data.get("completion_tokens", 0),
+            cached_prompt_tokens=(data.get("prompt_tokens_details") or {}).get(
+                "cached_tokens", 0
+            ),
+            cost=data.get("cost"),
+        )
+
+
+@frozen
+class Completion:
+    """A reply of an LLM together with what we know about the request."""
+
+    content: str
+    usage: Usage | None = None
+    finish_reason: str | None = None
+    # Number of failed attempts before the reply was received.
+    retries: int = 0
+    # The reply was replayed from a recording instead of being requested.
+    cached: bool = False
+    # The model that replied if it is not the requested one, e.g., the
+    # fallback model of a hedge.
+    model: Model | None = None
+
+    def model_id(self, requested: Model) -> str:
+        return (self.model or requested).id
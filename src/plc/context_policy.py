@@ -0,0 +1,55 @@
+from attrs import frozen
+
+from plc.message import Message
+from plc.token_estimator import estimate_message_tokens, estimate_tokens
+
+
+@frozen
+class ContextPolicy:
+    """Select the messages of a conversation that are sent to the LLM.
+
+    The first `prefix_length` messages (the initial prompt, its
+    acknowledgement and the conversion examples) and the last message are
+    always sent. Of the exchanges in between, only the most recent
+    `max_exchanges` are sent, and only as many as fit into `max_tokens`
+    (estimated) tokens. Without limits the full history is sent."""
+
+    max_exchanges: int | None = None
+    max_tokens: int | None = None
+
+    @property
+    def is_full_history(self) -> bool:
+        return self.max_exchanges is None and self.max_tokens is None
+
+    def select(self, messages: list[Message], prefix_length: int) -> list[Message]:
+        if self.is_full_history or len(messages) <= prefix_length + 1:
+            return messages
+        prefix = messages[:prefix_length]
+        exchanges = messages[prefix_length:-1]
+        last_message = messages[-1]
+
+        if self.max_exchanges is not None:
+            exchanges = exchanges[max(0, len(exchanges) - 2 * self.max_exchanges) :]
+        if self.max_tokens is not None:
+            budget = self.max_tokens - estimate_message_tokens(prefix + [last_message])
+            start = len(exchanges)
+            while start >= 2:
+                exchange_tokens = estimate_message_tokens(exchanges[start - 2 : start])
+                if exchange_tokens > budget:
+                    break
+                budget -= exchange_tokens
+                start -= 2
+            exchanges = exchanges[start:]
+        return prefix + exchanges + [last_message]
+
+    @classmethod
+    def parse(cls, spec: str) -> "ContextPolicy":
+        """Parse `full`, `last:N` (exchanges) or `tokens:N` (token budget)."""
+        kind, _, value = spec.partition(":")
+        if kind == "full" and not value:
+            return cls()
+        if kind == "last" and value.isdigit():
+            return cls(max_exchanges=int(value))
+        if kind == "tokens" and value.isdigit():
+            return cls(max_tokens=int(value))
+        raise ValueError(f"Invalid context policy: {spec}")
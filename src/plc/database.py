@@ -0,0 +1,301 @@
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from sqlite3 import Connection
+from typing import Collection
+
+from attrs import Factory, define, field
+from loguru import logger
+
+# (file_name, model, from_lang, to_lang)
+FileKey = tuple[str, str, str, str]
+# (model, from_lang, to_lang, source_hash, prompt_hash)
+ContentKey = tuple[str, str, str, str, str]
+# (chunk_hash, model, from_lang, to_lang, prompt_hash)
+TranslationKey = tuple[str, str, str, str, str]
+
+
+def create_tables(conn: Connection):
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS converted_files (
+            file_name TEXT,
+            model TEXT,
+            from_lang TEXT,
+            to_lang TEXT,
+            source_hash TEXT,
+            prompt_hash TEXT,
+            PRIMARY KEY (file_name, model, from_lang, to_lang)
+        )
+        """
+    )
+    add_missing_columns(
+        conn, "converted_files", {"source_hash": "TEXT", "prompt_hash": "TEXT"}
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS converted_files_content ON converted_files "
+        "(source_hash, prompt_hash, model, from_lang, to_lang)"
+    )
+    # Replies for the chunks of files whose conversion has not finished yet.
+    # The acknowledgement of the initial prompt is stored with chunk_index -1.
+    # message_hash is the hash of the user message the reply answers.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chunk_checkpoints (
+            file_name TEXT,
+            model TEXT,
+            from_lang TEXT,
+            to_lang TEXT,
+            chunk_index INTEGER,
+            message_hash TEXT,
+            reply TEXT,
+            PRIMARY KEY (file_name, model, from_lang, to_lang, chunk_index)
+        )
+        """
+    )
+    # Replies for chunks, shared between files; chunk_hash is the hash of the
+    # normalized chunk.
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS translation_memory (
+            chunk_hash TEXT,
+            model TEXT,
+            from_lang TEXT,
+            to_lang TEXT,
+            prompt_hash TEXT,
+            reply TEXT,
+            PRIMARY KEY (chunk_hash, model, from_lang, to_lang, prompt_hash)
+        )
+        """
+    )
+    cursor.close()
+    conn.commit()
+
+
+def add_missing_columns(conn: Connection, table: str, columns: dict[str, str]):
+    """Migrate databases created by older versions by adding new columns."""
+    existing_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns.items():
+        if name not in existing_columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+@define
+class DatabaseWriter:
+    """Execute write statements on a background thread.
+
+    Statements are queued without blocking the caller. The thread executes
+    everything that has been queued while it was busy and commits it in a
+    single transaction, so the number of commits (and fsyncs) drops as the
+    write rate rises. The database is put into WAL mode, which lets the
+    writer commit while other connections read."""
+
+    db_path: Path | str
+    max_batch_size: int = 1000
+    _queue: queue.Queue = field(init=False, factory=queue.Queue)
+    _thread: threading.Thread | None = field(init=False, default=None)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="plc-database-writer", daemon=True
+        )
+        self._thread.start()
+
+    def execute(self, sql: str, parameters: tuple = ()):
+        self._queue.put((sql, parameters))
+
+    def flush(self):
+        """Wait until all queued statements have been committed."""
+        self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode this is still safe against corruption; a power loss may
+        # only lose the last commits.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            while (item := self._queue.get()) is not None:
+                batch = [item]
+                while len(batch) < self.max_batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        # Put the sentinel back for the outer loop.
+                        self._queue.task_done()
+                        self._queue.put(None)
+                        break
+                    batch.append(item)
+                self._write_batch(conn, batch)
+            self._queue.task_done()
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn: Connection, batch: list[tuple[str, tuple]]):
+        try:
+            with conn:
+                for sql, parameters in batch:
+                    conn.execute(sql, parameters)
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(batch)} statement(s): {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+@define
+class ConversionDatabase:
+    """The converted files, chunk checkpoints and translations, held in memory.
+
+    Everything is loaded with a single query per table, so that lookups do
+    not touch the database. Translations are only loaded if `models` and
+    `to_langs` are given, and only for those. Changes update the in-memory
+    state immediately and are written through `writer` if there is one,
+    otherwise directly to `conn`. A read-only database only changes its
+    in-memory state."""
+
+    conn: Connection
+    writer: DatabaseWriter | None = None
+    read_only: bool = False
+    converted_files: dict[FileKey, tuple[str | None, str | None]] = Factory(dict)
+    files_by_content: dict[ContentKey, set[str]] = Factory(dict)
+    checkpoints: dict[FileKey, dict[int, tuple[str, str]]] = Factory(dict)
+    translations: dict[TranslationKey, str] = Factory(dict)
+
+    @classmethod
+    def load(
+        cls,
+        conn: Connection,
+        writer: DatabaseWriter | None = None,
+        read_only: bool = False,
+        models: Collection[str] | None = None,
+        to_langs: Collection[str] | None = None,
+    ):
+        database = cls(conn, writer, read_only=read_only)
+        for *key, source_hash, prompt_hash in conn.execute(
+            "SELECT file_name, model, from_lang, to_lang, source_hash, prompt_hash "
+            "FROM converted_files"
+        ):
+            database._add_converted_file(tuple(key), source_hash, prompt_hash)
+        for *key, index, message_hash, reply in conn.execute(
+            "SELECT file_name, model, from_lang, to_lang, chunk_index, "
+            "message_hash, reply FROM chunk_checkpoints"
+        ):
+            database.checkpoints.setdefault(tuple(key), {})[index] = (
+                message_hash,
+                reply,
+            )
+        if models is not None and to_langs is not None:
+            database._load_translations(list(models), list(to_langs))
+        logger.debug(
+            f"Loaded {len(database.converted_files)} converted file(s), "
+            f"checkpoints for {len(database.checkpoints)} file(s) and "
+            f"{len(database.translations)} translation(s)"
+        )
+        return database
+
+    def _load_translations(self, models: list[str], to_langs: list[str]):
+        if not models or not to_langs:
+            return
+        try:
+            rows = self.conn.execute(
+                "SELECT chunk_hash, model, from_lang, to_lang, prompt_hash, reply "
+                "FROM translation_memory "
+                f"WHERE model IN ({', '.join('?' * len(models))}) "
+                f"AND to_lang IN ({', '.join('?' * len(to_langs))})",
+                (*models, *to_langs),
+            )
+            for *key, reply in rows:
+                self.translations[tuple(key)] = reply
+        except sqlite3.OperationalError:
+            # Read-only databases of older versions have no translation memory.
+            pass
+
+    def converted_file(self, key: FileKey) -> tuple[str | None, str | None] | None:
+        """Return the source and prompt hash of a converted file, if any."""
+        return self.converted_files.get(key)
+
+    def files_with_content(
+        self, key: FileKey, source_hash: str, prompt_hash: str
+    ) -> set[str]:
+        """Return the files converted from the same content as `key`."""
+        _, model, from_lang, to_lang = key
+        return self.files_by_content.get(
+            (model, from_lang, to_lang, source_hash, prompt_hash), set()
+        )
+
+    def note_file_converted(self, key: FileKey, source_hash: str, prompt_hash: str):
+        self._add_converted_file(key, source_hash, prompt_hash)
+        self.execute(
+            "INSERT OR REPLACE INTO converted_files"
+            " (file_name, model, from_lang, to_lang, source_hash, prompt_hash)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, source_hash, prompt_hash),
+        )
+
+    def chunk_checkpoints(self, key: FileKey) -> dict[int, tuple[str, str]]:
+        return dict(self.checkpoints.get(key, {}))
+
+    def save_chunk_checkpoint(
+        self, key: FileKey, index: int, message_hash: str, reply: str
+    ):
+        self.checkpoints.setdefault(key, {})[index] = (message_hash, reply)
+        self.execute(
+            "INSERT OR REPLACE INTO chunk_checkpoints"
+            " (file_name, model, from_lang, to_lang,"
+            " chunk_index, message_hash, reply)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, index, message_hash, reply),
+        )
+
+    def clear_chunk_checkpoints(self, key: FileKey):
+        if self.checkpoints.pop(key, None) is not None:
+            self.execute(
+                "DELETE FROM chunk_checkpoints "
+                "WHERE file_name = ? AND model = ? AND from_lang = ? AND to_lang = ?",
+                key,
+            )
+
+    def translation(self, key: TranslationKey) -> str | None:
+        return self.translations.get(key)
+
+    def save_translation(self, key: TranslationKey, reply: str):
+        self.translations[key] = reply
+        self.execute(
+            "INSERT OR REPLACE INTO translation_memory"
+            " (chunk_hash, model, from_lang, to_lang, prompt_hash, reply)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, reply),
+        )
+
+    def execute(self, sql: str, parameters: tuple):
+        if self.read_only:
+            return
+        if self.writer is not None:
+            self.writer.execute(sql, parameters)
+        else:
+            self.conn.execute(sql, parameters)
+            self.conn.commit()
+
+    def _add_converted_file(
+        self, key: FileKey, source_hash: str | None, prompt_hash: str | None
+    ):
+        file_name, model, from_lang, to_lang = key
+        old_hashes = self.converted_files.get(key)
+        if old_hashes is not None and None not in old_hashes:
+            content_key = (model, from_lang, to_lang, *old_hashes)
+            self.files_by_content.get(content_key, set()).discard(file_name)
+        self.converted_files[key] = (source_hash, prompt_hash)
+        if source_hash is not None and prompt_hash is not None:
+            content_key = (model, from_lang, to_lang, source_hash, prompt_hash)
+            self.files_by_content.setdefault(content_key, set()).add(file_name)
@@ -0,0 +1,48 @@
+import re
+from typing import Sequence
+
+# Modifiers that may precede a declaration in the supported languages.
+_MODIFIERS = (
+    r"(?:(?:public|private|protected|internal|static|abstract|final|sealed|"
+    r"export|default|partial|readonly|async|virtual|override|inline|const)\s+)*"
+)
+_TYPE_DECLARATION = re.compile(
+    rf"^\s*{_MODIFIERS}(?:class|interface|enum|record|struct|namespace|def)\s+"
+    r"\w+[^{;=]*"
+)
+# Statements that look like a return type followed by a call.
+_NOT_A_TYPE = r"(?!(?:return|new|throw|else|case|await|yield|delete|goto)\b)"
+_NOT_A_NAME = r"(?!(?:if|while|for|foreach|switch|catch|using|lock)\b)"
+_FUNCTION_DECLARATION = re.compile(
+    rf"^\s*{_MODIFIERS}(?:function\s+\w+|{_NOT_A_TYPE}[\w<>\[\],.:*&]+"
+    rf"(?:\s+[*&]?|[*&]\s*){_NOT_A_NAME}\w+)\s*\([^;{{]*\)"
+)
+_COMMENT_PREFIXES = ("//", "#", "/*", "*")
+
+
+def extract_declarations(chunk: str) -> list[str]:
+    """The signatures of the types and functions declared in a chunk."""
+    declarations = []
+    for line in chunk.splitlines():
+        if line.lstrip().startswith(_COMMENT_PREFIXES):
+            continue
+        match = _TYPE_DECLARATION.match(line) or _FUNCTION_DECLARATION.match(line)
+        if match:
+            declarations.append(" ".join(match.group().split()).rstrip(":"))
+    return declarations
+
+
+def declaration_summaries(
+    chunks: Sequence[str], max_declarations: int = 40
+) -> list[list[str]]:
+    """For each chunk, the last `max_declarations` declarations of the chunks
+    before it."""
+    summaries = []
+    # Ordered by their last declaration, without duplicates.
+    declared: dict[str, None] = {}
+    for chunk in chunks:
+        summaries.append(list(declared)[-max_declarations:])
+        for declaration in extract_declarations(chunk):
+            declared.pop(declaration, None)
+            declared[declaration] = None
+    return summaries
@@ -235,3 +235,17 @@ default_convert_chunk_prompt = """Convert the following chunk of code from {from
 {chunk}
 
 Reply with only the converted {to_lang} code. Do not add any explanations or comments about the conversion process."""
+
+
+default_declarations_prompt = """The earlier chunks of this notebook are converted separately. They declare the following {from_lang} types and functions, which this chunk may use but should not declare again:
+
+{declarations}
+
+"""
+
+
+default_pack_prompt = """Convert each of the following {count} files from {from_lang} to {to_lang}, following the instructions provided earlier. Every file starts with a line <<<FILE n>>> and ends with a line <<<END FILE n>>>, where n is its number.
+
+{files}
+
+Reply with only the converted {to_lang} files, in the same order and each enclosed in the same two lines as the original file. Do not add any explanations or comments about the conversion process."""
@@ -0,0 +1,75 @@
+import asyncio
+
+import aiohttp
+
+
+class LlmProviderError(RuntimeError):
+    def __init__(
+        self, message: str, status: int | None = None, retry_after: float | None = None
+    ):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        # Set once a provider has retried the request as often as it may, so
+        # that callers do not retry it again.
+        self.retries_exhausted = False
+
+
+class RetryableProviderError(LlmProviderError):
+    """A transient failure, e.g., a server error or an overloaded provider."""
+
+
+class RateLimitError(RetryableProviderError):
+    """The provider rejected the request because a rate limit was exceeded."""
+
+
+RETRYABLE_STATUS_CODES = frozenset({408, 500, 502, 503, 504, 520, 524, 529})
+
+
+def error_for_status(
+    status: int, message: str, retry_after: float | None = None
+) -> LlmProviderError:
+    if status == 429:
+        return RateLimitError(message, status, retry_after)
+    if status in RETRYABLE_STATUS_CODES:
+        return RetryableProviderError(message, status, retry_after)
+    return LlmProviderError(message, status, retry_after)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed request may succeed if it is sent again.
+
+    Retryable provider errors (rate limits, server errors, stalled streams),
+    timeouts and broken connections are transient; all other errors, e.g.,
+    rejected requests or invalid credentials, are permanent."""
+    if isinstance(error, LlmProviderError):
+        return isinstance(error, RetryableProviderError)
+    return isinstance(
+        error,
+        (
+            asyncio.TimeoutError,
+            ConnectionError,
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+        ),
+    )
+
+
+def should_retry_request(error: BaseException) -> bool:
+    """Whether a caller should send a failed request again: it is retryable
+    and no provider has already used up its retries on it."""
+    if isinstance(error, LlmProviderError) and error.retries_exhausted:
+        return False
+    return is_retryable(error)
+
+
+class TruncatedReplyError(LlmProviderError):
+    """The reply was cut off at the output limit of the model."""
+
+
+class CassetteMissError(LlmProviderError):
+    """A strict replay found no recorded response for a request."""
+
+
+class StreamStalledError(RetryableProviderError):
+    """A streamed reply stopped making progress."""
@@ -0,0 +1,64 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+from attrs import define, field
+
+
+@define
+class FairSlots:
+    """A semaphore whose released slots go to the waiting model with the
+    fewest running jobs.
+
+    A plain semaphore hands slots to its waiters in order, so a model with
+    long jobs and a deep backlog ends up holding most of the slots; here
+    every model that waits gets its share of the slots."""
+
+    slots: int
+    _free: int = field(init=False)
+    _running: dict[str, int] = field(factory=dict, init=False)
+    _waiters: dict[str, deque[asyncio.Future]] = field(factory=dict, init=False)
+
+    def __attrs_post_init__(self):
+        self._free = self.slots
+
+    def running(self, key: str) -> int:
+        return self._running.get(key, 0)
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    async def acquire(self, key: str):
+        if self._free > 0 and not any(self._waiters.values()):
+            self._free -= 1
+            self._running[key] = self.running(key) + 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just before we were cancelled.
+                self.release(key)
+            else:
+                self._waiters[key].remove(future)
+            raise
+
+    def release(self, key: str):
+        self._running[key] -= 1
+        self._free += 1
+        while self._free > 0:
+            waiting = [k for k, futures in self._waiters.items() if futures]
+            if not waiting:
+                return
+            key = min(waiting, key=self.running)
+            future = self._waiters[key].popleft()
+            self._free -= 1
+            self._running[key] = self.running(key) + 1
+            future.set_result(None)
@@ -0,0 +1,179 @@
+import re
+from typing import Callable
+
+from attrs import define, evolve, field
+from loguru import logger
+
+from plc.defaults import default_pack_prompt
+from plc.file_processor import FileProcessor
+from plc.message import Message
+from plc.model import Model
+from plc.scheduler import ConversionJob
+
+_PACKED_FILE_PATTERN = re.compile(
+    r"^<<<FILE (\d+)>>>\n(.*?)\n?<<<END FILE \1>>>$", re.MULTILINE | re.DOTALL
+)
+
+
+def pack_files(contents: list[str]) -> str:
+    return "\n\n".join(
+        f"<<<FILE {number}>>>\n{content.strip(chr(10))}\n<<<END FILE {number}>>>"
+        for number, content in enumerate(contents, 1)
+    )
+
+
+def restore_trailing_newline(converted: str, source: str) -> str:
+    """Packing drops the trailing newline of a file; give it back, so that
+    the output of a packed file matches that of a file converted alone."""
+    if source.endswith("\n") and not converted.endswith("\n"):
+        return converted + "\n"
+    return converted
+
+
+def unpack_files(reply: str, count: int) -> list[str] | None:
+    """Split a reply into the `count` files it should contain; `None` unless
+    it contains each of them exactly once, in order and not empty."""
+    matches = _PACKED_FILE_PATTERN.findall(reply)
+    if [int(number) for number, _ in matches] != list(range(1, count + 1)):
+        return None
+    files = [content for _, content in matches]
+    if any(not content.strip() for content in files):
+        return None
+    return files
+
+
+@define
+class FilePack:
+    """Small files that are converted into the same target by the same model
+    in a single request.
+
+    The conversation of the first processor carries the request, so the
+    initial prompt, its acknowledgement and the examples are sent once for
+    all files. If the request fails or its reply cannot be split into the
+    files, every file is converted on its own."""
+
+    processors: list[FileProcessor]
+
+    @property
+    def lead(self) -> FileProcessor:
+        return self.processors[0]
+
+    def build_pack_message(self, processors: list[FileProcessor]) -> Message:
+        lead = self.lead
+        return Message(
+            role="user",
+            content=default_pack_prompt.format(
+                count=len(processors),
+                from_lang=lead.from_lang,
+                to_lang=lead.to_lang,
+                files=pack_files([p.file_content for p in processors]),
+            ),
+        )
+
+    async def process(self):
+        # `pack_jobs` drops processed files before packing; this only catches
+        # packs that were built without that check.
+        processors = [
+            p
+            for p in self.processors
+            if p.reprocess or not p.has_file_been_processed()
+        ]
+        skipped = len(self.processors) - len(processors)
+        if skipped:
+            logger.info(
+                f"Skipping {skipped} packed file(s) for model "
+                f"{self.lead.model.id} (already processed)"
+            )
+        if len(processors) > 1 and await self.convert_packed(processors):
+            return
+        for processor in processors:
+            await processor.process()
+
+    async def convert_packed(self, processors: list[FileProcessor]) -> bool:
+        """Convert the files in one request; false if that did not work."""
+        lead = processors[0]
+        names = ", ".join(p.file_path.name for p in processors)
+        logger.info(
+            f"Processing {len(processors)} packed files ({names}) with model "
+            f"{lead.model.slug}"
+        )
+        lead.messages = lead.build_initial_message()
+        try:
+            await lead.acknowledge_initial_prompt()
+            lead.add_conversion_example_messages()
+            lead.prefix_length = len(lead.messages)
+            lead.messages.append(self.build_pack_message(processors))
+            reply = await lead.send_messages_with_retries(chunk_index=0)
+        except Exception as e:
+            logger.warning(
+                f"Packed request for {names} to {lead.model.slug} failed ({e}); "
+                f"converting the files separately"
+            )
+            return False
+        files = unpack_files(reply, len(processors))
+        if files is None:
+            logger.warning(
+                f"Reply of {lead.model.slug} for {names} could not be split into "
+                f"the packed files; converting them separately"
+            )
+            return False
+        for processor, converted_file in zip(processors, files):
+            converted_file = restore_trailing_newline(
+                processor.clean_chunk(converted_file), processor.file_content
+            )
+            processor.write_converted_chunks_to_file([converted_file])
+            processor.note_file_processed()
+        return True
+
+
+@define
+class FilePacker:
+    """Group the jobs for small files into packs.
+
+    Jobs whose prepared file is a single chunk of at most `max_file_tokens`
+    (estimated) tokens are collected per model and target until their total
+    would exceed `token_budget(model)`; other jobs are passed on at once."""
+
+    token_budget: Callable[[Model], int]
+    max_file_tokens: int = 500
+    # The collected jobs and their tokens by (model, target).
+    _pending: dict[tuple[str, str | None], list[ConversionJob]] = field(
+        factory=dict, init=False
+    )
+    _pending_tokens: dict[tuple[str, str | None], int] = field(
+        factory=dict, init=False
+    )
+
+    def add(self, job: ConversionJob) -> list[ConversionJob]:
+        """The jobs that are ready to run after adding `job`."""
+        processor = job.processor
+        budget = self.token_budget(job.model)
+        tokens = self.file_tokens(processor)
+        if tokens is None or tokens > min(self.max_file_tokens, budget):
+            return [job]
+        key = (job.model.id, job.to_slug)
+        ready = []
+        if key in self._pending and self._pending_tokens[key] + tokens > budget:
+            ready.append(self.pack_job(self._pending.pop(key)))
+            del self._pending_tokens[key]
+        self._pending.setdefault(key, []).append(job)
+        self._pending_tokens[key] = self._pending_tokens.get(key, 0) + tokens
+        return ready
+
+    def flush(self) -> list[ConversionJob]:
+        ready = [self.pack_job(jobs) for jobs in self._pending.values()]
+        self._pending.clear()
+        self._pending_tokens.clear()
+        return ready
+
+    @staticmethod
+    def file_tokens(processor: FileProcessor | None) -> int | None:
+        if processor is None or processor.chunks is None:
+            return None
+        if len(processor.chunks) != 1:
+            return None
+        return processor.token_estimator(processor.file_content)
+
+    @staticmethod
+    def pack_job(jobs: list[ConversionJob]) -> ConversionJob:
+        return evolve(jobs[0], pack=tuple(job.processor for job in jobs[1:]))
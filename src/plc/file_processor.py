@@ -1,20 +1,53 @@
+import asyncio
+import os
 import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 from sqlite3 import Connection
-from typing import List
+from typing import Callable, List, Sequence, TextIO
 
-from attrs import Factory, define
+from attrs import Factory, define, evolve, field
 from loguru import logger
 
+from plc.completion import Completion
+from plc.context_policy import ContextPolicy
+from plc.database import ConversionDatabase
+from plc.declarations import declaration_summaries
 from plc.defaults import (
     default_convert_chunk_prompt,
+    default_declarations_prompt,
     get_initial_prompt,
 )
-from plc.file_utils import split_into_chunks
+from plc.errors import (
+    RetryableProviderError,
+    TruncatedReplyError,
+    should_retry_request,
+)
+from plc.fair_slots import FairSlots
+from plc.file_utils import Chunks, content_hash
 from plc.llm_provider import LlmProvider
 from plc.message import Message
+from plc.metrics import RequestRecord, RunMetrics
 from plc.model import Model
+from plc.model_profile import ModelProfile
 from plc.prog_lang_spec import prog_lang_conversions, prog_lang_specs
+from plc.rate_limiter import backoff_delay
+from plc.token_estimator import TokenEstimator, estimator_for_model
+from plc.translation_memory import TranslationKey, TranslationMemory, chunk_hash
+
+# How the acknowledgement of the initial prompt is obtained: "request" asks
+# the LLM for every file, "synthesize" makes one up without a request and
+# "cache" asks once per model and language pair and reuses the reply.
+ACK_MODES = ("request", "synthesize", "cache")
+SYNTHETIC_ACKNOWLEDGEMENT = "I understand!"
+# Truncated replies lower the chunk size limit of a model to no less than this
+# fraction of its configured limit.
+TRUNCATION_CHUNK_SIZE_FLOOR = 1 / 16
+
+# (model, from_lang, to_lang, hash of the initial prompt)
+AckKey = tuple[str, str, str, str]
 
 
 @define
@@ -25,12 +58,62 @@ class FileProcessor:
     from_slug: str
     to_slug: str
     conn: Connection
+    # The in-memory view of `conn`; loaded on first use if not given.
+    database: ConversionDatabase | None = field(default=None, repr=False)
     max_chunk_size: int = 4096
+    # If set, chunks are sized by estimated tokens instead of characters.
+    chunk_token_budget: int | None = None
+    accurate_token_estimates: bool = False
     initial_prompt: str = ""
     convert_chunk_prompt: str = default_convert_chunk_prompt
     reprocess: bool = False
+    context_policy: ContextPolicy = Factory(ContextPolicy)
     messages: list[Message] = Factory(list)
+    # Number of leading messages (prompt, acknowledgement, examples) that are
+    # sent with every request, regardless of the context policy.
+    prefix_length: int = 0
     converted_chunks: list[str] = Factory(list)
+    source_hash: str | None = None
+    # The content and chunks of the file are read by `prepare()`, either in
+    # advance or when the file is processed.
+    file_content: str | None = field(default=None, repr=False)
+    chunks: Chunks | None = field(default=None, repr=False)
+    # In streaming mode replies are written to a partial output file while
+    # they arrive; it is renamed to the output file once the file is done.
+    streaming: bool = False
+    metrics: RunMetrics | None = None
+    ack_mode: str = "request"
+    # Acknowledgements shared between the processors of a run in "cache" mode.
+    ack_cache: dict[AckKey, asyncio.Future] = field(factory=dict, repr=False)
+    # Mark the constant prefix of the conversation for provider-side caching.
+    prompt_caching: bool = False
+    translation_memory: TranslationMemory | None = field(default=None, repr=False)
+    # Transient failures of a request are retried this many times, with
+    # exponential backoff, before the conversion of the file fails.
+    chunk_retries: int = 2
+    chunk_retry_delay: float = 1.0
+    chunk_retry_max_delay: float = 30.0
+    # Chunk size limits per model (by id), learned from truncated replies and
+    # shared between the processors of a run.
+    chunk_size_limits: dict[str, int] = field(factory=dict, repr=False)
+    # The limits and prices of the model; if set, they bound the chunk size
+    # and the `max_tokens` of requests, and price requests without a cost.
+    profile: ModelProfile | None = None
+    # Convert up to `chunk_concurrency` chunks at the same time, each sent
+    # with the prefix and the declarations of the chunks before it instead
+    # of the conversation so far.
+    independent_chunks: bool = False
+    chunk_concurrency: int = 4
+    # The global slots of the scheduler. The job of this processor holds one
+    # of them; independent chunks that are converted at the same time take
+    # a further slot for each additional request.
+    request_slots: FairSlots | None = field(default=None, repr=False)
+    # The model that sent the last reply; another one if a hedge won.
+    last_reply_model_id: str | None = field(default=None, init=False, repr=False)
+    _partial_output: TextIO | None = field(default=None, init=False, repr=False)
+    _partial_chunk_start: int = field(default=0, init=False, repr=False)
+    # The position before the separator of the current chunk.
+    _partial_chunk_begin: int = field(default=0, init=False, repr=False)
 
     def __attrs_post_init__(self):
         if not self.initial_prompt:
@@ -52,7 +135,46 @@ class FileProcessor:
     def to_lang(self) -> str:
         return prog_lang_specs[self.to_slug].name
 
+    @property
+    def prompt_hash(self) -> str:
+        return content_hash(
+            "\0".join(
+                [
+                    self.initial_prompt,
+                    self.convert_chunk_prompt,
+                    prog_lang_conversions[self.from_slug],
+                    prog_lang_conversions[self.to_slug],
+                ]
+            )
+        )
+
+    def get_source_hash(self) -> str:
+        if self.source_hash is None:
+            self.source_hash = content_hash(
+                self.file_path.read_text(encoding="utf-8")
+            )
+        return self.source_hash
+
+    def prepare(self, file_content: str | None = None):
+        """Read and split the file.
+
+        This blocks on file I/O and may take a while for large files, so it
+        should be run in a worker thread."""
+        if file_content is None:
+            with self.file_path.open("r", encoding="utf-8") as f:
+                file_content = f.read()
+        self.file_content = file_content
+        self.source_hash = content_hash(file_content)
+        self.chunks = self.split_into_chunks(file_content)
+
     async def process(self):
+        if self.chunks is None:
+            await asyncio.to_thread(self.prepare)
+        file_content, chunks = self.file_content, self.chunks
+        # Prepared content is only used once; processing the file again reads
+        # its current content.
+        self.file_content = self.chunks = None
+
         if self.has_file_been_processed() and not self.reprocess:
             logger.info(
                 f"Skipping {self.file_path} for model {self.model.id} "
@@ -60,49 +182,301 @@ class FileProcessor:
             )
             return
 
-        with self.file_path.open("r", encoding="utf-8") as f:
-            file_content = f.read()
         logger.info(
             f"File content: {file_content[:240]}... ({len(file_content)} "
             f"characters)"
         )
 
-        chunks = split_into_chunks(file_content, max_chunk_size=self.max_chunk_size)
-        converted_chunks = await self.convert_chunks(chunks)
+        with self.open_partial_output():
+            converted_chunks = await self.convert_chunks(chunks)
 
-        if len(converted_chunks) == len(chunks):
-            self.write_converted_chunks_to_file(converted_chunks)
+        if converted_chunks is not None:
+            if self.streaming:
+                os.replace(self.partial_output_path, self.output_file_path)
+            else:
+                self.write_converted_chunks_to_file(converted_chunks)
             self.note_file_processed()
+            self.clear_chunk_checkpoints()
         else:
+            self.partial_output_path.unlink(missing_ok=True)
             logger.info(
                 f"Conversion incomplete for {self.file_path.name} with "
                 f"model {self.model.id}"
             )
 
-    async def convert_chunks(self, chunks: list[str]) -> list[str]:
+    @property
+    def token_estimator(self) -> TokenEstimator:
+        return estimator_for_model(self.model, self.accurate_token_estimates)
+
+    def split_into_chunks(self, content: str) -> Chunks:
+        """Split the content into chunks whose text is extracted when sent."""
+        return Chunks.split(content, self.max_chunk_size_for_model, self.chunk_size)
+
+    async def convert_chunks(self, chunks: Sequence[str]) -> list[str] | None:
+        """Convert the chunks; `None` if the conversion failed."""
         converted_chunks: list[str] = []
         self.messages = self.build_initial_message()
+        self.prefix_length = 0
+        checkpoints = self.load_chunk_checkpoints()
 
         try:
             # The first message should just be an acknowledgement that the LLM has
             # understood the task
-            ack_message = await self.send_messages_to_llm()
+            ack_message = self.resume_from_checkpoint(checkpoints, -1)
+            if ack_message is None:
+                checkpoints.clear()
+                ack_message = await self.acknowledge_initial_prompt()
+                self.save_chunk_checkpoint(-1)
             logger.trace(f"{self.model.slug} replied with {ack_message[:240]}...")
             self.add_conversion_example_messages()
+            self.prefix_length = len(self.messages)
+            if self.prompt_caching:
+                self.mark_prefix_for_caching()
+            if self.independent_chunks:
+                return await self.convert_independent_chunks(chunks, checkpoints)
 
-            for index, chunk in enumerate(chunks):
+            # Chunks that were split because they were too large for the model
+            # come before the remaining chunks of the file.
+            split_chunks: deque[str] = deque()
+            next_chunk = index = 0
+            while split_chunks or next_chunk < len(chunks):
+                if split_chunks:
+                    chunk = split_chunks.popleft()
+                else:
+                    chunk = chunks[next_chunk]
+                    next_chunk += 1
+                if self.chunk_size(chunk) > self.max_chunk_size_for_model:
+                    pieces = self.split_chunk(chunk)
+                    if len(pieces) > 1:
+                        split_chunks.extendleft(reversed(pieces))
+                        continue
+                self.messages.append(self.build_chunk_message(chunk))
+                self.begin_partial_chunk(index)
+                reply = self.resume_from_checkpoint(checkpoints, index)
+                if reply is not None:
+                    logger.info(
+                        f"Resuming chunk {index + 1} of file {self.file_path.name} "
+                        f"with model {self.model.slug} from checkpoint"
+                    )
+                    converted_chunks.append(self.clean_chunk(reply))
+                    self.write_partial_chunk(converted_chunks[-1])
+                    index += 1
+                    continue
+                # Checkpoints after a missing or outdated one are invalid, since
+                # their replies were based on a different conversation.
+                checkpoints.clear()
                 logger.info(
                     f"Processing chunk {index + 1} of file {self.file_path.name} "
                     f"with model {self.model.slug}"
                 )
-                converted_chunk: str = await self.convert_chunk(chunk, index)
+                # If the chunk fails, later chunks would be sent with a broken
+                # conversation; the checkpoints let the next run continue here.
+                try:
+                    converted_chunk = await self.convert_chunk_from_memory(
+                        chunk, index
+                    )
+                except TruncatedReplyError:
+                    self.messages.pop()
+                    self.discard_partial_chunk()
+                    split_chunks.extendleft(reversed(self.split_truncated_chunk(chunk)))
+                    continue
                 converted_chunks.append(converted_chunk)
+                self.write_partial_chunk(converted_chunk)
+                index += 1
             return converted_chunks
         except Exception as e:
             logger.warning(
                 f"Failed while converting chunks with model {self.model.slug}: {e}"
             )
-            return []
+            return None
+
+    async def convert_independent_chunks(
+        self, chunks: Sequence[str], checkpoints: dict[int, tuple[str, str]]
+    ) -> list[str]:
+        """Convert the chunks concurrently, each in a conversation of its own,
+        and write them to the partial output in order."""
+        chunks = [
+            piece
+            for chunk in chunks
+            for piece in (
+                self.split_chunk(chunk)
+                if self.chunk_size(chunk) > self.max_chunk_size_for_model
+                else [chunk]
+            )
+        ]
+        prefix = self.messages[: self.prefix_length]
+        summaries = declaration_summaries(chunks)
+        slots = asyncio.Semaphore(max(1, self.chunk_concurrency))
+        job_slot = asyncio.Lock()
+
+        async def convert(index: int) -> str:
+            async with slots, self.request_slot(job_slot):
+                return await self.convert_independent_chunk(
+                    prefix, summaries[index], chunks[index], index, checkpoints
+                )
+
+        tasks = [asyncio.ensure_future(convert(i)) for i in range(len(chunks))]
+        try:
+            converted_chunks = list(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+        for index, converted_chunk in enumerate(converted_chunks):
+            self.begin_partial_chunk(index)
+            self.write_partial_chunk(converted_chunk)
+        return converted_chunks
+
+    @asynccontextmanager
+    async def request_slot(self, job_slot: asyncio.Lock):
+        """Use the slot of the job if it is free, else one of the scheduler's
+        slots, so that the global concurrency also bounds chunk requests."""
+        if self.request_slots is None:
+            yield
+        elif not job_slot.locked():
+            async with job_slot:
+                yield
+        else:
+            async with self.request_slots.slot(self.model.id):
+                yield
+
+    async def convert_independent_chunk(
+        self,
+        prefix: list[Message],
+        declarations: list[str],
+        chunk: str,
+        index: int,
+        checkpoints: dict[int, tuple[str, str]],
+    ) -> str:
+        # A processor for the conversation of the chunk, which shares the
+        # database, metrics and caches of this one.
+        processor = evolve(
+            self,
+            messages=[*prefix, self.build_chunk_message(chunk, declarations)],
+            prefix_length=len(prefix),
+            streaming=False,
+        )
+        reply = processor.resume_from_checkpoint(checkpoints, index)
+        if reply is not None:
+            logger.info(
+                f"Resuming chunk {index + 1} of file {self.file_path.name} "
+                f"with model {self.model.slug} from checkpoint"
+            )
+            return self.clean_chunk(reply)
+        logger.info(
+            f"Processing chunk {index + 1} of file {self.file_path.name} "
+            f"independently with model {self.model.slug}"
+        )
+        try:
+            return await processor.convert_chunk_from_memory(chunk, index)
+        except TruncatedReplyError:
+            # The pieces share the index of the chunk, so they are not resumed
+            # from checkpoints.
+            converted_pieces = [
+                await self.convert_independent_chunk(
+                    prefix, declarations, piece, index, {}
+                )
+                for piece in self.split_truncated_chunk(chunk)
+            ]
+            return "\n".join(converted_pieces)
+
+    @property
+    def max_chunk_size_for_model(self) -> int:
+        """The chunk size limit, lowered to what the profile of the model
+        allows and if replies of the model were cut off at its output limit
+        during this run."""
+        limit = self.configured_chunk_size_limit
+        return min(limit, self.chunk_size_limits.get(self.model.id, limit))
+
+    @property
+    def configured_chunk_size_limit(self) -> int:
+        if self.chunk_token_budget is None:
+            limit = self.max_chunk_size
+        else:
+            limit = self.chunk_token_budget
+        if self.profile is not None:
+            limit = min(limit, self.profile_chunk_limit)
+        return limit
+
+    @property
+    def profile_chunk_limit(self) -> int:
+        """The largest chunk the profile allows, in the unit of `chunk_size`."""
+        tokens = self.profile.max_chunk_tokens
+        if self.chunk_token_budget is not None:
+            return tokens
+        return int(tokens * self.token_estimator.chars_per_token)
+
+    @property
+    def chunk_size(self) -> Callable[[str], int]:
+        return len if self.chunk_token_budget is None else self.token_estimator
+
+    def split_chunk(self, chunk: str) -> list[str]:
+        """Split a chunk at cell boundaries into chunks of the current limit."""
+        return list(
+            Chunks.split(chunk, self.max_chunk_size_for_model, self.chunk_size)
+        )
+
+    def split_truncated_chunk(self, chunk: str) -> list[str]:
+        """Split a chunk whose reply was truncated into halves and lower the
+        chunk size limit of the model for the rest of the run accordingly.
+
+        The limit is only lowered if the chunk can be split, and never below
+        `TRUNCATION_CHUNK_SIZE_FLOOR` of the configured limit, so that a few
+        long cells do not shrink the chunks of every later file."""
+        size = self.chunk_size(chunk)
+        floor = max(
+            1, int(self.configured_chunk_size_limit * TRUNCATION_CHUNK_SIZE_FLOOR)
+        )
+        limit = max(floor, min(size // 2, self.max_chunk_size_for_model))
+        pieces = list(Chunks.split(chunk, limit, self.chunk_size))
+        if len(pieces) < 2:
+            raise TruncatedReplyError(
+                f"The reply of {self.model.slug} for a single cell of "
+                f"{self.file_path.name} exceeds its output limit"
+            )
+        self.chunk_size_limits[self.model.id] = min(
+            limit, self.chunk_size_limits.get(self.model.id, limit)
+        )
+        logger.info(
+            f"Reply of {self.model.slug} for a chunk of {self.file_path.name} was "
+            f"truncated; splitting it into {len(pieces)} chunks and limiting "
+            f"chunks to {limit} for the rest of the run"
+        )
+        return pieces
+
+    async def acknowledge_initial_prompt(self) -> str:
+        """Append the acknowledgement of the initial prompt, see `ACK_MODES`."""
+        if self.ack_mode == "synthesize":
+            self.messages.append(
+                Message(role="assistant", content=SYNTHETIC_ACKNOWLEDGEMENT)
+            )
+            return SYNTHETIC_ACKNOWLEDGEMENT
+        if self.ack_mode != "cache":
+            return await self.send_messages_with_retries()
+
+        key = (
+            self.model.id,
+            self.from_slug,
+            self.to_slug,
+            content_hash(self.initial_prompt),
+        )
+        future = self.ack_cache.get(key)
+        if future is None:
+            # Processors that start while the request is running wait for it.
+            future = asyncio.get_running_loop().create_future()
+            self.ack_cache[key] = future
+            ack_message = None
+            try:
+                ack_message = await self.send_messages_with_retries()
+            finally:
+                if ack_message is None:
+                    del self.ack_cache[key]
+                future.set_result(ack_message)
+            return ack_message
+        ack_message = await asyncio.shield(future)
+        if ack_message is None:
+            return await self.acknowledge_initial_prompt()
+        self.messages.append(Message(role="assistant", content=ack_message))
+        return ack_message
 
     def build_initial_message(self):
         content = self.initial_prompt
@@ -114,6 +488,15 @@ class FileProcessor:
             ),
         ]
 
+    def mark_prefix_for_caching(self):
+        """Mark the initial prompt, which is the same for all files, and the
+        end of the prefix, which is only the same for all files if the
+        acknowledgement is (see `ACK_MODES`)."""
+        self.messages[0] = evolve(self.messages[0], cache=True)
+        self.messages[self.prefix_length - 1] = evolve(
+            self.messages[self.prefix_length - 1], cache=True
+        )
+
     @logger.catch
     def add_conversion_example_messages(self):
         logger.trace(
@@ -143,39 +526,79 @@ class FileProcessor:
             f"Message 1: {message1_content}, Message 2: {message2_content}"
         )
 
-    @logger.catch
+    def build_chunk_message(
+        self, chunk: str, declarations: Sequence[str] = ()
+    ) -> Message:
+        content = self.convert_chunk_prompt.format(
+            chunk=chunk, from_lang=self.from_lang, to_lang=self.to_lang
+        )
+        if declarations:
+            content = (
+                default_declarations_prompt.format(
+                    from_lang=self.from_lang, declarations="\n".join(declarations)
+                )
+                + content
+            )
+        return Message(role="user", content=content)
+
     async def convert_chunk(self, chunk, index) -> str:
+        new_message_content = self.messages[-1].content or "I understand!"
+        logger.trace(
+            f"Added message to {self.model.slug}: {new_message_content[:240]}..."
+        )
         try:
-            new_message = Message(
-                role="user",
-                content=self.convert_chunk_prompt.format(
-                    chunk=chunk, from_lang=self.from_lang, to_lang=self.to_lang
-                ),
+            converted_chunk = await self.send_messages_with_retries(
+                on_delta=self.write_partial_delta if self.streaming else None,
+                chunk_index=index,
             )
-            self.messages.append(new_message)
-            new_message_content = new_message.content or "I understand!"
-            logger.trace(
-                f"Added message to {self.model.slug}: "
-                f"{new_message_content[:240]}..."
-            )
-            converted_chunk = await self.send_messages_to_llm()
-            if converted_chunk is None:
-                logger.warning(f"Converted chunk from {self.model.slug} is None!")
-            else:
-                logger.trace(
-                    f"Converted chunk from {self.model.slug}: "
-                    f"{converted_chunk[:240]}..."
-                )
-            converted_chunk = self.clean_chunk(converted_chunk)
-
         except Exception as e:
             logger.info(
                 f"Failed to convert chunk {index + 1} of file {self.file_path.name} "
                 f"with model {self.model.slug}: {str(e)}"
             )
             raise
+        logger.trace(
+            f"Converted chunk from {self.model.slug}: {converted_chunk[:240]}..."
+        )
+        self.save_chunk_checkpoint(index)
+        return self.clean_chunk(converted_chunk)
+
+    async def convert_chunk_from_memory(self, chunk: str, index: int) -> str | None:
+        """Convert a chunk, reusing the reply for an identical chunk if the
+        translation memory has one."""
+        if self.translation_memory is None:
+            return await self.convert_chunk(chunk, index)
+        key = self.translation_key(chunk)
+        reply = await self.translation_memory.lookup(key)
+        if reply is not None:
+            logger.debug(
+                f"Reusing translation of chunk {index + 1} of {self.file_path.name} "
+                f"for model {self.model.slug}"
+            )
+            self.messages.append(Message(role="assistant", content=reply))
+            self.save_chunk_checkpoint(index)
+            return self.clean_chunk(reply)
+        converted_chunk = None
+        self.last_reply_model_id = self.model.id
+        try:
+            converted_chunk = await self.convert_chunk(chunk, index)
+        finally:
+            self.translation_memory.finish(
+                key,
+                self.messages[-1].content if converted_chunk is not None else None,
+                model_id=self.last_reply_model_id,
+            )
         return converted_chunk
 
+    def translation_key(self, chunk: str) -> TranslationKey:
+        return (
+            chunk_hash(chunk),
+            self.model.id,
+            self.from_slug,
+            self.to_slug,
+            self.prompt_hash,
+        )
+
     def clean_chunk(self, chunk: str) -> str:
         if chunk is None:
             raise ValueError(f"Trying to clean invalid chunk from {self.model.slug}.")
@@ -189,13 +612,54 @@ class FileProcessor:
             return result
         return chunk
 
-    @logger.catch
-    async def send_messages_to_llm(self):
-        converted_chunk = await self.llm_provider.send_message(
-            self.messages, self.model
-        )
+    async def send_messages_with_retries(
+        self, on_delta: Callable[[str], None] = None, chunk_index: int = -1
+    ) -> str:
+        """Send the conversation, retrying transient failures with backoff.
+
+        Requests are retried only if `should_retry_request()` classifies
+        their error as transient and not yet retried by the provider, e.g.,
+        by a `RateLimitedProvider`; other errors and the last failure are
+        raised."""
+        for attempt in range(self.chunk_retries + 1):
+            try:
+                return await self.send_messages_to_llm(on_delta, chunk_index)
+            except Exception as e:
+                if attempt >= self.chunk_retries or not should_retry_request(e):
+                    raise
+                delay = backoff_delay(
+                    attempt, self.chunk_retry_delay, self.chunk_retry_max_delay
+                )
+                logger.info(
+                    f"Request for chunk {chunk_index + 1} of {self.file_path.name} "
+                    f"to {self.model.slug} failed ({e}); retrying in {delay:.1f}s "
+                    f"(attempt {attempt + 1} of {self.chunk_retries})"
+                )
+                # The next attempt streams its reply from the start again.
+                self.restart_partial_chunk()
+                await asyncio.sleep(delay)
+
+    async def send_messages_to_llm(
+        self, on_delta: Callable[[str], None] = None, chunk_index: int = -1
+    ):
+        messages = self.context_policy.select(self.messages, self.prefix_length)
+        start = time.perf_counter()
+        try:
+            completion = await self.llm_provider.complete(
+                messages, self.model, on_delta, max_tokens=self.max_reply_tokens()
+            )
+        except Exception:
+            self.record_request(messages, chunk_index, start, None)
+            raise
+        self.record_request(messages, chunk_index, start, completion)
+        self.last_reply_model_id = completion.model_id(self.model)
+        converted_chunk = completion.content
         if converted_chunk is None:
-            raise ValueError(f"{self.model.slug} returned None as converted chunk.")
+            raise RetryableProviderError(f"{self.model.slug} returned no reply.")
+        if completion.finish_reason == "length":
+            raise TruncatedReplyError(
+                f"The reply of {self.model.slug} was cut off at its output limit."
+            )
         reply_message = Message(role="assistant", content=converted_chunk)
         self.messages.append(reply_message)
         logger.trace(
@@ -204,35 +668,149 @@ class FileProcessor:
         )
         return converted_chunk
 
+    def max_reply_tokens(self) -> int | None:
+        """The `max_tokens` for a reply to the last message, in proportion to
+        its length; `None` without a profile."""
+        if self.profile is None:
+            return None
+        return self.profile.max_reply_tokens(
+            self.token_estimator(self.messages[-1].content)
+        )
+
+    def get_database(self) -> ConversionDatabase:
+        if self.database is None:
+            self.database = ConversionDatabase.load(self.conn)
+        return self.database
+
+    def record_request(
+        self,
+        messages: list[Message],
+        chunk_index: int,
+        start: float,
+        completion: Completion | None,
+    ):
+        """Record a request in the metrics; `completion` is `None` on failure."""
+        if self.metrics is None:
+            return
+        usage = completion.usage if completion is not None else None
+        cost = usage.cost if usage else None
+        if usage is not None:
+            prompt_tokens, completion_tokens = (
+                usage.prompt_tokens,
+                usage.completion_tokens,
+            )
+        else:
+            estimate = self.token_estimator
+            prompt_tokens = sum(estimate(m.content) for m in messages)
+            completion_tokens = estimate(completion.content or "") if completion else 0
+        model_id = completion.model_id(self.model) if completion else self.model.id
+        # Replayed replies cost nothing; the profile only prices this model.
+        if (
+            cost is None
+            and self.profile
+            and completion
+            and not completion.cached
+            and model_id == self.model.id
+        ):
+            cost = self.profile.cost(prompt_tokens, completion_tokens)
+        self.metrics.record(
+            RequestRecord(
+                model=model_id,
+                from_lang=self.from_slug,
+                to_lang=self.to_slug,
+                file_name=str(self.file_path),
+                chunk_index=chunk_index,
+                latency=time.perf_counter() - start,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                retries=completion.retries if completion else 0,
+                cached_prompt_tokens=usage.cached_prompt_tokens if usage else 0,
+                cost=cost,
+                estimated_tokens=usage is None,
+                cached=completion.cached if completion else False,
+                succeeded=completion is not None,
+            )
+        )
+
     def has_file_been_processed(self) -> bool:
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT file_name FROM converted_files "
-            "WHERE file_name = ? AND model = ? AND from_lang = ? AND to_lang = ?",
-            (
-                str(self.file_path.absolute()),
-                self.model.id,
-                self.from_slug,
-                self.to_slug,
-            ),
+        """Check whether the current content of the file has been converted.
+
+        A file counts as processed if it was converted from the same source
+        and prompts, either at its current location or, if its output file
+        exists, at a location it was moved from. Entries recorded before
+        hashes were tracked match if the output file is at least as new as the
+        file; their hashes are filled in then, so that later edits are seen."""
+        key = self.db_key
+        source_hash, prompt_hash = self.get_source_hash(), self.prompt_hash
+        database = self.get_database()
+        hashes = database.converted_file(key)
+        if hashes == (source_hash, prompt_hash):
+            return True
+        if hashes is not None and hashes[0] is None:
+            if self.is_output_up_to_date():
+                logger.debug(f"Recording the hashes of {self.file_path.name}")
+                self.note_file_processed()
+                return True
+            return False
+        moved_from = [
+            file_name
+            for file_name in database.files_with_content(key, source_hash, prompt_hash)
+            if file_name != key[0]
+        ]
+        if moved_from and self.output_file_path.exists():
+            logger.debug(f"{self.file_path.name} was converted as {moved_from[0]}")
+            self.note_file_processed()
+            return True
+        return False
+
+    def is_output_up_to_date(self) -> bool:
+        try:
+            output_mtime = self.output_file_path.stat().st_mtime
+        except OSError:
+            return False
+        return output_mtime >= self.file_path.stat().st_mtime
+
+    @property
+    def db_key(self) -> tuple[str, str, str, str]:
+        return (
+            str(self.file_path.absolute()),
+            self.model.id,
+            self.from_slug,
+            self.to_slug,
+        )
+
+    def load_chunk_checkpoints(self) -> dict[int, tuple[str, str]]:
+        return self.get_database().chunk_checkpoints(self.db_key)
+
+    def resume_from_checkpoint(
+        self, checkpoints: dict[int, tuple[str, str]], index: int
+    ) -> str | None:
+        """Append the checkpointed reply for the last message, if there is one.
+
+        A checkpoint is only used if it answers exactly the message we are
+        about to send; otherwise `None` is returned."""
+        if index not in checkpoints:
+            return None
+        message_hash, reply = checkpoints[index]
+        if message_hash != content_hash(self.messages[-1].content):
+            return None
+        self.messages.append(Message(role="assistant", content=reply))
+        return reply
+
+    def save_chunk_checkpoint(self, index: int):
+        """Persist the last reply, which answers the message before it."""
+        question, reply = self.messages[-2], self.messages[-1]
+        self.get_database().save_chunk_checkpoint(
+            self.db_key, index, content_hash(question.content), reply.content
         )
-        return cursor.fetchone() is not None
+
+    def clear_chunk_checkpoints(self):
+        self.get_database().clear_chunk_checkpoints(self.db_key)
 
     def note_file_processed(self):
-        self.conn.cursor().execute(
-            (
-                "INSERT OR REPLACE INTO converted_files"
-                " (file_name, model, from_lang, to_lang)"
-                " VALUES (?, ?, ?, ?)"
-            ),
-            (
-                str(self.file_path.absolute()),
-                self.model.id,
-                self.from_slug,
-                self.to_slug,
-            ),
+        self.get_database().note_file_converted(
+            self.db_key, self.get_source_hash(), self.prompt_hash
         )
-        self.conn.commit()
 
     def write_converted_chunks_to_file(self, converted_chunks: List[str]):
         if any(c is None for c in converted_chunks):
@@ -242,6 +820,54 @@ class FileProcessor:
         with outfile_path.open("w", encoding="utf-8") as f:
             f.write(converted_content)
 
+    @contextmanager
+    def open_partial_output(self):
+        if not self.streaming:
+            yield
+            return
+        with self.partial_output_path.open("w", encoding="utf-8") as f:
+            self._partial_output = f
+            try:
+                yield
+            finally:
+                self._partial_output = None
+
+    def begin_partial_chunk(self, index: int):
+        if self._partial_output is None:
+            return
+        self._partial_chunk_begin = self._partial_output.tell()
+        if index > 0:
+            self._partial_output.write("\n")
+        self._partial_chunk_start = self._partial_output.tell()
+
+    def write_partial_delta(self, delta: str):
+        if self._partial_output is not None:
+            self._partial_output.write(delta)
+            self._partial_output.flush()
+
+    def restart_partial_chunk(self):
+        if self._partial_output is not None:
+            self._partial_output.seek(self._partial_chunk_start)
+            self._partial_output.truncate()
+
+    def discard_partial_chunk(self):
+        """Remove the current chunk, including its separator."""
+        if self._partial_output is not None:
+            self._partial_output.seek(self._partial_chunk_begin)
+            self._partial_output.truncate()
+
+    def write_partial_chunk(self, converted_chunk: str):
+        """Replace the streamed reply for the current chunk by its cleaned text."""
+        if self._partial_output is None:
+            return
+        self.restart_partial_chunk()
+        self._partial_output.write(converted_chunk)
+        self._partial_output.flush()
+
+    @property
+    def partial_output_path(self) -> Path:
+        return self.output_file_path.with_name(f"{self.output_file_path.name}.part")
+
     @property
     def output_file_path(self):
         return self.file_path.with_suffix(f".{self.model.slug}{self.to_suffix}")
@@ -1,48 +1,226 @@
+import hashlib
+import mmap
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Sequence, overload
+
+from attrs import frozen
+
 MAX_CHUNK_SIZE = 8192
 
+# A span is a pair of (start, end) offsets into the content of a file.
+Span = tuple[int, int]
+Buffer = str | bytes | mmap.mmap
 
-def split_into_chunks(content: str, max_chunk_size: int = MAX_CHUNK_SIZE) -> list[str]:
-    possible_chunks = split_into_possible_chunks(content)
-    final_chunks = aggregate_chunks(max_chunk_size, possible_chunks)
-    return final_chunks
+# The line boundaries recognized by `str.splitlines()`; in UTF-8 encoded
+# content the last three are multi-byte sequences.
+_LINE_BREAKS = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+_ASCII_LINE_BREAKS = b"\n\r\v\f\x1c\x1d\x1e"
+_UTF8_LINE_BREAKS = (b"\xc2\x85", b"\xe2\x80\xa8", b"\xe2\x80\xa9")
+# Cell markers are `# %%` and `// %%`; scanning for their common suffix is
+# much faster than matching a pattern at the start of every line.
+_MARKER_SUFFIX = re.compile(" %%")
+_MARKER_SUFFIX_BYTES = re.compile(b" %%")
 
 
-def split_into_possible_chunks(content: str) -> list[str]:
-    possible_chunks: list = []
-    current_chunk = ""
-    lines = content.splitlines(keepends=True)  # Keep original line endings
+def split_into_chunks(
+    content: str,
+    max_chunk_size: int = MAX_CHUNK_SIZE,
+    size_function: Callable[[str], int] = len,
+) -> list[str]:
+    """Split `content` at cell boundaries into chunks of at most `max_chunk_size`.
 
-    for line in lines:
-        if line.strip().startswith("# %%") or line.strip().startswith("// %%"):
-            if current_chunk:
-                possible_chunks.append(current_chunk)
-            current_chunk = line
-        else:
-            current_chunk += line
+    The size of a chunk is measured by `size_function`, e.g., a token
+    estimator; by default it is the number of characters. Cells larger than
+    `max_chunk_size` become chunks of their own."""
+    return list(Chunks.split(content, max_chunk_size, size_function))
 
-    if current_chunk:
-        possible_chunks.append(current_chunk)
 
-    return possible_chunks
+def split_into_possible_chunks(content: str) -> list[str]:
+    return [content[start:end] for start, end in cell_spans(content)]
 
 
-def aggregate_chunks(max_chunk_size: int, possible_chunks: list[str]) -> list[str]:
+def aggregate_chunks(
+    max_chunk_size: int,
+    possible_chunks: list[str],
+    size_function: Callable[[str], int] = len,
+) -> list[str]:
     final_chunks = []
-    current_chunk = ""
+    current_chunk: list[str] = []
+    current_size = 0
 
     for chunk in possible_chunks:
-        if len(chunk) > max_chunk_size:
+        chunk_size = size_function(chunk)
+        if chunk_size > max_chunk_size:
             if current_chunk:
-                final_chunks.append(current_chunk)
-                current_chunk = ""
+                final_chunks.append("".join(current_chunk))
+                current_chunk = []
+                current_size = 0
             final_chunks.append(chunk)
-        elif len(current_chunk) + len(chunk) <= max_chunk_size:
-            current_chunk += chunk
+        elif current_size + chunk_size <= max_chunk_size:
+            current_chunk.append(chunk)
+            current_size += chunk_size
         else:
-            final_chunks.append(current_chunk)
-            current_chunk = chunk
+            final_chunks.append("".join(current_chunk))
+            current_chunk = [chunk]
+            current_size = chunk_size
 
     if current_chunk:
-        final_chunks.append(current_chunk)
+        final_chunks.append("".join(current_chunk))
 
     return final_chunks
+
+
+def cell_spans(content: Buffer) -> list[Span]:
+    """Return the spans of the cells of `content` in a single scan.
+
+    `content` is either a string or UTF-8 encoded bytes, e.g., an mmap of a
+    file; for bytes the spans are byte offsets. Text before the first cell
+    marker forms a cell of its own."""
+    is_text = isinstance(content, str)
+    pattern = _MARKER_SUFFIX if is_text else _MARKER_SUFFIX_BYTES
+    starts = []
+    for match in pattern.finditer(content):
+        start = _marker_line_start(content, match.start(), is_text)
+        if start is not None:
+            starts.append(start)
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(content)]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+
+def _marker_line_start(content: Buffer, position: int, is_text: bool) -> int | None:
+    """Return the start of the line if `position` is the suffix of a marker.
+
+    A line is the start of a cell if its first non-blank characters are a cell
+    marker."""
+    hash_sign, slashes = ("#", "//") if is_text else (b"#", b"//")
+    if position >= 1 and content[position - 1 : position] == hash_sign:
+        index = position - 2
+    elif position >= 2 and content[position - 2 : position] == slashes:
+        index = position - 3
+    else:
+        return None
+    while index >= 0 and not _ends_line(content, index, is_text):
+        char = content[index : index + 1]
+        if not (char.isspace() if is_text else char in b" \t\x1f"):
+            return None
+        index -= 1
+    return index + 1
+
+
+def _ends_line(content: Buffer, index: int, is_text: bool) -> bool:
+    if is_text:
+        return content[index] in _LINE_BREAKS
+    if content[index : index + 1] in _ASCII_LINE_BREAKS:
+        return True
+    return any(
+        index + 1 >= len(line_break)
+        and content[index + 1 - len(line_break) : index + 1] == line_break
+        for line_break in _UTF8_LINE_BREAKS
+    )
+
+
+def aggregate_spans(
+    content: Buffer,
+    spans: list[Span],
+    max_chunk_size: int,
+    size_function: Callable[[str], int] = len,
+) -> list[Span]:
+    """Merge adjacent cell spans into chunks, like `aggregate_chunks()`."""
+    if size_function is len and isinstance(content, str):
+        # The common case does not need to look at the text at all.
+        def span_size(start, end):
+            return end - start
+
+    else:
+
+        def span_size(start, end):
+            return size_function(span_text(content, (start, end)))
+
+    final_spans = []
+    current_span: Span | None = None
+    current_size = 0
+
+    for start, end in spans:
+        size = span_size(start, end)
+        if size > max_chunk_size:
+            if current_span is not None:
+                final_spans.append(current_span)
+                current_span = None
+                current_size = 0
+            final_spans.append((start, end))
+        elif current_span is None:
+            current_span = (start, end)
+            current_size = size
+        elif current_size + size <= max_chunk_size:
+            current_span = (current_span[0], end)
+            current_size += size
+        else:
+            final_spans.append(current_span)
+            current_span = (start, end)
+            current_size = size
+
+    if current_span is not None:
+        final_spans.append(current_span)
+
+    return final_spans
+
+
+def span_text(content: Buffer, span: Span) -> str:
+    start, end = span
+    if isinstance(content, str):
+        return content[start:end]
+    return content[start:end].decode("utf-8")
+
+
+@frozen
+class Chunks(Sequence[str]):
+    """The chunks of a file as spans; the text of a chunk is only extracted
+    from the content when it is accessed."""
+
+    content: Buffer
+    spans: list[Span]
+
+    @classmethod
+    def split(
+        cls,
+        content: Buffer,
+        max_chunk_size: int = MAX_CHUNK_SIZE,
+        size_function: Callable[[str], int] = len,
+    ) -> "Chunks":
+        spans = aggregate_spans(
+            content, cell_spans(content), max_chunk_size, size_function
+        )
+        return cls(content, spans)
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [span_text(self.content, span) for span in self.spans[index]]
+        return span_text(self.content, self.spans[index])
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+
+@contextmanager
+def mapped_file(path: Path) -> Iterator[Buffer]:
+    """Map a file read-only into memory; empty files cannot be mapped."""
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
@@ -0,0 +1,176 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable
+
+from attrs import Factory, define, evolve, field
+from loguru import logger
+
+from plc.completion import Completion
+from plc.errors import RateLimitError
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.metrics import RunMetrics
+from plc.model import Model
+from plc.rate_limiter import AdaptiveRateLimiter
+from plc.token_estimator import estimate_message_tokens
+
+
+@define
+class HedgingProvider(LlmProvider):
+    """Send a duplicate of requests that take unusually long.
+
+    Once a request to a model has taken longer than the `quantile` of the
+    latencies recently observed for that model (but at least `min_delay`), the
+    same request is sent again, to the fallback model for the model if there
+    is one. The first valid reply wins and the other request is cancelled.
+    Until `min_samples` latencies have been observed for a model, its requests
+    are not hedged.
+
+    Streamed requests are not hedged, since their replies are already being
+    passed on while they arrive.
+
+    The latencies should be those of single HTTP requests, so this provider
+    belongs below a `RateLimitedProvider`: above it, the time spent waiting
+    for the limiter and in backoff would count as latency, and requests
+    would be hedged exactly when the provider is throttled. Hedges bypass
+    that provider, so they take their budget from `limiter_for(hedge_model)`
+    and report rate limits to it, e.g., `RateLimitedProvider.limiter_for`.
+    The reply of a hedge to a fallback model names that model."""
+
+    provider: LlmProvider
+    quantile: float = 0.95
+    min_samples: int = 20
+    min_delay: float = 1.0
+    # The number of recent latencies per model from which the quantile is
+    # computed.
+    window: int = 200
+    # Hedges for a model (by id) go to this model instead.
+    fallback_models: dict[str, Model] = Factory(dict)
+    metrics: RunMetrics | None = None
+    limiter_for: Callable[[Model], AdaptiveRateLimiter] | None = None
+    _latencies: dict[str, deque[float]] = field(factory=dict, init=False, repr=False)
+
+    async def open(self):
+        await self.provider.open()
+
+    async def close(self):
+        await self.provider.close()
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        return (await self.complete(messages, model)).content
+
+    async def stream_message(
+        self, messages: list[Message], model: Model, on_delta: Callable[[str], None]
+    ) -> str:
+        return (await self.complete(messages, model, on_delta)).content
+
+    def hedge_delay(self, model: Model) -> float | None:
+        latencies = self._latencies.get(model.id)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+        return max(self.min_delay, ordered[index])
+
+    def observe(self, model: Model, latency: float):
+        self._latencies.setdefault(model.id, deque(maxlen=self.window)).append(
+            latency
+        )
+
+    def expected_latency(self, model: Model, elapsed: float) -> float:
+        """Estimate when a request that has been running for `elapsed` seconds
+        would have finished, from the latencies in the tail."""
+        tail = [t for t in self._latencies.get(model.id, ()) if t > elapsed]
+        return sum(tail) / len(tail) if tail else elapsed
+
+    async def complete(
+        self,
+        messages: list[Message],
+        model: Model,
+        on_delta: Callable[[str], None] | None = None,
+        max_tokens: int | None = None,
+    ) -> Completion:
+        delay = self.hedge_delay(model)
+        start = time.perf_counter()
+        if on_delta is not None or delay is None:
+            completion = await self.provider.complete(
+                messages, model, on_delta, max_tokens=max_tokens
+            )
+            self.observe(model, time.perf_counter() - start)
+            return completion
+
+        primary = asyncio.create_task(
+            self.provider.complete(messages, model, max_tokens=max_tokens)
+        )
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                completion = primary.result()
+                self.observe(model, time.perf_counter() - start)
+                return completion
+
+            hedge_model = self.fallback_models.get(model.id, model)
+            logger.debug(
+                f"Hedging request to {model.slug} with {hedge_model.slug} after "
+                f"{delay:.1f}s"
+            )
+            hedge_start = time.perf_counter()
+            hedge = asyncio.create_task(
+                self.send_hedge(messages, hedge_model, max_tokens)
+            )
+            winner = await self.first_valid(primary, hedge)
+            elapsed = time.perf_counter() - start
+            hedge_won = winner is hedge
+            # Only the winner's latency is known; the loser's is censored and
+            # would bias the quantile downwards.
+            if hedge_won:
+                self.observe(hedge_model, time.perf_counter() - hedge_start)
+            else:
+                self.observe(model, elapsed)
+            saved = 0.0
+            if hedge_won:
+                saved = max(0.0, self.expected_latency(model, elapsed) - elapsed)
+            if self.metrics is not None:
+                self.metrics.record_hedge(model.id, hedge_won, saved)
+            completion = winner.result()
+            if hedge_won and hedge_model != model:
+                completion = evolve(completion, model=hedge_model)
+            return completion
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def send_hedge(
+        self, messages: list[Message], model: Model, max_tokens: int | None
+    ) -> Completion:
+        limiter = self.limiter_for(model) if self.limiter_for is not None else None
+        if limiter is None:
+            return await self.provider.complete(messages, model, max_tokens=max_tokens)
+        await limiter.acquire(estimate_message_tokens(messages))
+        try:
+            completion = await self.provider.complete(
+                messages, model, max_tokens=max_tokens
+            )
+        except RateLimitError as e:
+            limiter.on_rate_limited(e.retry_after)
+            raise
+        limiter.on_success()
+        return completion
+
+    @staticmethod
+    async def first_valid(primary: asyncio.Task, hedge: asyncio.Task) -> asyncio.Task:
+        """Return the first task that has a reply; if both fail, the primary
+        request's error is raised."""
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in sorted(done, key=lambda t: t is not primary):
+                if task.exception() is None and task.result().content is not None:
+                    return task
+        primary.result()
+        raise ValueError("Neither the request nor its hedge returned a reply.")
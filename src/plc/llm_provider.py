@@ -1,8 +1,44 @@
-from typing import Protocol
+from typing import Callable, Protocol
 
+from plc.completion import Completion
 from plc.message import Message
 from plc.model import Model
 
 
 class LlmProvider(Protocol):
     async def send_message(self, messages: list[Message], model: Model) -> str: ...
+
+    async def stream_message(
+        self, messages: list[Message], model: Model, on_delta: Callable[[str], None]
+    ) -> str:
+        """Like `send_message()`, but pass each part of the reply to `on_delta`
+        as soon as it arrives.
+
+        Providers that cannot stream pass the whole reply at once."""
+        reply = await self.send_message(messages, model)
+        on_delta(reply)
+        return reply
+
+    async def complete(
+        self,
+        messages: list[Message],
+        model: Model,
+        on_delta: Callable[[str], None] | None = None,
+        max_tokens: int | None = None,
+    ) -> Completion:
+        """Request a reply together with its usage, streaming it to `on_delta`
+        if that is given. `max_tokens` limits the length of the reply.
+
+        Providers that do not report usage only fill in the content, and they
+        may ignore `max_tokens`."""
+        if on_delta is None:
+            content = await self.send_message(messages, model)
+        else:
+            content = await self.stream_message(messages, model, on_delta)
+        return Completion(content)
+
+    async def open(self) -> None:
+        """Acquire long-lived resources, e.g., a connection pool, for a run."""
+
+    async def close(self) -> None:
+        """Release the resources acquired by `open()`."""
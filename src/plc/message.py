@@ -1,7 +1,23 @@
-from attrs import frozen
+from typing import Callable
+
+from attrs import field, frozen
 
 
 @frozen
 class Message:
     role: str
     content: str
+    # Ask the provider to cache the conversation up to and including this
+    # message, so that a constant prefix is processed only once.
+    cache: bool = False
+    _encoded: bytes | None = field(default=None, init=False, eq=False, repr=False)
+
+    def encoded(self, encode: Callable[["Message"], bytes]) -> bytes:
+        """The request encoding of the message, computed by `encode` once.
+
+        A conversation is resent with every request, so caching the encoding
+        means that each request only encodes the messages added since the
+        last one."""
+        if self._encoded is None:
+            object.__setattr__(self, "_encoded", encode(self))
+        return self._encoded
@@ -0,0 +1,304 @@
+import bisect
+import heapq
+import json
+import os
+import time
+from pathlib import Path
+
+from attrs import Factory, asdict, define, field, frozen
+from loguru import logger
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+NUM_SLOWEST_REQUESTS = 10
+
+
+@frozen
+class RequestRecord:
+    model: str
+    from_lang: str
+    to_lang: str
+    file_name: str
+    # -1 is the acknowledgement of the initial prompt.
+    chunk_index: int
+    latency: float
+    prompt_tokens: int
+    completion_tokens: int
+    retries: int = 0
+    # Prompt tokens that the provider read from its prompt cache.
+    cached_prompt_tokens: int = 0
+    cost: float | None = None
+    # The provider reported no usage, so the token counts are estimates.
+    estimated_tokens: bool = False
+    cached: bool = False
+    succeeded: bool = True
+
+
+@define
+class Histogram:
+    """A histogram with fixed buckets in the style of Prometheus."""
+
+    bounds: tuple[float, ...]
+    # The number of observations per bucket; the last bucket is +Inf.
+    counts: list[int] = field()
+    sum: float = 0.0
+    count: int = 0
+
+    @counts.default
+    def _counts_default(self):
+        return [0] * (len(self.bounds) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate a quantile by interpolating within its bucket."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        result, cumulative = [], 0
+        for bound, count in zip([*self.bounds, "+Inf"], self.counts):
+            cumulative += count
+            result.append((f"{bound:g}" if bound != "+Inf" else bound, cumulative))
+        return result
+
+    def to_json(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(self.cumulative_counts()),
+        }
+
+
+@define
+class RequestStats:
+    """Aggregated requests for one model and language pair."""
+
+    requests: int = 0
+    failures: int = 0
+    cached: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    estimated_token_requests: int = 0
+    cost: float = 0.0
+    requests_without_cost: int = 0
+    latency: Histogram = Factory(lambda: Histogram(LATENCY_BUCKETS))
+    prompt_token_counts: Histogram = Factory(lambda: Histogram(TOKEN_BUCKETS))
+
+    def add(self, record: RequestRecord):
+        self.requests += 1
+        self.retries += record.retries
+        self.latency.observe(record.latency)
+        if not record.succeeded:
+            self.failures += 1
+            return
+        self.cached += record.cached
+        self.prompt_tokens += record.prompt_tokens
+        self.cached_prompt_tokens += record.cached_prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.prompt_token_counts.observe(record.prompt_tokens)
+        self.estimated_token_requests += record.estimated_tokens
+        if record.cost is not None:
+            self.cost += record.cost
+        elif not record.cached:
+            self.requests_without_cost += 1
+
+    def to_json(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "cached": self.cached,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_token_requests": self.estimated_token_requests,
+            "cost_usd": self.cost,
+            "requests_without_cost": self.requests_without_cost,
+            "latency_seconds": self.latency.to_json(),
+            "prompt_tokens_per_request": self.prompt_token_counts.to_json(),
+        }
+
+
+@define
+class HedgeStats:
+    """Hedged requests for one model."""
+
+    hedges: int = 0
+    # Hedges whose reply arrived before that of the original request.
+    won: int = 0
+    # Estimated from the latencies that the original requests would have had.
+    seconds_saved: float = 0.0
+
+    def to_json(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "won": self.won,
+            "seconds_saved": self.seconds_saved,
+        }
+
+
+@define
+class RunMetrics:
+    """Collect per-request metrics of a run and export them.
+
+    The summary is written as JSON and as a Prometheus textfile (for the
+    textfile collector of the node exporter). Both are replaced atomically,
+    so they can be written periodically while the run is in progress."""
+
+    json_path: Path | None = None
+    prometheus_path: Path | None = None
+    stats: dict[tuple[str, str, str], RequestStats] = Factory(dict)
+    hedges: dict[str, HedgeStats] = Factory(dict)
+    started: float = Factory(time.time)
+    # The slowest requests as a min-heap of (latency, sequence number, record).
+    _slowest: list = field(factory=list, init=False, repr=False)
+    _num_records: int = field(default=0, init=False, repr=False)
+
+    def record(self, record: RequestRecord):
+        key = (record.model, record.from_lang, record.to_lang)
+        self.stats.setdefault(key, RequestStats()).add(record)
+        self._num_records += 1
+        entry = (record.latency, self._num_records, record)
+        if len(self._slowest) < NUM_SLOWEST_REQUESTS:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    def record_hedge(self, model: str, won: bool, seconds_saved: float):
+        stats = self.hedges.setdefault(model, HedgeStats())
+        stats.hedges += 1
+        stats.won += won
+        stats.seconds_saved += seconds_saved
+
+    @property
+    def total_cost(self) -> float:
+        return sum(stats.cost for stats in self.stats.values())
+
+    def summary(self) -> dict:
+        return {
+            "started": self.started,
+            "elapsed_seconds": time.time() - self.started,
+            "requests": sum(stats.requests for stats in self.stats.values()),
+            "cost_usd": self.total_cost,
+            "by_model": [
+                {"model": model, "from_lang": from_lang, "to_lang": to_lang}
+                | stats.to_json()
+                for (model, from_lang, to_lang), stats in sorted(self.stats.items())
+            ],
+            "hedges": {
+                model: stats.to_json() for model, stats in sorted(self.hedges.items())
+            },
+            "slowest_requests": [
+                asdict(record)
+                for _, _, record in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def prometheus_text(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP plc_{name} {help_text}")
+            lines.append(f"# TYPE plc_{name} {kind}")
+
+        def sample(name: str, labels: dict, value: float):
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"plc_{name}{{{label_text}}} {value:g}")
+
+        def histogram(name: str, labels: dict, values: Histogram):
+            for bound, count in values.cumulative_counts():
+                sample(f"{name}_bucket", labels | {"le": bound}, count)
+            sample(f"{name}_sum", labels, values.sum)
+            sample(f"{name}_count", labels, values.count)
+
+        items = sorted(self.stats.items())
+        labelled = [
+            ({"model": m, "from_lang": f, "to_lang": t}, stats)
+            for (m, f, t), stats in items
+        ]
+        counters = [
+            ("requests_total", "Requests sent to the LLM.", "requests"),
+            ("request_failures_total", "Requests that failed.", "failures"),
+            ("cached_requests_total", "Replies replayed from a cassette.", "cached"),
+            ("request_retries_total", "Retries of failed attempts.", "retries"),
+            ("prompt_tokens_total", "Prompt tokens.", "prompt_tokens"),
+            (
+                "cached_prompt_tokens_total",
+                "Prompt tokens read from the provider's cache.",
+                "cached_prompt_tokens",
+            ),
+            ("completion_tokens_total", "Completion tokens.", "completion_tokens"),
+            ("cost_usd_total", "Cost reported by the provider or estimated.", "cost"),
+        ]
+        for name, help_text, attribute in counters:
+            metric(name, "counter", help_text)
+            for labels, stats in labelled:
+                sample(name, labels, getattr(stats, attribute))
+        metric("request_duration_seconds", "histogram", "Latency of requests.")
+        for labels, stats in labelled:
+            histogram("request_duration_seconds", labels, stats.latency)
+        metric("request_prompt_tokens", "histogram", "Prompt tokens per request.")
+        for labels, stats in labelled:
+            histogram("request_prompt_tokens", labels, stats.prompt_token_counts)
+        hedge_counters = [
+            ("hedged_requests_total", "Requests that were hedged.", "hedges"),
+            ("hedges_won_total", "Hedges that replied first.", "won"),
+            (
+                "hedge_seconds_saved_total",
+                "Estimated seconds saved by hedges.",
+                "seconds_saved",
+            ),
+        ]
+        for name, help_text, attribute in hedge_counters:
+            metric(name, "counter", help_text)
+            for model, stats in sorted(self.hedges.items()):
+                sample(name, {"model": model}, getattr(stats, attribute))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        if self.json_path is not None:
+            write_atomically(self.json_path, json.dumps(self.summary(), indent=2))
+        if self.prometheus_path is not None:
+            write_atomically(self.prometheus_path, self.prometheus_text())
+
+    def log_summary(self):
+        for (model, from_lang, to_lang), stats in sorted(self.stats.items()):
+            p50, p95 = stats.latency.quantile(0.5), stats.latency.quantile(0.95)
+            logger.info(
+                f"{model} ({from_lang} -> {to_lang}): {stats.requests} request(s), "
+                f"{stats.failures} failed, {stats.retries} retries, "
+                f"latency p50 {p50:.1f}s p95 {p95:.1f}s, "
+                f"{stats.prompt_tokens} prompt and {stats.completion_tokens} "
+                f"completion tokens, ${stats.cost:.4f}"
+            )
+        for model, stats in sorted(self.hedges.items()):
+            logger.info(
+                f"{model}: {stats.hedges} hedged request(s), {stats.won} won by the "
+                f"hedge, about {stats.seconds_saved:.0f}s saved"
+            )
+
+
+def write_atomically(path: Path, text: str):
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    temporary_path.write_text(text, encoding="utf-8")
+    os.replace(temporary_path, path)
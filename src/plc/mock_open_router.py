@@ -0,0 +1,273 @@
+"""A local HTTP server that speaks the OpenRouter chat-completions protocol.
+
+It is used by the tests and benchmarks so that the HTTP stack can be exercised
+without network access or API costs."""
+
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Callable
+
+from aiohttp import web
+from attrs import Factory, define, field
+from loguru import logger
+
+from plc.token_estimator import estimate_tokens
+
+CHAT_COMPLETIONS_PATH = "/api/v1/chat/completions"
+
+
+LatencyDistribution = Callable[[random.Random], float]
+
+
+def message_text(message: dict) -> str:
+    """Return the text of a message whose content may be a list of parts."""
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content)
+
+
+def has_cache_breakpoint(message: dict) -> bool:
+    content = message["content"]
+    return not isinstance(content, str) and any(
+        "cache_control" in part for part in content
+    )
+
+
+def echo_last_message(messages: list[dict]) -> str:
+    return message_text(messages[-1]) if messages else ""
+
+
+def uniform_latency(low: float, high: float) -> LatencyDistribution:
+    return lambda rng: rng.uniform(low, high)
+
+
+def exponential_latency(mean: float) -> LatencyDistribution:
+    return lambda rng: rng.expovariate(1 / mean)
+
+
+def lognormal_latency(median: float, sigma: float) -> LatencyDistribution:
+    """Latencies with a heavy tail, as observed for many LLM providers."""
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+@define
+class MockOpenRouterServer:
+    host: str = "127.0.0.1"
+    port: int = 0
+    latency: float = 0.0
+    # Additional latency for every 1000 prompt tokens, since providers take
+    # longer to process longer prompts.
+    latency_per_1k_tokens: float = 0.0
+    # Random additional latency for every request.
+    latency_distribution: LatencyDistribution | None = None
+    reply: Callable[[list[dict]], str] = echo_last_message
+    # Status codes returned, in order, before the server replies normally.
+    error_statuses: list[int] = Factory(list)
+    retry_after: float | None = None
+    # Fraction of the remaining requests that fail with `error_status`.
+    error_rate: float = 0.0
+    error_status: int = 503
+    # Every `rate_limit_burst_interval` seconds, all requests are rejected with
+    # status 429 for `rate_limit_burst_duration` seconds.
+    rate_limit_burst_interval: float | None = None
+    rate_limit_burst_duration: float = 0.0
+    seed: int | None = None
+    # If set, the usage reports a cost in USD per 1000 tokens.
+    cost_per_1k_tokens: float | None = None
+    # Streamed replies are sent in events of `stream_chunk_size` characters,
+    # `stream_delay` seconds apart. After `stall_after` events the server
+    # stops sending until the client gives up.
+    stream_chunk_size: int = 16
+    stream_delay: float = 0.0
+    stall_after: int | None = None
+    requests_served: int = 0
+    # HEAD requests, which clients send to open connections in advance.
+    head_requests: int = 0
+    client_connections: set[tuple] = Factory(set)
+    _runner: web.AppRunner | None = field(default=None, init=False, repr=False)
+    _stopping: asyncio.Event | None = field(default=None, init=False, repr=False)
+    _random: random.Random = field(init=False, repr=False)
+    _started_at: float = field(default=0.0, init=False, repr=False)
+    _cached_prefixes: set[str] = field(factory=set, init=False, repr=False)
+
+    @_random.default
+    def _random_default(self):
+        return random.Random(self.seed)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{CHAT_COMPLETIONS_PATH}"
+
+    async def start(self):
+        self._stopping = asyncio.Event()
+        self._started_at = time.monotonic()
+        app = web.Application()
+        app.router.add_post(CHAT_COMPLETIONS_PATH, self.handle_chat_completion)
+        app.router.add_route("HEAD", CHAT_COMPLETIONS_PATH, self.handle_head)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # Pick up the port the OS assigned if we asked for port 0.
+        self.port = self._runner.addresses[0][1]
+        logger.debug(f"Mock OpenRouter server listening on {self.url}")
+
+    async def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def error_response(
+        self, status: int, retry_after: float | None = None
+    ) -> web.Response:
+        headers = {}
+        if retry_after is None:
+            retry_after = self.retry_after
+        if retry_after is not None:
+            headers["Retry-After"] = f"{retry_after:g}"
+        return web.json_response(
+            {"error": {"code": status, "message": f"Mock error {status}"}},
+            status=status,
+            headers=headers,
+        )
+
+    def remaining_rate_limit_burst(self) -> float:
+        """Return the number of seconds the current 429 burst lasts, if any."""
+        if not self.rate_limit_burst_interval:
+            return 0.0
+        interval = self.rate_limit_burst_interval
+        elapsed = (time.monotonic() - self._started_at) % interval
+        # Bursts are at the end of each interval, so that a run starts normally.
+        burst_start = interval - self.rate_limit_burst_duration
+        if elapsed < burst_start:
+            return 0.0
+        return interval - elapsed
+
+    def cached_prefix_tokens(
+        self, model: str, messages: list[dict], message_tokens: list[int]
+    ) -> int:
+        """Simulate prompt caching: the prefix up to the last cache breakpoint
+        is cached by the first request and read from the cache afterwards."""
+        breakpoints = [i for i, m in enumerate(messages) if has_cache_breakpoint(m)]
+        if not breakpoints:
+            return 0
+        end = breakpoints[-1] + 1
+        key = json.dumps([model, [message_text(m) for m in messages[:end]]])
+        if key not in self._cached_prefixes:
+            self._cached_prefixes.add(key)
+            return 0
+        return sum(message_tokens[:end])
+
+    async def handle_head(self, request: web.Request) -> web.Response:
+        self.client_connections.add(request.transport.get_extra_info("peername"))
+        self.head_requests += 1
+        # Without a length, the client cannot reuse the connection.
+        return web.Response(headers={"Content-Length": "0"})
+
+    async def handle_chat_completion(self, request: web.Request) -> web.Response:
+        self.client_connections.add(request.transport.get_extra_info("peername"))
+        payload = await request.json()
+        messages = payload.get("messages", [])
+        message_tokens = [estimate_tokens(message_text(m)) for m in messages]
+        prompt_tokens = sum(message_tokens)
+        cached_tokens = self.cached_prefix_tokens(
+            payload.get("model"), messages, message_tokens
+        )
+        latency = (
+            self.latency
+            + self.latency_per_1k_tokens * (prompt_tokens - cached_tokens) / 1000
+        )
+        if self.latency_distribution is not None:
+            latency += self.latency_distribution(self._random)
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if self.error_statuses:
+            return self.error_response(self.error_statuses.pop(0))
+        if (remaining_burst := self.remaining_rate_limit_burst()) > 0:
+            return self.error_response(429, math.ceil(remaining_burst))
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            return self.error_response(self.error_status)
+        content = self.reply(messages)
+        self.requests_served += 1
+        completion_tokens = estimate_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if cached_tokens:
+            usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+        if self.cost_per_1k_tokens is not None:
+            usage["cost"] = usage["total_tokens"] * self.cost_per_1k_tokens / 1000
+        if payload.get("stream"):
+            return await self.stream_response(request, payload, content, usage)
+        return web.json_response(
+            {
+                "id": f"gen-mock-{self.requests_served}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def stream_response(
+        self, request: web.Request, payload: dict, content: str, usage: dict
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+
+        async def send_event(data: dict | str):
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            await response.write(f"data: {data}\n\n".encode("utf-8"))
+
+        def chunk_event(delta: dict, finish_reason: str | None = None) -> dict:
+            return {
+                "id": f"gen-mock-{self.requests_served}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model"),
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        pieces = [
+            content[i : i + self.stream_chunk_size]
+            for i in range(0, len(content), self.stream_chunk_size)
+        ]
+        for index, piece in enumerate(pieces):
+            if self.stall_after is not None and index >= self.stall_after:
+                await self._stopping.wait()
+                return response
+            await send_event(chunk_event({"role": "assistant", "content": piece}))
+            if self.stream_delay > 0:
+                await asyncio.sleep(self.stream_delay)
+        await send_event({**chunk_event({}, "stop"), "usage": usage})
+        await send_event("[DONE]")
+        await response.write_eof()
+        return response
@@ -0,0 +1,133 @@
+import math
+from pathlib import Path
+
+from attrs import Factory, define, evolve, fields, frozen
+
+from plc.model import Model
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+
+@frozen
+class ModelProfile:
+    """The limits and prices of a model.
+
+    Prices are in USD per million tokens."""
+
+    context_window: int = 32_768
+    max_output_tokens: int = 4096
+    # Maximum number of jobs for the model that run at the same time; `None`
+    # if only the overall concurrency applies.
+    concurrency: int | None = None
+    prompt_price: float = 0.0
+    completion_price: float = 0.0
+    # `max_tokens` of a request is this many times the tokens of its last
+    # message, but at least `min_reply_tokens`.
+    reply_ratio: float = 2.0
+    min_reply_tokens: int = 1024
+
+    @property
+    def max_chunk_tokens(self) -> int:
+        """The largest chunk whose reply fits into the output limit and that
+        leaves most of the context window to the prompt and the history."""
+        return max(
+            1,
+            min(
+                int(self.max_output_tokens / self.reply_ratio),
+                self.context_window // 4,
+            ),
+        )
+
+    def max_reply_tokens(self, input_tokens: int) -> int:
+        reply_tokens = max(
+            self.min_reply_tokens, math.ceil(input_tokens * self.reply_ratio)
+        )
+        return min(self.max_output_tokens, reply_tokens)
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (
+            prompt_tokens * self.prompt_price
+            + completion_tokens * self.completion_price
+        ) / 1_000_000
+
+
+DEFAULT_PROFILE = ModelProfile()
+
+# Published limits and OpenRouter prices of the models in `plc.defaults`.
+default_model_profiles: dict[str, ModelProfile] = {
+    "anthropic/claude-3.5-sonnet:beta": ModelProfile(
+        context_window=200_000,
+        max_output_tokens=8192,
+        prompt_price=3.0,
+        completion_price=15.0,
+    ),
+    "qwen/qwen-2.5-72b-instruct": ModelProfile(
+        context_window=32_768,
+        max_output_tokens=8192,
+        prompt_price=0.35,
+        completion_price=0.4,
+    ),
+    "google/gemini-pro-1.5": ModelProfile(
+        context_window=2_000_000,
+        max_output_tokens=8192,
+        prompt_price=1.25,
+        completion_price=5.0,
+    ),
+    "openai/chatgpt-4o-latest": ModelProfile(
+        context_window=128_000,
+        max_output_tokens=16_384,
+        prompt_price=5.0,
+        completion_price=15.0,
+    ),
+}
+
+
+@define
+class ModelProfiles:
+    """The profiles of the models by id.
+
+    A TOML file can override the built-in profiles:
+
+        [default]
+        max_output_tokens = 4096
+
+        [models."anthropic/claude-3.5-sonnet:beta"]
+        concurrency = 4
+        prompt_price = 3.0
+
+    Every table only needs to give the values that differ; the others are
+    taken from the built-in profile of the model, or from the default. Models
+    with neither a built-in nor a configured profile have none: their limits
+    and prices are unknown."""
+
+    profiles: dict[str, ModelProfile] = Factory(
+        lambda: dict(default_model_profiles)
+    )
+    default: ModelProfile = DEFAULT_PROFILE
+
+    def for_model(self, model: Model) -> ModelProfile | None:
+        return self.profiles.get(model.id)
+
+    @classmethod
+    def load(cls, path: Path) -> "ModelProfiles":
+        with path.open("rb") as f:
+            data = tomllib.load(f)
+        profiles = cls()
+        profiles.default = update_profile(
+            profiles.default, data.get("default", {}), "default"
+        )
+        for model_id, values in data.get("models", {}).items():
+            profile = profiles.profiles.get(model_id, profiles.default)
+            profiles.profiles[model_id] = update_profile(profile, values, model_id)
+        return profiles
+
+
+def update_profile(profile: ModelProfile, values: dict, name: str) -> ModelProfile:
+    known = {a.name for a in fields(ModelProfile)}
+    unknown = sorted(set(values) - known)
+    if unknown:
+        raise ValueError(f"Unknown settings in model profile {name}: {unknown}")
+    return evolve(profile, **values)
@@ -1,43 +1,274 @@
+import asyncio
+import gzip
 import json
 import os
+from typing import Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import aiohttp
-import attrs
-from attrs import define
+from attrs import define, field
 from loguru import logger
 
+from plc.completion import Completion, Usage
+from plc.errors import LlmProviderError, StreamStalledError, error_for_status
+from plc.llm_provider import LlmProvider
 from plc.message import Message
 from plc.model import Model
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
 
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a `Retry-After` header given either in seconds or as HTTP date."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+def message_json(message: Message) -> dict:
+    """Convert a message into the request format.
+
+    Messages marked for caching get a `cache_control` breakpoint, which
+    OpenRouter passes on to providers that need explicit markers (Anthropic,
+    Gemini); providers that cache prefixes automatically ignore it."""
+    if not message.cache:
+        return {"role": message.role, "content": message.content}
+    return {
+        "role": message.role,
+        "content": [
+            {
+                "type": "text",
+                "text": message.content,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ],
+    }
+
+
+def encode_message(message: Message) -> bytes:
+    return dumps(message_json(message))
+
+
 @define
-class OpenRouterProvider:
+class OpenRouterProvider(LlmProvider):
     api_key: str = OPENROUTER_API_KEY
     api_url: str = OPENROUTER_API_URL
+    max_connections: int = 100
+    max_connections_per_host: int = 32
+    keepalive_timeout: float = 60.0
+    warm_up_connections: int = 0
+    stream_idle_timeout: float | None = 60.0
+    # Send gzip-compressed request bodies; this saves upload time for long
+    # conversations on slow links at the cost of some CPU time.
+    compress_requests: bool = False
+    _session: aiohttp.ClientSession | None = field(
+        default=None, init=False, repr=False
+    )
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def is_open(self) -> bool:
+        return self._session is not None and not self._session.closed
+
+    async def open(self):
+        if self.is_open:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        logger.debug(
+            f"Opened connection pool for {self.api_url} "
+            f"(limit={self.max_connections}, "
+            f"limit_per_host={self.max_connections_per_host})"
+        )
+        if self.warm_up_connections > 0:
+            await self.warm_up(self.warm_up_connections)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.debug(f"Closed connection pool for {self.api_url}")
+
+    async def warm_up(self, num_connections: int):
+        """Establish `num_connections` pooled connections to the API host.
+
+        The response status is irrelevant; we only want DNS, TCP and TLS to be
+        done before the first real request is sent."""
+        if not self.is_open:
+            raise RuntimeError("Cannot warm up a provider that is not open.")
+
+        async def ping():
+            try:
+                async with self._session.head(self.api_url) as response:
+                    await response.read()
+            except aiohttp.ClientError as e:
+                logger.debug(f"Warm-up request to {self.api_url} failed: {e}")
+
+        await asyncio.gather(*(ping() for _ in range(num_connections)))
+        logger.debug(f"Warmed up {num_connections} connection(s) to {self.api_url}")
 
     async def send_message(self, messages: list[Message], model: Model) -> str:
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        data = json.dumps(
-            {
-                "model": model.id,
-                "messages": [attrs.asdict(m) for m in messages],  # noqa
-            }
+        return (await self.complete(messages, model)).content
+
+    async def stream_message(
+        self, messages: list[Message], model: Model, on_delta: Callable[[str], None]
+    ) -> str:
+        return (await self.complete(messages, model, on_delta)).content
+
+    async def complete(
+        self,
+        messages: list[Message],
+        model: Model,
+        on_delta: Callable[[str], None] | None = None,
+        max_tokens: int | None = None,
+    ) -> Completion:
+        options = {} if max_tokens is None else {"max_tokens": max_tokens}
+        if on_delta is not None:
+            options["stream"] = True
+        data = self.build_request_data(messages, model, **options)
+        return await self._request(data, model, on_delta)
+
+    @staticmethod
+    def build_request_data(messages: list[Message], model: Model, **options) -> bytes:
+        """Encode a request from the cached encodings of its messages, so that
+        only new messages of a conversation are encoded."""
+        # Ask OpenRouter to include the cost of the request in `usage`.
+        head = dumps({"model": model.id, "usage": {"include": True}, **options})
+        return b"".join(
+            [
+                head[:-1],
+                b',"messages":[',
+                b",".join(m.encoded(encode_message) for m in messages),
+                b"]}",
+            ]
         )
 
+    async def _request(
+        self, data: bytes, model: Model, on_delta: Callable[[str], None] | None = None
+    ) -> Completion:
+        if self.is_open:
+            return await self._post(self._session, data, model, on_delta)
+        # Without an open pool we fall back to a one-shot session per request.
         async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=self.api_url, headers=headers, data=data
-            ) as response:
-                if response.status == 200:
-                    response_json = await response.json()
-                    logger.trace(
-                        f"Received response message from {model.slug}: "
-                        f"{response_json['choices'][0]['message']["content"]}"
-                    )
-                    return response_json["choices"][0]["message"]["content"]
-                else:
-                    response_text = await response.text()
-                    raise RuntimeError(f"Failed to convert chunk: {response_text}")
+            return await self._post(session, data, model, on_delta)
+
+    async def _post(
+        self,
+        session: aiohttp.ClientSession,
+        data: bytes,
+        model: Model,
+        on_delta: Callable[[str], None] | None,
+    ) -> Completion:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        if self.compress_requests:
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        async with session.post(
+            url=self.api_url, headers=headers, data=data
+        ) as response:
+            if response.status != 200:
+                response_text = await response.text()
+                raise error_for_status(
+                    response.status,
+                    f"Failed to convert chunk: {response_text}",
+                    parse_retry_after(response.headers.get("Retry-After")),
+                )
+            if on_delta is None:
+                response_json = await response.json(loads=loads)
+                choice = response_json["choices"][0]
+                completion = Completion(
+                    content=choice["message"]["content"],
+                    usage=Usage.from_json(response_json.get("usage")),
+                    finish_reason=choice.get("finish_reason"),
+                )
+            else:
+                completion = await self._read_stream(response, on_delta)
+            logger.trace(
+                f"Received response message from {model.slug}: {completion.content}"
+            )
+            return completion
+
+    async def _read_stream(
+        self, response: aiohttp.ClientResponse, on_delta: Callable[[str], None]
+    ) -> Completion:
+        parts = []
+        usage, finish_reason = None, None
+        async for event in self._iterate_events(response):
+            if "error" in event:
+                raise LlmProviderError(f"Failed to convert chunk: {event['error']}")
+            # The last event carries the usage and may have no choices.
+            usage = Usage.from_json(event.get("usage")) or usage
+            if not event.get("choices"):
+                continue
+            choice = event["choices"][0]
+            finish_reason = choice.get("finish_reason") or finish_reason
+            delta = choice.get("delta", {}).get("content")
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+        return Completion("".join(parts), usage, finish_reason)
+
+    async def _iterate_events(self, response: aiohttp.ClientResponse):
+        """Yield the JSON payloads of the server-sent events in `response`."""
+        while True:
+            try:
+                line = await asyncio.wait_for(
+                    response.content.readline(), self.stream_idle_timeout
+                )
+            except asyncio.TimeoutError:
+                raise StreamStalledError(
+                    f"Stream from {self.api_url} stalled for "
+                    f"{self.stream_idle_timeout}s"
+                )
+            if not line:
+                return
+            # Blank lines separate events, lines starting with ":" are comments
+            # that OpenRouter sends to keep the connection alive.
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line.removeprefix("data:").strip()
+            if data == "[DONE]":
+                return
+            yield loads(data)
@@ -0,0 +1,391 @@
+import heapq
+import sqlite3
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+from attrs import Factory, define, evolve, frozen
+from loguru import logger
+
+from plc.database import create_tables
+from plc.declarations import declaration_summaries
+from plc.file_pack import FilePack, pack_files
+from plc.file_processor import SYNTHETIC_ACKNOWLEDGEMENT, FileProcessor
+from plc.message import Message
+from plc.model import Model
+from plc.model_profile import ModelProfile
+from plc.polyglot_language_converter import PolyglotLanguageConverter
+from plc.scheduler import ConversionJob, Scheduler
+from plc.translation_memory import TranslationKey, TranslationMemory
+
+
+@frozen
+class JobPlan:
+    file_path: Path
+    model: Model
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
+    # The number of files converted by the job, more than one for packs.
+    files: int = 1
+
+
+def format_cost(cost: float | None) -> str:
+    return f"{'unknown':>11}" if cost is None else f"{cost:11.2f}"
+
+
+@define
+class ModelPlan:
+    model: Model
+    # Prices the tokens; the cost is unknown without a profile.
+    profile: ModelProfile | None = None
+    files: int = 0
+    skipped_files: int = 0
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    request_seconds: float = 0.0
+
+    @property
+    def cost(self) -> float | None:
+        if self.profile is None:
+            return None
+        return self.profile.cost(self.prompt_tokens, self.completion_tokens)
+
+    def add(self, job: JobPlan):
+        self.files += job.files
+        self.requests += job.requests
+        self.prompt_tokens += job.prompt_tokens
+        self.completion_tokens += job.completion_tokens
+        self.request_seconds += job.seconds
+
+
+@define
+class ConversionPlan:
+    models: dict[str, ModelPlan] = Factory(dict)
+    jobs: list[JobPlan] = Factory(list)
+    wall_time: float = 0.0
+
+    @property
+    def requests(self) -> int:
+        return sum(plan.requests for plan in self.models.values())
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(plan.prompt_tokens for plan in self.models.values())
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(plan.completion_tokens for plan in self.models.values())
+
+    @property
+    def cost(self) -> float | None:
+        """The total cost; `None` if the cost of any model is unknown."""
+        costs = [plan.cost for plan in self.models.values()]
+        if None in costs:
+            return None
+        return sum(costs)
+
+    def format(self) -> str:
+        lines = [
+            f"{'model':<40} {'files':>7} {'skipped':>8} {'requests':>9} "
+            f"{'input tokens':>13} {'output tokens':>14} {'cost (USD)':>11}"
+        ]
+        for plan in self.models.values():
+            lines.append(
+                f"{plan.model.id:<40} {plan.files:7} {plan.skipped_files:8} "
+                f"{plan.requests:9} {plan.prompt_tokens:13,} "
+                f"{plan.completion_tokens:14,} {format_cost(plan.cost)}"
+            )
+        lines.append(
+            f"{'total':<40} {sum(job.files for job in self.jobs):7} "
+            f"{sum(p.skipped_files for p in self.models.values()):8} "
+            f"{self.requests:9} {self.prompt_tokens:13,} "
+            f"{self.completion_tokens:14,} {format_cost(self.cost)}"
+        )
+        hours, rest = divmod(round(self.wall_time), 3600)
+        minutes, seconds = divmod(rest, 60)
+        lines.append(f"Projected wall time: {hours}:{minutes:02}:{seconds:02}")
+        return "\n".join(lines)
+
+
+@define
+class ConversionPlanner:
+    """Estimate the requests, tokens and wall time of a conversion run.
+
+    The planner walks the directory with the same rules as the converter,
+    splits the files into chunks and replays the conversation of each (file,
+    model) job with synthetic replies, so that the history that is resent
+    with every chunk is accounted for as the context policy selects it. It
+    reads the database of processed files, but never writes to it, and never
+    sends a request.
+
+    The duration of a request is estimated as `request_overhead` plus the
+    time to generate its completion at `output_tokens_per_second`; replies
+    are assumed to be `output_ratio` times as long as the chunk."""
+
+    converter: PolyglotLanguageConverter
+    output_ratio: float = 1.0
+    request_overhead: float = 2.0
+    output_tokens_per_second: float = 50.0
+    # Estimated length of the acknowledgement of the initial prompt.
+    ack_tokens: int = 20
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+
+    def plan(self, max_files: int = None, reprocess: bool = False) -> ConversionPlan:
+        plan = ConversionPlan(
+            models={
+                m.id: ModelPlan(m, self.converter.model_profiles.for_model(m))
+                for m in self.converter.models
+            }
+        )
+        conn = self.connect_read_only()
+        try:
+            database = self.converter.load_database(conn, read_only=True)
+            memory = None
+            if self.converter.use_translation_memory:
+                memory = TranslationMemory(database)
+            seen_chunks: set[TranslationKey] = set()
+            acknowledged: set[tuple[str, str, str]] = set()
+
+            def is_translated(processor: FileProcessor, chunk: str) -> bool:
+                key = processor.translation_key(chunk)
+                if key in seen_chunks or memory.contains(key):
+                    return True
+                seen_chunks.add(key)
+                return False
+
+            def add_job(job: ConversionJob):
+                acknowledge = self.sends_acknowledgement(job.processor, acknowledged)
+                if job.pack:
+                    job_plan = self.plan_pack([job.processor, *job.pack], acknowledge)
+                else:
+                    job_plan = self.plan_job(
+                        job.processor,
+                        acknowledge,
+                        is_translated if memory is not None else None,
+                    )
+                plan.jobs.append(job_plan)
+                plan.models[job.model.id].add(job_plan)
+
+            packer = None
+            if self.converter.pack_small_files:
+                packer = self.converter.file_packer()
+            for file_path in self.converter.iterate_file_paths(max_files):
+                try:
+                    file_content = file_path.read_text(encoding="utf-8")
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warning(f"Could not read {file_path}: {e}")
+                    continue
+                for job in self.converter.jobs_for_file(file_path):
+                    processor = self.converter.create_file_processor(
+                        job, conn, reprocess, database
+                    )
+                    processor.prepare(file_content)
+                    if processor.has_file_been_processed() and not reprocess:
+                        plan.models[job.model.id].skipped_files += 1
+                        continue
+                    job = evolve(job, processor=processor)
+                    for ready_job in packer.add(job) if packer else [job]:
+                        add_job(ready_job)
+            for ready_job in packer.flush() if packer else []:
+                add_job(ready_job)
+        finally:
+            conn.close()
+        plan.wall_time = self.project_wall_time(plan)
+        return plan
+
+    def connect_read_only(self) -> sqlite3.Connection:
+        db_path = self.converter.db_path
+        if str(db_path) != ":memory:" and Path(db_path).exists():
+            return sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True)
+        logger.debug(f"No database at {db_path}; planning as if nothing was done")
+        conn = sqlite3.connect(":memory:")
+        create_tables(conn)
+        return conn
+
+    @staticmethod
+    def sends_acknowledgement(processor: FileProcessor, acknowledged: set) -> bool:
+        if processor.ack_mode == "synthesize":
+            return False
+        if processor.ack_mode == "request":
+            return True
+        # Cached acknowledgements are requested by the first job of a model
+        # and language pair.
+        key = (processor.model.id, processor.from_slug, processor.to_slug)
+        if key in acknowledged:
+            return False
+        acknowledged.add(key)
+        return True
+
+    def plan_job(
+        self,
+        processor: FileProcessor,
+        acknowledge: bool = True,
+        is_translated: Callable[[FileProcessor, str], bool] | None = None,
+    ) -> JobPlan:
+        """Replay the conversation of a job; chunks for which `is_translated`
+        is true are answered from the translation memory without a request."""
+        estimate = processor.token_estimator
+        token_counts: dict[int, int] = {}
+
+        def count_tokens(messages: list[Message]) -> int:
+            total = 0
+            for message in messages:
+                if id(message) not in token_counts:
+                    token_counts[id(message)] = estimate(message.content)
+                total += token_counts[id(message)]
+            return total
+
+        messages = processor.build_initial_message()
+        prompt_tokens = completion_tokens = 0
+        seconds = 0.0
+        if acknowledge:
+            prompt_tokens = count_tokens(messages)
+            completion_tokens = self.ack_tokens
+            seconds = self.request_seconds(self.ack_tokens)
+        messages.append(Message("assistant", SYNTHETIC_ACKNOWLEDGEMENT))
+        processor.messages = messages
+        processor.add_conversion_example_messages()
+        prefix_length = len(messages)
+        requests = int(acknowledge)
+
+        chunks = list(processor.chunks)
+        summaries = None
+        if processor.independent_chunks:
+            summaries = declaration_summaries(chunks)
+        chunk_seconds = []
+        for index, chunk in enumerate(chunks):
+            reply = self.synthetic_reply(chunk)
+            if summaries is None:
+                messages.append(processor.build_chunk_message(chunk))
+                messages.append(Message("assistant", reply))
+                selected = messages[:-1]
+            else:
+                # Independent chunks are only sent with the prefix.
+                selected = [
+                    *messages[:prefix_length],
+                    processor.build_chunk_message(chunk, summaries[index]),
+                ]
+            if is_translated is not None and is_translated(processor, chunk):
+                continue
+            requests += 1
+            selected = processor.context_policy.select(selected, prefix_length)
+            prompt_tokens += count_tokens(selected)
+            reply_tokens = estimate(reply)
+            if processor.profile is not None:
+                max_tokens = processor.profile.max_reply_tokens(
+                    count_tokens(selected[-1:])
+                )
+                reply_tokens = min(reply_tokens, max_tokens)
+            completion_tokens += reply_tokens
+            chunk_seconds.append(self.request_seconds(reply_tokens))
+        if summaries is None:
+            seconds += sum(chunk_seconds)
+        elif chunk_seconds:
+            # Roughly the time of the concurrent requests on the slots.
+            slots = max(1, processor.chunk_concurrency)
+            seconds += max(max(chunk_seconds), sum(chunk_seconds) / slots)
+
+        return JobPlan(
+            file_path=processor.file_path,
+            model=processor.model,
+            requests=requests,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            seconds=seconds,
+        )
+
+    def plan_pack(
+        self, processors: list[FileProcessor], acknowledge: bool = True
+    ) -> JobPlan:
+        """Estimate the request for a pack of small files."""
+        lead = processors[0]
+        estimate = lead.token_estimator
+        lead.messages = lead.build_initial_message()
+        prompt_tokens = completion_tokens = 0
+        seconds = 0.0
+        if acknowledge:
+            prompt_tokens = estimate(lead.messages[0].content)
+            completion_tokens = self.ack_tokens
+            seconds = self.request_seconds(self.ack_tokens)
+        lead.messages.append(Message("assistant", SYNTHETIC_ACKNOWLEDGEMENT))
+        lead.add_conversion_example_messages()
+        lead.messages.append(FilePack(processors).build_pack_message(processors))
+        prompt_tokens += sum(estimate(m.content) for m in lead.messages)
+        reply_tokens = estimate(
+            pack_files([self.synthetic_reply(p.file_content) for p in processors])
+        )
+        if lead.profile is not None:
+            reply_tokens = min(reply_tokens, lead.max_reply_tokens())
+        return JobPlan(
+            file_path=lead.file_path,
+            model=lead.model,
+            requests=int(acknowledge) + 1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens + reply_tokens,
+            seconds=seconds + self.request_seconds(reply_tokens),
+            files=len(processors),
+        )
+
+    def synthetic_reply(self, chunk: str) -> str:
+        size = int(len(chunk) * self.output_ratio)
+        return (chunk * (int(self.output_ratio) + 1))[:size]
+
+    def request_seconds(self, completion_tokens: int) -> float:
+        return self.request_overhead + completion_tokens / self.output_tokens_per_second
+
+    def project_wall_time(self, plan: ConversionPlan) -> float:
+        """Simulate the scheduler: jobs of every model run in order on the
+        model's workers, and at most `concurrency` jobs run at once."""
+        scheduler = Scheduler(
+            concurrency=self.converter.concurrency,
+            per_model_concurrency=self.converter.per_model_concurrency,
+            model_profiles=self.converter.model_profiles,
+        )
+        queues: dict[str, deque[float]] = {}
+        for job in plan.jobs:
+            queues.setdefault(job.model.id, deque()).append(job.seconds)
+        workers = {
+            model.id: scheduler.workers_for_model(model)
+            for model in self.converter.models
+        }
+        running: list[tuple[float, str]] = []
+        running_per_model = dict.fromkeys(queues, 0)
+        now = 0.0
+        while queues or running:
+            started = True
+            while started and len(running) < scheduler.concurrency:
+                started = False
+                # Start jobs round-robin, so that no model is starved.
+                for model_id in list(queues):
+                    if len(running) >= scheduler.concurrency:
+                        break
+                    if running_per_model[model_id] < workers[model_id]:
+                        heapq.heappush(
+                            running, (now + queues[model_id].popleft(), model_id)
+                        )
+                        running_per_model[model_id] += 1
+                        started = True
+                        if not queues[model_id]:
+                            del queues[model_id]
+            now, model_id = heapq.heappop(running)
+            running_per_model[model_id] -= 1
+
+        return max(now, self.rate_limited_time(plan))
+
+    def rate_limited_time(self, plan: ConversionPlan) -> float:
+        """The minimum time that the rate limits of each model allow."""
+        minimum = 0.0
+        for model_plan in plan.models.values():
+            if self.requests_per_minute:
+                minimum = max(
+                    minimum, model_plan.requests / self.requests_per_minute * 60
+                )
+            if self.tokens_per_minute:
+                minimum = max(
+                    minimum, model_plan.prompt_tokens / self.tokens_per_minute * 60
+                )
+        return minimum
@@ -1,13 +1,19 @@
 import asyncio
+import fnmatch
+import os
 import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
 from sqlite3 import Connection
-from typing import List
+from typing import AsyncIterator, Iterator, List
 
-from attrs import Factory, define
+from attrs import Factory, define, evolve, field
 from loguru import logger
 
+from plc.context_policy import ContextPolicy
+from plc.database import ConversionDatabase, DatabaseWriter, create_tables
 from plc.defaults import (
     DIRECTORY_PATH,
     default_convert_chunk_prompt,
@@ -15,11 +21,16 @@ from plc.defaults import (
     default_models,
     get_initial_prompt,
 )
-from plc.file_processor import FileProcessor
+from plc.file_pack import FilePack, FilePacker
+from plc.file_processor import AckKey, FileProcessor
 from plc.llm_provider import LlmProvider
+from plc.metrics import RunMetrics
 from plc.model import Model
+from plc.model_profile import ModelProfiles
 from plc.open_router_provider import OpenRouterProvider
 from plc.prog_lang_spec import prog_lang_specs
+from plc.scheduler import ConversionJob, Scheduler
+from plc.translation_memory import TranslationMemory
 
 
 @define
@@ -28,15 +39,69 @@ class PolyglotLanguageConverter:
     models: List[Model] = Factory(list)
     from_slug: str = "java"
     to_slug: str = "csharp"
+    # Convert every file into all of these languages in a single run; if it
+    # is empty, only `to_slug` is the target.
+    to_slugs: list[str] = Factory(list)
+    # If set, the initial prompt for all targets; otherwise each target gets
+    # its default prompt.
     initial_prompt: str = ""
     convert_chunk_prompt: str = default_convert_chunk_prompt
     db_path: Path | str = ":memory:"
     directory_path: Path = DIRECTORY_PATH
     max_chunk_size: int = 8192
+    chunk_token_budget: int | None = None
+    accurate_token_estimates: bool = False
+    concurrency: int = 8
+    per_model_concurrency: int | None = None
+    # Limits and prices per model; they size the chunks and the replies of
+    # each model and cap its concurrency.
+    model_profiles: ModelProfiles = Factory(ModelProfiles)
+    context_policy: ContextPolicy = Factory(ContextPolicy)
+    streaming: bool = False
+    # Number of files that are read and split ahead of the LLM workers, and
+    # the number of threads that do it.
+    prefetch_files: int = 16
+    prefetch_threads: int = 4
+    metrics: RunMetrics = Factory(RunMetrics)
+    # If set, the metrics are also written every `metrics_interval` seconds
+    # during the run, not only at its end.
+    metrics_interval: float | None = None
+    ack_mode: str = "request"
+    prompt_caching: bool = False
+    # Retries of transient failures of a chunk before its file fails.
+    chunk_retries: int = 2
+    # Reuse the replies for chunks that were converted before, in any file.
+    use_translation_memory: bool = False
+    # Convert the chunks of each file concurrently instead of in one
+    # conversation, see `FileProcessor.independent_chunks`.
+    independent_chunks: bool = False
+    chunk_concurrency: int = 4
+    # Convert files of at most `pack_max_file_tokens` estimated tokens in
+    # packs of up to `pack_token_budget` tokens (or what the model's profile
+    # allows), one request per pack.
+    pack_small_files: bool = False
+    pack_token_budget: int = 2000
+    pack_max_file_tokens: int = 500
+    _ack_cache: dict[AckKey, asyncio.Future] = field(
+        factory=dict, init=False, repr=False
+    )
+    _translation_memory: TranslationMemory | None = field(
+        default=None, init=False, repr=False
+    )
+    _initial_prompts: dict[str, str] = field(factory=dict, init=False, repr=False)
+    # Chunk size limits learned from truncated replies during a run.
+    _chunk_size_limits: dict[str, int] = field(factory=dict, init=False, repr=False)
 
     def __attrs_post_init__(self):
-        if not self.initial_prompt:
-            self.initial_prompt = get_initial_prompt(self.from_slug, self.to_slug)
+        if self.to_slugs:
+            self.to_slug = self.to_slugs[0]
+        else:
+            self.to_slugs = [self.to_slug]
+        for to_slug in self.to_slugs:
+            self._initial_prompts[to_slug] = self.initial_prompt or (
+                get_initial_prompt(self.from_slug, to_slug)
+            )
+        self.initial_prompt = self._initial_prompts[self.to_slug]
 
     @property
     def glob_pattern(self):
@@ -53,20 +118,8 @@ class PolyglotLanguageConverter:
     @contextmanager
     def connect_to_database(self) -> Connection:
         conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS converted_files (
-                    file_name TEXT,
-                    model TEXT,
-                    from_lang TEXT,
-                    to_lang TEXT,
-                    PRIMARY KEY (file_name, model, from_lang, to_lang)
-                )
-                """
-            )
-            cursor.close()
+            create_tables(conn)
             yield conn
         finally:
             conn.close()
@@ -76,39 +129,269 @@ class PolyglotLanguageConverter:
         max_files: int = None,
         reprocess: bool = False,
     ):
+        scheduler = Scheduler(
+            concurrency=self.concurrency,
+            per_model_concurrency=self.per_model_concurrency,
+            queue_size=self.prefetch_files,
+            model_profiles=self.model_profiles,
+        )
+        # Cached acknowledgements are futures of the previous run's event loop.
+        self._ack_cache.clear()
+        self._chunk_size_limits.clear()
+        await self.llm_provider.open()
+        metrics_writer = None
+        if self.metrics_interval:
+            metrics_writer = asyncio.create_task(self.write_metrics_periodically())
+        try:
+            with self.connect_to_database() as conn, self.database_writer() as writer:
+                database = self.load_database(conn, writer)
+                if self.use_translation_memory:
+                    self._translation_memory = TranslationMemory(database)
+
+                async def handle(job: ConversionJob):
+                    processor = job.processor or self.create_file_processor(
+                        job, conn, reprocess, database
+                    )
+                    for file_processor in (processor, *job.pack):
+                        file_processor.request_slots = scheduler.slots
+                    if job.pack:
+                        await FilePack([processor, *job.pack]).process()
+                    else:
+                        await processor.process()
+
+                jobs = self.prefetch_jobs(conn, max_files, reprocess, database)
+                if self.pack_small_files:
+                    jobs = self.pack_jobs(jobs, reprocess)
+                await scheduler.run(jobs, handle)
+        finally:
+            if metrics_writer is not None:
+                metrics_writer.cancel()
+            await self.llm_provider.close()
+            if self._translation_memory is not None:
+                self._translation_memory.log_summary()
+                self._translation_memory = None
+            self.metrics.log_summary()
+            self.metrics.write()
+
+    def load_database(
+        self,
+        conn: Connection,
+        writer: DatabaseWriter | None = None,
+        read_only: bool = False,
+    ) -> ConversionDatabase:
+        """Load the database, with the translations for the models and targets
+        of this converter if the translation memory is used."""
+        if not self.use_translation_memory:
+            return ConversionDatabase.load(conn, writer, read_only)
+        return ConversionDatabase.load(
+            conn,
+            writer,
+            read_only,
+            models=[model.id for model in self.models],
+            to_langs=self.to_slugs,
+        )
+
+    async def write_metrics_periodically(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            # The summaries are small, so writing them does not need a thread
+            # (which would have to synchronize with the metrics being updated).
+            self.metrics.write()
+
+    @contextmanager
+    def database_writer(self) -> Iterator[DatabaseWriter | None]:
+        """Run a background writer for databases stored in a file.
+
+        In-memory databases cannot be shared between connections, so they are
+        written directly."""
+        if str(self.db_path) == ":memory:":
+            yield None
+            return
+        writer = DatabaseWriter(self.db_path)
+        writer.start()
+        try:
+            yield writer
+        finally:
+            writer.close()
+
+    def iterate_file_paths(self, max_files: int = None) -> Iterator[Path]:
+        """Walk the directory in sorted order and yield the files to convert.
+
+        Directories whose names would cause all their files to be skipped are
+        not entered."""
         num_files_processed = 0
-        with self.connect_to_database() as conn:
-            logger.trace(
-                f"Directory path is {self.directory_path}, "
-                f"glob pattern is {self.glob_pattern}"
+        logger.trace(
+            f"Directory path is {self.directory_path}, "
+            f"glob pattern is {self.glob_pattern}"
+        )
+        for directory, dir_names, file_names in os.walk(self.directory_path):
+            directory = Path(directory)
+            dir_names[:] = sorted(
+                name
+                for name in dir_names
+                if not self.skip_file_because_of_name(directory / name)
             )
-            for file_path in self.directory_path.rglob(self.glob_pattern):
+            for file_name in sorted(fnmatch.filter(file_names, self.glob_pattern)):
+                file_path = directory / file_name
+                if self.skip_file_because_of_name(file_path):
+                    continue
                 if max_files and num_files_processed >= max_files:
                     logger.info(f"Exit: {num_files_processed} files processed.")
+                    return
+                logger.info(f"Processing {file_path}")
+                num_files_processed += 1
+                yield file_path
+
+    def iterate_jobs(self, max_files: int = None) -> Iterator[ConversionJob]:
+        for file_path in self.iterate_file_paths(max_files):
+            yield from self.jobs_for_file(file_path)
+
+    def jobs_for_file(self, file_path: Path) -> Iterator[ConversionJob]:
+        for to_slug in self.to_slugs:
+            for model in self.models:
+                yield ConversionJob(file_path=file_path, model=model, to_slug=to_slug)
+
+    def prepare_jobs(
+        self,
+        file_path: Path,
+        conn: Connection,
+        reprocess: bool = False,
+        database: ConversionDatabase | None = None,
+    ) -> list[ConversionJob]:
+        """Read a file once for all models and targets and split it.
+
+        This blocks, so it is run in a worker thread. Files that cannot be
+        read are logged and skipped."""
+        try:
+            file_content = file_path.read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(f"Cannot read {file_path}: {e}")
+            return []
+        jobs = []
+        for job in self.jobs_for_file(file_path):
+            processor = self.create_file_processor(job, conn, reprocess, database)
+            processor.prepare(file_content)
+            jobs.append(evolve(job, processor=processor))
+        return jobs
+
+    async def prefetch_jobs(
+        self,
+        conn: Connection,
+        max_files: int = None,
+        reprocess: bool = False,
+        database: ConversionDatabase | None = None,
+    ) -> AsyncIterator[ConversionJob]:
+        """Yield prepared jobs in order, walking, reading and splitting files
+        in a thread pool.
+
+        At most `prefetch_files` files are prepared ahead of the consumer, so
+        the memory used for file contents stays bounded however large the
+        directory tree is."""
+        loop = asyncio.get_running_loop()
+        file_paths = self.iterate_file_paths(max_files)
+        pending: deque[asyncio.Future] = deque()
+        exhausted = False
+        executor = ThreadPoolExecutor(
+            max_workers=self.prefetch_threads, thread_name_prefix="plc-prefetch"
+        )
+        try:
+            while True:
+                while not exhausted and len(pending) < self.prefetch_files:
+                    file_path = await loop.run_in_executor(
+                        executor, next, file_paths, None
+                    )
+                    if file_path is None:
+                        exhausted = True
+                    else:
+                        pending.append(
+                            loop.run_in_executor(
+                                executor,
+                                self.prepare_jobs,
+                                file_path,
+                                conn,
+                                reprocess,
+                                database,
+                            )
+                        )
+                if not pending:
                     break
+                for job in await pending.popleft():
+                    yield job
+        finally:
+            # Do not block the event loop if the run is cancelled.
+            executor.shutdown(wait=False, cancel_futures=True)
 
-                if self.skip_file_because_of_name(file_path):
-                    continue
+    async def pack_jobs(
+        self, jobs: AsyncIterator[ConversionJob], reprocess: bool = False
+    ) -> AsyncIterator[ConversionJob]:
+        """Combine prepared jobs for small files into packs, see `FilePacker`.
 
-                logger.info(f"Processing {file_path}")
-                num_files_processed += 1
+        Files that have already been processed are dropped first, so that
+        they do not take the place of files that need converting in a pack
+        (and so that packs are those predicted by the planner)."""
+        packer = self.file_packer()
+        async for job in jobs:
+            processor = job.processor
+            if (
+                processor is not None
+                and not reprocess
+                and processor.has_file_been_processed()
+            ):
+                logger.info(
+                    f"Skipping {processor.file_path} for model {job.model.id} "
+                    f"(already processed)"
+                )
+                continue
+            for ready_job in packer.add(job):
+                yield ready_job
+        for ready_job in packer.flush():
+            yield ready_job
 
-                tasks = [
-                    FileProcessor(
-                        file_path=file_path,
-                        llm_provider=self.llm_provider,
-                        model=model,
-                        from_slug=self.from_slug,
-                        to_slug=self.to_slug,
-                        conn=conn,
-                        max_chunk_size=self.max_chunk_size,
-                        initial_prompt=self.initial_prompt,
-                        convert_chunk_prompt=self.convert_chunk_prompt,
-                        reprocess=reprocess,
-                    ).process()
-                    for model in self.models
-                ]
-                await asyncio.gather(*tasks, return_exceptions=True)
+    def file_packer(self) -> FilePacker:
+        def token_budget(model: Model) -> int:
+            profile = self.model_profiles.for_model(model)
+            if profile is None:
+                return self.pack_token_budget
+            return min(self.pack_token_budget, profile.max_chunk_tokens)
+
+        return FilePacker(
+            token_budget=token_budget, max_file_tokens=self.pack_max_file_tokens
+        )
+
+    def create_file_processor(
+        self,
+        job: ConversionJob,
+        conn: Connection,
+        reprocess: bool = False,
+        database: ConversionDatabase | None = None,
+    ) -> FileProcessor:
+        return FileProcessor(
+            file_path=job.file_path,
+            llm_provider=self.llm_provider,
+            model=job.model,
+            from_slug=self.from_slug,
+            to_slug=job.to_slug or self.to_slug,
+            conn=conn,
+            database=database,
+            max_chunk_size=self.max_chunk_size,
+            chunk_token_budget=self.chunk_token_budget,
+            accurate_token_estimates=self.accurate_token_estimates,
+            initial_prompt=self._initial_prompts[job.to_slug or self.to_slug],
+            convert_chunk_prompt=self.convert_chunk_prompt,
+            reprocess=reprocess,
+            context_policy=self.context_policy,
+            streaming=self.streaming,
+            metrics=self.metrics,
+            ack_mode=self.ack_mode,
+            ack_cache=self._ack_cache,
+            prompt_caching=self.prompt_caching,
+            translation_memory=self._translation_memory,
+            chunk_retries=self.chunk_retries,
+            chunk_size_limits=self._chunk_size_limits,
+            profile=self.model_profiles.for_model(job.model),
+            independent_chunks=self.independent_chunks,
+            chunk_concurrency=self.chunk_concurrency,
+        )
 
     @staticmethod
     def skip_file_because_of_name(file_path):
@@ -0,0 +1,262 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from attrs import Factory, define, evolve, field
+from loguru import logger
+
+from plc.completion import Completion
+from plc.errors import RateLimitError, RetryableProviderError
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.model import Model
+from plc.token_estimator import estimate_message_tokens
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with "equal jitter" for the given (0-based) attempt."""
+    delay = min(max_delay, base_delay * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+@define
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float = field()
+    updated: float = 0.0
+
+    @tokens.default
+    def _tokens_default(self):
+        return self.capacity
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+    def time_until_available(self, amount: float, now: float) -> float:
+        self.refill(now)
+        # Requests larger than the bucket would never fit; let them drain it.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+@define
+class AdaptiveRateLimiter:
+    """Token-bucket limits on requests and tokens per minute for one model.
+
+    The configured rates are scaled by a factor that is decreased
+    multiplicatively whenever the provider reports a rate limit and increased
+    additively after every successful request (AIMD), so that we settle just
+    below the limits that the provider actually enforces.
+
+    Without a configured request rate, a rate limit sets it to the rate of
+    the requests sent in the preceding minute, which the factor then scales;
+    so the limiter adapts even if no limits are given. At least
+    `min_requests_to_learn` requests are needed to estimate that rate."""
+
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+    decrease_factor: float = 0.5
+    increase_step: float = 0.05
+    min_factor: float = 0.05
+    clock: Callable[[], float] = time.monotonic
+    factor: float = 1.0
+    blocked_until: float = 0.0
+    min_requests_to_learn: int = 10
+    request_bucket: TokenBucket | None = field(init=False, default=None)
+    token_bucket: TokenBucket | None = field(init=False, default=None)
+    _lock: asyncio.Lock = field(init=False, factory=asyncio.Lock)
+    # When the requests of the last minute were sent.
+    _sent: deque[float] = field(init=False, factory=deque)
+
+    def __attrs_post_init__(self):
+        now = self.clock()
+        if self.requests_per_minute:
+            rate = self.requests_per_minute / 60
+            # Allow a burst of about one second worth of requests.
+            self.request_bucket = TokenBucket(rate, max(1.0, rate), updated=now)
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute / 60
+            self.token_bucket = TokenBucket(rate, max(1.0, rate * 10), updated=now)
+
+    def time_until_available(self, num_tokens: int) -> float:
+        now = self.clock()
+        delay = max(0.0, self.blocked_until - now)
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.time_until_available(1, now))
+        if self.token_bucket is not None:
+            delay = max(
+                delay, self.token_bucket.time_until_available(num_tokens, now)
+            )
+        return delay
+
+    async def acquire(self, num_tokens: int = 0):
+        # The lock serves waiting requests in FIFO order.
+        async with self._lock:
+            while (delay := self.time_until_available(num_tokens)) > 0:
+                await asyncio.sleep(delay)
+            if self.request_bucket is not None:
+                self.request_bucket.consume(1)
+            if self.token_bucket is not None:
+                self.token_bucket.consume(num_tokens)
+            self._sent.append(self.clock())
+            self.forget_old_requests()
+
+    def on_success(self):
+        if self.factor < 1.0:
+            self._set_factor(self.factor + self.increase_step)
+
+    def on_rate_limited(self, retry_after: float | None = None):
+        if self.request_bucket is None:
+            self.learn_request_rate()
+        self._set_factor(self.factor * self.decrease_factor)
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, self.clock() + retry_after)
+
+    def learn_request_rate(self):
+        """Limit requests to the rate at which they were sent in the last
+        minute."""
+        now = self.clock()
+        self.forget_old_requests()
+        if len(self._sent) < self.min_requests_to_learn:
+            return
+        seconds = max(1.0, now - self._sent[0])
+        self.requests_per_minute = len(self._sent) / seconds * 60
+        rate = self.requests_per_minute / 60
+        self.request_bucket = TokenBucket(rate, max(1.0, rate), 0.0, updated=now)
+        logger.info(
+            f"Rate limited at {self.requests_per_minute:.0f} requests per minute; "
+            f"limiting requests from now on"
+        )
+
+    def forget_old_requests(self):
+        now = self.clock()
+        while self._sent and self._sent[0] < now - 60:
+            self._sent.popleft()
+
+    def _set_factor(self, factor: float):
+        self.factor = min(1.0, max(self.min_factor, factor))
+        now = self.clock()
+        if self.request_bucket is not None:
+            self.request_bucket.refill(now)
+            self.request_bucket.rate = self.requests_per_minute / 60 * self.factor
+        if self.token_bucket is not None:
+            self.token_bucket.refill(now)
+            self.token_bucket.rate = self.tokens_per_minute / 60 * self.factor
+
+
+@define
+class RateLimitedProvider(LlmProvider):
+    """Wrap an `LlmProvider` with per-model rate limits and retries.
+
+    Retryable errors are retried with exponential backoff and jitter; a
+    `Retry-After` sent by the provider takes precedence over the backoff and
+    pauses all requests to the affected model."""
+
+    provider: LlmProvider
+    requests_per_minute: float | None = None
+    tokens_per_minute: float | None = None
+    max_retries: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    limiters: dict[str, AdaptiveRateLimiter] = Factory(dict)
+
+    def limiter_for(self, model: Model) -> AdaptiveRateLimiter:
+        if model.id not in self.limiters:
+            self.limiters[model.id] = AdaptiveRateLimiter(
+                requests_per_minute=self.requests_per_minute,
+                tokens_per_minute=self.tokens_per_minute,
+            )
+        return self.limiters[model.id]
+
+    async def open(self):
+        await self.provider.open()
+
+    async def close(self):
+        await self.provider.close()
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        return (await self.complete(messages, model)).content
+
+    async def stream_message(
+        self, messages: list[Message], model: Model, on_delta: Callable[[str], None]
+    ) -> str:
+        return (await self.complete(messages, model, on_delta)).content
+
+    async def complete(
+        self,
+        messages: list[Message],
+        model: Model,
+        on_delta: Callable[[str], None] | None = None,
+        max_tokens: int | None = None,
+    ) -> Completion:
+        if on_delta is None:
+            return await self._send_with_retries(
+                messages,
+                model,
+                lambda: self.provider.complete(
+                    messages, model, max_tokens=max_tokens
+                ),
+            )
+
+        received_delta = False
+
+        def forward_delta(delta: str):
+            nonlocal received_delta
+            received_delta = True
+            on_delta(delta)
+
+        # Once parts of the reply have been passed on, a retry would duplicate
+        # them; in that case the error is left to the caller.
+        return await self._send_with_retries(
+            messages,
+            model,
+            lambda: self.provider.complete(
+                messages, model, forward_delta, max_tokens=max_tokens
+            ),
+            can_retry=lambda: not received_delta,
+        )
+
+    async def _send_with_retries(
+        self,
+        messages: list[Message],
+        model: Model,
+        send: Callable[[], Awaitable[Completion]],
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> Completion:
+        limiter = self.limiter_for(model)
+        num_tokens = estimate_message_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(num_tokens)
+            try:
+                result = await send()
+            except RetryableProviderError as e:
+                if isinstance(e, RateLimitError):
+                    limiter.on_rate_limited(e.retry_after)
+                if not can_retry():
+                    raise
+                if attempt >= self.max_retries:
+                    e.retries_exhausted = True
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                if e.retry_after is not None:
+                    delay = e.retry_after + random.uniform(0, self.base_delay)
+                logger.info(
+                    f"{model.slug} returned status {e.status}; retrying in "
+                    f"{delay:.1f}s (attempt {attempt + 1} of {self.max_retries})"
+                )
+                await asyncio.sleep(delay)
+            else:
+                limiter.on_success()
+                return evolve(result, retries=result.retries + attempt)
@@ -0,0 +1,158 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncIterable, Awaitable, Callable, Iterable
+
+from attrs import define, evolve, field, frozen
+from loguru import logger
+
+from plc.fair_slots import FairSlots
+from plc.file_processor import FileProcessor
+from plc.model import Model
+from plc.model_profile import ModelProfiles
+
+
+@frozen
+class ConversionJob:
+    file_path: Path
+    model: Model
+    # The target language; `None` for the converter's default target.
+    to_slug: str | None = None
+    # A processor whose file has already been read and split, if any.
+    processor: FileProcessor | None = field(default=None, eq=False, repr=False)
+    # Processors for further small files that are converted together with
+    # the file of `processor` in a single request, see `FilePack`.
+    pack: tuple[FileProcessor, ...] = field(default=(), eq=False, repr=False)
+
+
+JobHandler = Callable[[ConversionJob], Awaitable[None]]
+
+
+async def _iterate(jobs: Iterable | AsyncIterable):
+    if isinstance(jobs, AsyncIterable):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
+
+
+@define
+class Scheduler:
+    """Run conversion jobs on a bounded pool of workers.
+
+    Every model has its own job queue served by its own workers, so a slow
+    model never blocks the jobs of the other models. The number of jobs that
+    run at the same time is limited by `concurrency` across all models, which
+    is shared fairly between the models that have jobs waiting (see
+    `FairSlots`), and by
+    `per_model_concurrency` for each individual model, and further by the
+    concurrency of the model's profile, if it has one. A model whose limit is
+    below its share leaves the rest of `concurrency` to the other models,
+    since jobs only take a slot while they run.
+
+    If `queue_size` is set, at most that many jobs with a prepared processor
+    wait to be started, counted across all models. This bounds the memory
+    held by files that are read in advance without letting a slow model with
+    a long queue stop the jobs of the other models: once the budget is used
+    up, jobs are queued without their processor, so that their file is read
+    again when they start, as long as some worker is idle; otherwise no
+    further jobs are taken from the source until a prepared job is started."""
+
+    concurrency: int = 8
+    per_model_concurrency: int | None = None
+    queue_size: int | None = None
+    model_profiles: ModelProfiles | None = None
+    # The slots of the current run; jobs that send several requests at the
+    # same time take a slot for each request beyond the first from here.
+    slots: FairSlots | None = field(default=None, init=False)
+
+    def workers_for_model(self, model: Model) -> int:
+        limits = [self.concurrency, self.per_model_concurrency]
+        if self.model_profiles is not None:
+            profile = self.model_profiles.for_model(model)
+            if profile is not None:
+                limits.append(profile.concurrency)
+        return max(1, min(limit for limit in limits if limit is not None))
+
+    async def run(
+        self,
+        jobs: Iterable[ConversionJob] | AsyncIterable[ConversionJob],
+        handler: JobHandler,
+    ):
+        if self.concurrency < 1:
+            raise ValueError(f"Concurrency must be positive, not {self.concurrency}.")
+        slots = self.slots = FairSlots(self.concurrency)
+        queues: dict[str, asyncio.Queue] = {}
+        workers: dict[str, list[asyncio.Task]] = {}
+        # Workers waiting for a job, by model.
+        idle: dict[str, int] = {}
+        num_prepared = 0
+        budget_changed = asyncio.Condition()
+
+        async def notify():
+            async with budget_changed:
+                budget_changed.notify_all()
+
+        async def work(model_id: str, queue: asyncio.Queue):
+            nonlocal num_prepared
+            while True:
+                idle[model_id] += 1
+                await notify()
+                item = await queue.get()
+                idle[model_id] -= 1
+                if item is None:
+                    return
+                job, prepared = item
+                try:
+                    async with slots.slot(model_id):
+                        if prepared:
+                            num_prepared -= 1
+                            await notify()
+                        await handler(job)
+                except Exception as e:
+                    logger.warning(
+                        f"Job for {job.file_path.name} with model "
+                        f"{job.model.slug} failed: {e}"
+                    )
+
+        def queue_for(model: Model) -> asyncio.Queue:
+            if model.id not in queues:
+                queue = asyncio.Queue()
+                queues[model.id] = queue
+                idle[model.id] = 0
+                workers[model.id] = [
+                    asyncio.create_task(work(model.id, queue))
+                    for _ in range(self.workers_for_model(model))
+                ]
+                logger.debug(
+                    f"Started {len(workers[model.id])} worker(s) for {model.slug}"
+                )
+            return queues[model.id]
+
+        def has_idle_worker() -> bool:
+            return any(idle[key] > queue.qsize() for key, queue in queues.items())
+
+        try:
+            async for job in _iterate(jobs):
+                queue = queue_for(job.model)
+                # Packs hold several processors and are never re-read.
+                prepared = job.processor is not None and not job.pack
+                if prepared and self.queue_size:
+                    async with budget_changed:
+                        await budget_changed.wait_for(
+                            lambda: num_prepared < self.queue_size
+                            or has_idle_worker()
+                        )
+                    if num_prepared >= self.queue_size:
+                        job = evolve(job, processor=None)
+                        prepared = False
+                if prepared:
+                    num_prepared += 1
+                queue.put_nowait((job, prepared))
+            for model_id, queue in queues.items():
+                for _ in workers[model_id]:
+                    queue.put_nowait(None)
+            await asyncio.gather(*(t for ts in workers.values() for t in ts))
+        finally:
+            for task in (t for ts in workers.values() for t in ts):
+                task.cancel()
@@ -0,0 +1,87 @@
+import math
+import re
+
+from attrs import evolve, frozen
+
+from plc.message import Message
+from plc.model import Model
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_message_tokens(messages: list[Message]) -> int:
+    return sum(estimate_tokens(m.content) for m in messages)
+
+
+# Pre-tokenization in the style of the BPE tokenizers used by current models:
+# words with an optional leading space, numbers in groups of up to three
+# digits, runs of punctuation and runs of whitespace.
+_PRE_TOKEN_PATTERN = re.compile(
+    r" ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
+
+
+@frozen
+class TokenEstimator:
+    """Estimate the number of tokens of a text without a tokenizer.
+
+    The fast mode only looks at the length of the text and charges extra for
+    non-ASCII characters, which most tokenizers split into more tokens. The
+    accurate mode pre-tokenizes the text like a BPE tokenizer and estimates
+    the number of tokens for each word; it is several times slower but
+    tracks differences between prose and code more closely."""
+
+    chars_per_token: float = 4.0
+    # Extra tokens for every additional UTF-8 byte of non-ASCII characters.
+    tokens_per_extra_byte: float = 0.5
+    # Average number of UTF-8 bytes of a word that fit into one token.
+    bytes_per_word_token: float = 5.0
+    accurate: bool = False
+
+    def __call__(self, text: str) -> int:
+        if self.accurate:
+            return self.count_pre_tokens(text)
+        return self.count_fast(text)
+
+    def count_fast(self, text: str) -> int:
+        tokens = len(text) / self.chars_per_token
+        if not text.isascii():
+            extra_bytes = len(text.encode("utf-8")) - len(text)
+            tokens += extra_bytes * self.tokens_per_extra_byte
+        return math.ceil(tokens)
+
+    def count_pre_tokens(self, text: str) -> int:
+        tokens = 0
+        for match in _PRE_TOKEN_PATTERN.finditer(text):
+            piece = match.group().lstrip(" ")
+            if not piece or piece.isspace():
+                tokens += 1
+            elif piece[0].isalpha():
+                num_bytes = len(piece.encode("utf-8"))
+                tokens += math.ceil(num_bytes / self.bytes_per_word_token)
+            else:
+                # Punctuation is merged into tokens of about two characters.
+                tokens += math.ceil(len(piece) / 2)
+        return tokens
+
+
+# Rough ratios for the tokenizers of the model families, keyed by the vendor
+# prefix of the OpenRouter model id.
+MODEL_FAMILY_ESTIMATORS: dict[str, TokenEstimator] = {
+    "anthropic": TokenEstimator(chars_per_token=3.5, bytes_per_word_token=4.5),
+    "openai": TokenEstimator(chars_per_token=4.0, bytes_per_word_token=5.5),
+    "google": TokenEstimator(chars_per_token=4.0, bytes_per_word_token=5.0),
+    "qwen": TokenEstimator(chars_per_token=3.8, bytes_per_word_token=5.0),
+    "meta-llama": TokenEstimator(chars_per_token=3.8, bytes_per_word_token=5.5),
+}
+DEFAULT_ESTIMATOR = TokenEstimator()
+
+
+def estimator_for_model(model: Model, accurate: bool = False) -> TokenEstimator:
+    family = model.id.split("/", 1)[0]
+    estimator = MODEL_FAMILY_ESTIMATORS.get(family, DEFAULT_ESTIMATOR)
+    return evolve(estimator, accurate=accurate)
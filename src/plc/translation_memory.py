@@ -0,0 +1,86 @@
+import asyncio
+
+from attrs import define, field
+from loguru import logger
+
+from plc.database import ConversionDatabase, TranslationKey
+from plc.file_utils import content_hash
+
+
+def normalize_chunk(chunk: str) -> str:
+    """Ignore differences in line endings, trailing whitespace and blank lines
+    around a chunk, which do not change its conversion."""
+    return "\n".join(line.rstrip() for line in chunk.splitlines()).strip("\n")
+
+
+def chunk_hash(chunk: str) -> str:
+    return content_hash(normalize_chunk(chunk))
+
+
+@define
+class TranslationMemory:
+    """Replies for chunks, shared between files and runs.
+
+    Replies are stored in the `translation_memory` table of `database`, which
+    has to be loaded with the models and target languages of the run. While
+    a chunk is being converted, other files that contain the same chunk wait
+    for its reply instead of sending it again.
+
+    A caller that gets no reply from `lookup()` is responsible for converting
+    the chunk and must call `finish()` afterwards, whether it succeeded or
+    not."""
+
+    database: ConversionDatabase
+    hits: int = 0
+    misses: int = 0
+    # Lookups that waited for a conversion in progress.
+    coalesced: int = 0
+    _pending: dict[TranslationKey, asyncio.Future] = field(factory=dict, repr=False)
+
+    async def lookup(self, key: TranslationKey) -> str | None:
+        while (future := self._pending.get(key)) is not None:
+            reply = await asyncio.shield(future)
+            if reply is not None:
+                self.coalesced += 1
+                return reply
+            # The conversion failed; the next waiter (maybe us) tries again.
+        reply = self.stored_reply(key)
+        if reply is not None:
+            self.hits += 1
+            return reply
+        self.misses += 1
+        self._pending[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def finish(
+        self, key: TranslationKey, reply: str | None, model_id: str | None = None
+    ):
+        """Record the reply for a chunk returned by `lookup()`; `None` if the
+        conversion failed.
+
+        A reply of another model than the one of `key` (`model_id`) is shared
+        with the waiting lookups, but stored for that model."""
+        if reply is not None:
+            chunk, key_model_id, *rest = key
+            self.database.save_translation(
+                (chunk, model_id or key_model_id, *rest), reply
+            )
+        self._pending.pop(key).set_result(reply)
+
+    def contains(self, key: TranslationKey) -> bool:
+        return key in self._pending or self.stored_reply(key) is not None
+
+    def stored_reply(self, key: TranslationKey) -> str | None:
+        return self.database.translation(key)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / lookups if lookups else 0.0
+
+    def log_summary(self):
+        logger.info(
+            f"Translation memory: {self.hits} hit(s), {self.coalesced} chunk(s) "
+            f"shared within the run, {self.misses} miss(es), hit rate "
+            f"{self.hit_rate:.1%}"
+        )
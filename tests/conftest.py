@@ -1,10 +1,13 @@
 import pytest
+import pytest_asyncio
 from attr import Factory
 from attrs import define
 
+from plc.database import create_tables
 from plc.file_processor import FileProcessor
 from plc.llm_provider import LlmProvider
 from plc.message import Message
+from plc.mock_open_router import MockOpenRouterServer
 from plc.model import Model
 
 
@@ -17,19 +20,7 @@ def in_memory_db():
     import sqlite3
 
     conn = sqlite3.connect(":memory:")
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS converted_files (
-            file_name TEXT,
-            model TEXT,
-            from_lang TEXT,
-            to_lang TEXT,
-            PRIMARY KEY (file_name, model, from_lang, to_lang)
-        )
-        """
-    )
-    conn.commit()
+    create_tables(conn)
     yield conn
     conn.close()
 
@@ -39,7 +30,7 @@ class LlmProviderSpy(LlmProvider):
     sent_messages: list[list[Message]] = Factory(list)
 
     async def send_message(self, messages: list[Message], model: Model) -> str:
-        self.sent_messages.append(messages)
+        self.sent_messages.append(list(messages))
         return f"Received {len(messages)} message(s)"
 
 
@@ -48,6 +39,12 @@ def llm_provider_spy():
     return LlmProviderSpy()
 
 
+@pytest_asyncio.fixture
+async def mock_open_router():
+    async with MockOpenRouterServer() as server:
+        yield server
+
+
 FILE_PROCESSOR_TEST_TExT = """// %% [markdown] tags=["slide"]
 // # This is a slide
 
@@ -0,0 +1,172 @@
+import sqlite3
+
+import pytest
+
+from conftest import LlmProviderSpy
+from plc.cassette import CassetteProvider, request_key
+from plc.completion import Completion, Usage
+from plc.errors import CassetteMissError
+from plc.message import Message
+from plc.model import Model
+
+MODEL = Model("meta/llama", "llama")
+
+
+class TruncatingProvider(LlmProviderSpy):
+    async def complete(self, messages, model, on_delta=None, max_tokens=None):
+        self.sent_messages.append(list(messages))
+        usage = Usage(prompt_tokens=10, completion_tokens=5, cost=0.01)
+        return Completion("Cut o", usage=usage, finish_reason="length")
+
+
+def messages(text: str) -> list[Message]:
+    return [Message("user", text)]
+
+
+def test_request_key_depends_on_model_and_messages():
+    key = request_key(messages("Hello"), MODEL)
+    assert key == request_key(messages("Hello"), MODEL)
+    assert key != request_key(messages("Hello!"), MODEL)
+    assert key != request_key(messages("Hello"), Model("other/model", "other"))
+    assert key != request_key([Message("assistant", "Hello")], MODEL)
+
+
+@pytest.mark.asyncio
+async def test_replay_returns_recorded_responses_without_network(tmp_path):
+    spy = LlmProviderSpy()
+    recorder = CassetteProvider(tmp_path / "cassette.db", spy, mode="record")
+    await recorder.open()
+    recorded = await recorder.send_message(messages("Hello"), MODEL)
+    await recorder.close()
+
+    player = CassetteProvider(tmp_path / "cassette.db", mode="strict")
+    await player.open()
+    assert await player.send_message(messages("Hello"), MODEL) == recorded
+    await player.close()
+
+    assert len(spy.sent_messages) == 1
+    assert player.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_strict_replay_fails_on_miss(tmp_path):
+    player = CassetteProvider(tmp_path / "cassette.db", mode="strict")
+    with pytest.raises(CassetteMissError):
+        await player.send_message(messages("Hello"), MODEL)
+
+
+@pytest.mark.asyncio
+async def test_replay_mode_records_misses(tmp_path):
+    spy = LlmProviderSpy()
+    cassette = CassetteProvider(tmp_path / "cassette.db", spy)
+    await cassette.send_message(messages("Hello"), MODEL)
+    await cassette.send_message(messages("Hello"), MODEL)
+
+    assert len(spy.sent_messages) == 1
+    assert (cassette.hits, cassette.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_max_entries_evicts_least_recently_used(tmp_path):
+    cassette = CassetteProvider(
+        tmp_path / "cassette.db", LlmProviderSpy(), max_entries=2
+    )
+    await cassette.send_message(messages("first"), MODEL)
+    await cassette.send_message(messages("second"), MODEL)
+    await cassette.send_message(messages("first"), MODEL)
+    await cassette.send_message(messages("third"), MODEL)
+
+    assert cassette.lookup(request_key(messages("first"), MODEL)) is not None
+    assert cassette.lookup(request_key(messages("second"), MODEL)) is None
+    assert cassette.lookup(request_key(messages("third"), MODEL)) is not None
+
+
+@pytest.mark.asyncio
+async def test_max_bytes_bounds_cassette_size(tmp_path):
+    cassette = CassetteProvider(
+        tmp_path / "cassette.db", LlmProviderSpy(), max_bytes=100
+    )
+    for i in range(20):
+        await cassette.send_message(messages(f"message {i}"), MODEL)
+
+    total_size = cassette.connect().execute("SELECT SUM(size) FROM cassette")
+    assert total_size.fetchone()[0] <= 100
+
+
+def test_invalid_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        CassetteProvider(tmp_path / "cassette.db", LlmProviderSpy(), mode="rewind")
+
+
+@pytest.mark.asyncio
+async def test_replayed_stream_reports_whole_response(tmp_path):
+    cassette = CassetteProvider(tmp_path / "cassette.db", LlmProviderSpy())
+    recorded_deltas, replayed_deltas = [], []
+    await cassette.stream_message(messages("Hello"), MODEL, recorded_deltas.append)
+    await cassette.stream_message(messages("Hello"), MODEL, replayed_deltas.append)
+
+    assert replayed_deltas == recorded_deltas == ["Received 1 message(s)"]
+    assert cassette.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_replay_keeps_finish_reason_and_usage(tmp_path):
+    recorder = CassetteProvider(
+        tmp_path / "cassette.db", TruncatingProvider(), mode="record"
+    )
+    await recorder.complete(messages("Hello"), MODEL)
+
+    player = CassetteProvider(tmp_path / "cassette.db", mode="strict")
+    completion = await player.complete(messages("Hello"), MODEL)
+
+    assert completion.content == "Cut o"
+    assert completion.finish_reason == "length"
+    assert completion.usage == Usage(prompt_tokens=10, completion_tokens=5)
+    assert completion.cached
+
+
+@pytest.mark.asyncio
+async def test_reply_of_another_model_is_recorded_for_that_model(tmp_path):
+    other = Model("qwen/qwen", "qwen")
+
+    class FallbackProvider(LlmProviderSpy):
+        async def complete(self, messages, model, on_delta=None, max_tokens=None):
+            return Completion("From qwen", model=other)
+
+    cassette = CassetteProvider(tmp_path / "cassette.db", FallbackProvider())
+    await cassette.complete(messages("Hello"), MODEL)
+
+    assert cassette.lookup(request_key(messages("Hello"), MODEL)) is None
+    assert cassette.lookup(request_key(messages("Hello"), other)).content == (
+        "From qwen"
+    )
+
+
+@pytest.mark.asyncio
+async def test_replay_writes_order_of_use_only_with_next_write(tmp_path):
+    cassette = CassetteProvider(tmp_path / "cassette.db", LlmProviderSpy())
+    await cassette.send_message(messages("Hello"), MODEL)
+    conn = cassette.connect()
+    changes = conn.total_changes
+
+    for _ in range(5):
+        await cassette.send_message(messages("Hello"), MODEL)
+    assert conn.total_changes == changes
+    await cassette.close()
+
+    reopened = sqlite3.connect(tmp_path / "cassette.db")
+    assert reopened.execute("SELECT last_used FROM cassette").fetchone() == (6,)
+
+
+@pytest.mark.asyncio
+async def test_requests_with_other_max_tokens_are_not_replayed(tmp_path):
+    spy = LlmProviderSpy()
+    cassette = CassetteProvider(tmp_path / "cassette.db", spy)
+    await cassette.complete(messages("Hello"), MODEL, max_tokens=100)
+    await cassette.complete(messages("Hello"), MODEL, max_tokens=200)
+    await cassette.complete(messages("Hello"), MODEL, max_tokens=100)
+
+    assert len(spy.sent_messages) == 2
+    assert request_key(messages("Hello"), MODEL) != request_key(
+        messages("Hello"), MODEL, max_tokens=100
+    )
@@ -0,0 +1,71 @@
+import pytest
+
+from plc.context_policy import ContextPolicy
+from plc.message import Message
+
+PREFIX = [
+    Message("user", "prompt"),
+    Message("assistant", "ack"),
+    Message("user", "example"),
+    Message("assistant", "converted example"),
+]
+
+
+def conversation(num_exchanges: int) -> list[Message]:
+    exchanges = []
+    for i in range(num_exchanges):
+        exchanges += [Message("user", f"chunk {i}"), Message("assistant", f"c{i}")]
+    return PREFIX + exchanges + [Message("user", "next chunk")]
+
+
+def test_full_history_sends_all_messages():
+    messages = conversation(5)
+    assert ContextPolicy().select(messages, len(PREFIX)) == messages
+
+
+def test_max_exchanges_keeps_prefix_and_last_exchanges():
+    messages = conversation(5)
+    selected = ContextPolicy(max_exchanges=2).select(messages, len(PREFIX))
+    assert selected == PREFIX + messages[-5:]
+
+
+def test_max_exchanges_zero_sends_only_prefix_and_new_message():
+    messages = conversation(5)
+    selected = ContextPolicy(max_exchanges=0).select(messages, len(PREFIX))
+    assert selected == PREFIX + messages[-1:]
+
+
+def test_max_exchanges_larger_than_history_sends_all_messages():
+    messages = conversation(2)
+    assert ContextPolicy(max_exchanges=10).select(messages, len(PREFIX)) == messages
+
+
+def test_max_tokens_drops_oldest_exchanges():
+    messages = conversation(5)
+    # Every message is estimated at 2 tokens, i.e., 4 tokens per exchange.
+    selected = ContextPolicy(max_tokens=10 + 2 + 8).select(messages, len(PREFIX))
+    assert selected == PREFIX + messages[-5:]
+
+
+def test_max_tokens_never_drops_prefix_or_new_message():
+    messages = conversation(5)
+    selected = ContextPolicy(max_tokens=1).select(messages, len(PREFIX))
+    assert selected == PREFIX + messages[-1:]
+
+
+@pytest.mark.parametrize(
+    "spec, expected",
+    [
+        ("full", ContextPolicy()),
+        ("last:3", ContextPolicy(max_exchanges=3)),
+        ("tokens:4000", ContextPolicy(max_tokens=4000)),
+    ],
+)
+def test_parse(spec, expected):
+    assert ContextPolicy.parse(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["", "last", "last:x", "tokens:-1", "full:1"])
+def test_parse_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        ContextPolicy.parse(spec)
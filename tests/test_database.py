@@ -0,0 +1,110 @@
+import sqlite3
+
+from plc.database import ConversionDatabase, DatabaseWriter, create_tables
+
+
+def test_create_tables_migrates_old_converted_files_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE converted_files (file_name TEXT, model TEXT, "
+        "from_lang TEXT, to_lang TEXT, "
+        "PRIMARY KEY (file_name, model, from_lang, to_lang))"
+    )
+    conn.execute("INSERT INTO converted_files VALUES ('a.java', 'm', 'java', 'cs')")
+
+    create_tables(conn)
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(converted_files)")}
+    assert {"source_hash", "prompt_hash"} <= columns
+    assert conn.execute("SELECT COUNT(*) FROM converted_files").fetchone() == (1,)
+
+
+def test_create_tables_is_idempotent():
+    conn = sqlite3.connect(":memory:")
+    create_tables(conn)
+    create_tables(conn)
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    assert {"converted_files", "chunk_checkpoints"} <= tables
+
+
+KEY = ("/src/a.java", "m", "java", "csharp")
+
+
+def test_conversion_database_loads_converted_files_and_checkpoints():
+    conn = sqlite3.connect(":memory:")
+    create_tables(conn)
+    conn.execute(
+        "INSERT INTO converted_files VALUES (?, ?, ?, ?, ?, ?)", (*KEY, "s", "p")
+    )
+    conn.execute(
+        "INSERT INTO chunk_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (*KEY, 0, "h", "reply"),
+    )
+
+    database = ConversionDatabase.load(conn)
+
+    assert database.converted_file(KEY) == ("s", "p")
+    moved_key = ("/dst/a.java", *KEY[1:])
+    assert database.files_with_content(moved_key, "s", "p") == {"/src/a.java"}
+    assert database.chunk_checkpoints(KEY) == {0: ("h", "reply")}
+
+
+def test_conversion_database_loads_translations_of_given_models_and_targets():
+    conn = sqlite3.connect(":memory:")
+    create_tables(conn)
+    keys = [
+        ("c", "m", "java", "csharp", "p"),
+        ("c", "other", "java", "csharp", "p"),
+        ("c", "m", "java", "python", "p"),
+    ]
+    for key in keys:
+        conn.execute(
+            "INSERT INTO translation_memory VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, f"reply {key[1]} {key[3]}"),
+        )
+
+    database = ConversionDatabase.load(conn, models=["m"], to_langs=["csharp"])
+
+    assert database.translations == {keys[0]: "reply m csharp"}
+    assert ConversionDatabase.load(conn).translations == {}
+
+
+def test_conversion_database_writes_through_writer(tmp_path):
+    db_path = tmp_path / "processed.sqlite3"
+    conn = sqlite3.connect(db_path)
+    create_tables(conn)
+    writer = DatabaseWriter(db_path)
+    writer.start()
+    database = ConversionDatabase.load(conn, writer)
+
+    database.save_chunk_checkpoint(KEY, 0, "h", "reply")
+    database.note_file_converted(KEY, "s", "p")
+    database.clear_chunk_checkpoints(KEY)
+    # Changes are visible immediately, before they have been written.
+    assert database.converted_file(KEY) == ("s", "p")
+    writer.close()
+
+    reloaded = ConversionDatabase.load(conn)
+    assert reloaded.converted_file(KEY) == ("s", "p")
+    assert reloaded.chunk_checkpoints(KEY) == {}
+    assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+def test_database_writer_commits_queued_statements_in_batches(tmp_path):
+    db_path = tmp_path / "processed.sqlite3"
+    conn = sqlite3.connect(db_path)
+    create_tables(conn)
+    writer = DatabaseWriter(db_path, max_batch_size=10)
+    for index in range(25):
+        writer.execute(
+            "INSERT INTO chunk_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*KEY, index, "h", "reply"),
+        )
+    writer.start()
+    writer.flush()
+
+    assert conn.execute("SELECT COUNT(*) FROM chunk_checkpoints").fetchone() == (25,)
+    writer.close()
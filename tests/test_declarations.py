@@ -0,0 +1,48 @@
+from plc.declarations import declaration_summaries, extract_declarations
+
+JAVA_CELL = """// %%
+// class NotADeclaration {
+public class Point {
+    private final int x;
+
+    public Point(int x) { this.x = x; }
+
+    public int getX() {
+        if (x > 0) {
+            return scale(x);
+        }
+        System.out.println(x);
+        return x;
+    }
+}
+"""
+
+
+def test_extract_declarations_of_java_cell():
+    assert extract_declarations(JAVA_CELL) == [
+        "public class Point",
+        "public Point(int x)",
+        "public int getX()",
+    ]
+
+
+def test_extract_declarations_of_other_languages():
+    assert extract_declarations("def area(shape):\n    return 0\n") == [
+        "def area(shape)"
+    ]
+    assert extract_declarations("std::vector<int> squares(int n) {\n") == [
+        "std::vector<int> squares(int n)"
+    ]
+    assert extract_declarations("export function greet(name: string) {\n") == [
+        "export function greet(name: string)"
+    ]
+
+
+def test_summaries_contain_latest_declarations_of_earlier_chunks():
+    chunks = ["class A {}", "void f() {", "class B {}", "void f() {"]
+    assert declaration_summaries(chunks, max_declarations=2) == [
+        [],
+        ["class A"],
+        ["class A", "void f()"],
+        ["void f()", "class B"],
+    ]
@@ -0,0 +1,119 @@
+import pytest
+from attrs import define
+
+from conftest import LlmProviderSpy
+from plc.file_pack import pack_files, restore_trailing_newline, unpack_files
+from plc.message import Message
+from plc.model import Model
+from plc.planner import ConversionPlanner
+from plc.polyglot_language_converter import PolyglotLanguageConverter
+
+MODEL = Model(id="model1", slug="gpt")
+
+
+@define
+class PackEchoProvider(LlmProviderSpy):
+    """Echo the packed files of a request, or the chunk of other requests;
+    replies to packs are garbled if `garble_packs` is set."""
+
+    garble_packs: bool = False
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        self.sent_messages.append(list(messages))
+        content = messages[-1].content
+        if "<<<FILE 1>>>" not in content:
+            return content.rsplit("convert ", 1)[-1]
+        if self.garble_packs:
+            return "Here are the files!"
+        start = content.index("<<<FILE 1>>>")
+        end = content.rindex(">>>") + 3
+        return content[start:end].replace("File", "Converted")
+
+
+def make_converter(llm_provider, tmp_path, **kwargs):
+    return PolyglotLanguageConverter(
+        llm_provider=llm_provider,
+        models=[MODEL],
+        db_path=tmp_path / "processed.sqlite3",
+        directory_path=tmp_path,
+        convert_chunk_prompt="convert {chunk}",
+        pack_small_files=True,
+        **kwargs,
+    )
+
+
+def write_files(tmp_path, num_files: int):
+    for file_index in range(num_files):
+        (tmp_path / f"file{file_index}.java").write_text(f"// %%\nFile {file_index}\n")
+
+
+def test_unpack_files_requires_every_file_once_in_order():
+    packed = pack_files(["a\n", "b"])
+    assert unpack_files(f"Sure!\n{packed}\n", 2) == ["a", "b"]
+    assert unpack_files(packed, 3) is None
+    assert unpack_files(pack_files(["a", "b"]).replace("FILE 2", "FILE 3"), 2) is None
+    assert unpack_files(pack_files(["a", " "]), 2) is None
+
+
+def test_restore_trailing_newline_follows_the_source():
+    assert restore_trailing_newline("b", "a\n") == "b\n"
+    assert restore_trailing_newline("b\n", "a\n") == "b\n"
+    assert restore_trailing_newline("b", "a") == "b"
+
+
+@pytest.mark.asyncio
+async def test_small_files_are_converted_in_packs(tmp_path):
+    write_files(tmp_path, 5)
+    provider = PackEchoProvider()
+    # The files have 4 tokens each, so 3 of them fit into a pack.
+    await make_converter(provider, tmp_path, pack_token_budget=15).process_files()
+
+    # Like files converted alone, packed files keep their trailing newline.
+    assert (tmp_path / "file0.gpt.cs").read_text() == "// %%\nConverted 0\n"
+    assert (tmp_path / "file4.gpt.cs").read_text() == "// %%\nConverted 4\n"
+    # Two packs with an acknowledgement and a request each.
+    assert len(provider.sent_messages) == 4
+
+    await make_converter(provider, tmp_path).process_files()
+    assert len(provider.sent_messages) == 4
+
+
+@pytest.mark.asyncio
+async def test_incremental_run_packs_only_new_files(tmp_path):
+    write_files(tmp_path, 2)
+    provider = PackEchoProvider()
+    # Packs of up to three files.
+    await make_converter(provider, tmp_path, pack_token_budget=15).process_files()
+    assert len(provider.sent_messages) == 2
+
+    for file_index in range(2, 5):
+        (tmp_path / f"file{file_index}.java").write_text(f"// %%\nFile {file_index}\n")
+    converter = make_converter(provider, tmp_path, pack_token_budget=15)
+    plan = ConversionPlanner(converter).plan()
+    await converter.process_files()
+
+    # The three new files form one pack, as planned.
+    assert len(provider.sent_messages) == 2 + 2
+    assert "<<<FILE 3>>>" in provider.sent_messages[-1][-1].content
+    assert plan.requests == 2
+    assert (tmp_path / "file4.gpt.cs").read_text() == "// %%\nConverted 4\n"
+
+
+@pytest.mark.asyncio
+async def test_files_of_unusable_pack_reply_are_converted_separately(tmp_path):
+    write_files(tmp_path, 3)
+    provider = PackEchoProvider(garble_packs=True)
+    await make_converter(provider, tmp_path).process_files()
+
+    assert (tmp_path / "file1.gpt.cs").read_text() == "// %%\nFile 1\n"
+    # The pack, and an acknowledgement and a chunk for each file.
+    assert len(provider.sent_messages) == 2 + 3 * 2
+
+
+def test_plan_counts_one_request_per_pack(llm_provider_spy, tmp_path):
+    write_files(tmp_path, 4)
+    plan = ConversionPlanner(make_converter(llm_provider_spy, tmp_path)).plan()
+
+    assert plan.requests == 2
+    assert plan.models[MODEL.id].files == 4
+    assert len(plan.jobs) == 1
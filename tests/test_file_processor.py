@@ -1,8 +1,21 @@
+import asyncio
+import os
+
 import pytest
+from attrs import Factory, define, evolve
 
-from conftest import FILE_PROCESSOR_TEST_TExT
+from conftest import FILE_PROCESSOR_TEST_TExT, LlmProviderSpy
+from plc.completion import Completion
+from plc.context_policy import ContextPolicy
+from plc.errors import LlmProviderError, RetryableProviderError
+from plc.fair_slots import FairSlots
 from plc.message import Message
+from plc.metrics import RunMetrics
+from plc.model import Model
+from plc.model_profile import ModelProfile
+from plc.open_router_provider import OpenRouterProvider
 from plc.prog_lang_spec import prog_lang_conversions
+from plc.rate_limiter import RateLimitedProvider
 
 
 def test_output_file_path_is_correct(file_processor_stub):
@@ -63,3 +76,478 @@ def test_write_converted_chunks_doesnt_write_none(file_processor_stub):
     with pytest.raises(ValueError):
         file_processor_stub.write_converted_chunks_to_file(["Foo", None, "Bar"])
     assert file_processor_stub.output_file_path.exists() is False
+
+
+@define
+class FailingLlmProvider(LlmProviderSpy):
+    fail_on_request: int = 0
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        if len(self.sent_messages) + 1 == self.fail_on_request:
+            self.sent_messages.append(messages)
+            raise RuntimeError("Connection lost")
+        return await super().send_message(messages, model)
+
+
+def num_checkpoints(file_processor) -> int:
+    return len(file_processor.load_chunk_checkpoints())
+
+
+@pytest.mark.asyncio
+async def test_interrupted_conversion_resumes_from_first_missing_chunk(
+    file_processor_stub,
+):
+    file_processor_stub.max_chunk_size = 40
+    # Request 1 is the acknowledgement, requests 2-5 convert chunks 1-4.
+    file_processor_stub.llm_provider = FailingLlmProvider(fail_on_request=4)
+    await file_processor_stub.process()
+    assert not file_processor_stub.output_file_path.exists()
+    assert num_checkpoints(file_processor_stub) == 3
+
+    resumed_provider = LlmProviderSpy()
+    file_processor_stub.llm_provider = resumed_provider
+    await file_processor_stub.process()
+
+    assert file_processor_stub.output_file_path.exists()
+    assert len(resumed_provider.sent_messages) == 2
+    assert num_checkpoints(file_processor_stub) == 0
+
+
+@pytest.mark.asyncio
+async def test_changed_chunks_invalidate_checkpoints(file_processor_stub):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.llm_provider = FailingLlmProvider(fail_on_request=5)
+    await file_processor_stub.process()
+    assert num_checkpoints(file_processor_stub) == 4
+
+    file_processor_stub.file_path.write_text(
+        FILE_PROCESSOR_TEST_TExT.replace("YourClass", "TheirClass")
+    )
+    resumed_provider = LlmProviderSpy()
+    file_processor_stub.llm_provider = resumed_provider
+    await file_processor_stub.process()
+
+    # Chunk 3 changed, so chunks 3 and 4 have to be converted.
+    assert len(resumed_provider.sent_messages) == 2
+
+
+def test_edited_file_is_no_longer_processed(file_processor_stub):
+    file_processor_stub.note_file_processed()
+    file_processor_stub.file_path.write_text("// %%\nclass Edited {}\n")
+    file_processor_stub.source_hash = None
+    assert not file_processor_stub.has_file_been_processed()
+
+
+def test_changed_prompt_invalidates_processed_file(file_processor_stub):
+    file_processor_stub.note_file_processed()
+    file_processor_stub.convert_chunk_prompt = "translate {chunk}"
+    assert not file_processor_stub.has_file_been_processed()
+
+
+def test_moved_file_with_output_counts_as_processed(file_processor_stub, tmp_path):
+    file_processor_stub.note_file_processed()
+    moved_dir = tmp_path / "moved"
+    moved_dir.mkdir()
+    moved_file = file_processor_stub.file_path.rename(moved_dir / "test_file.java")
+    file_processor_stub.file_path = moved_file
+    assert not file_processor_stub.has_file_been_processed()
+
+    file_processor_stub.output_file_path.write_text("Converted")
+    assert file_processor_stub.has_file_been_processed()
+
+
+def test_entries_without_hashes_match_if_output_is_newer(
+    file_processor_stub, in_memory_db
+):
+    in_memory_db.execute(
+        "INSERT INTO converted_files (file_name, model, from_lang, to_lang) "
+        "VALUES (?, ?, ?, ?)",
+        file_processor_stub.db_key,
+    )
+    output = file_processor_stub.output_file_path
+    output.write_text("Converted")
+    source_mtime = file_processor_stub.file_path.stat().st_mtime
+    os.utime(output, (source_mtime + 10, source_mtime + 10))
+    assert file_processor_stub.has_file_been_processed()
+
+    # The hashes were recorded, so an edit is noticed from now on.
+    file_processor_stub.file_path.write_text("// %%\nclass Edited {}\n")
+    os.utime(file_processor_stub.file_path, (source_mtime, source_mtime))
+    file_processor_stub.source_hash = None
+    assert not file_processor_stub.has_file_been_processed()
+
+
+def test_entries_without_hashes_do_not_match_if_file_is_newer(
+    file_processor_stub, in_memory_db
+):
+    in_memory_db.execute(
+        "INSERT INTO converted_files (file_name, model, from_lang, to_lang) "
+        "VALUES (?, ?, ?, ?)",
+        file_processor_stub.db_key,
+    )
+    output = file_processor_stub.output_file_path
+    output.write_text("Converted")
+    source_mtime = file_processor_stub.file_path.stat().st_mtime
+    os.utime(output, (source_mtime - 10, source_mtime - 10))
+    assert not file_processor_stub.has_file_been_processed()
+    output.unlink()
+    assert not file_processor_stub.has_file_been_processed()
+
+
+@pytest.mark.asyncio
+async def test_process_reconverts_edited_file(file_processor_stub):
+    await file_processor_stub.process()
+    file_processor_stub.file_path.write_text("// %%\nclass Edited {}\n")
+    file_processor_stub.llm_provider = LlmProviderSpy()
+    await file_processor_stub.process()
+    assert len(file_processor_stub.llm_provider.sent_messages) == 2
+
+
+@pytest.mark.asyncio
+async def test_context_policy_bounds_sent_history(file_processor_stub):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.context_policy = ContextPolicy(max_exchanges=1)
+    await file_processor_stub.process()
+
+    sent_messages = file_processor_stub.llm_provider.sent_messages
+    # Acknowledgement, first chunk with empty history, then prefix (4 messages),
+    # one previous exchange and the new chunk.
+    assert [len(messages) for messages in sent_messages] == [1, 5, 7, 7, 7]
+    assert len(file_processor_stub.messages) == 12
+
+
+@pytest.fixture
+def streaming_file_processor(file_processor_stub, mock_open_router):
+    file_processor_stub.llm_provider = OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url, stream_idle_timeout=0.2
+    )
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.streaming = True
+    file_processor_stub.chunk_retry_delay = 0.01
+    return file_processor_stub
+
+
+@pytest.mark.asyncio
+async def test_streaming_writes_cleaned_chunks_to_output_file(
+    streaming_file_processor, mock_open_router
+):
+    mock_open_router.stream_chunk_size = 3
+    mock_open_router.reply = lambda messages: f"```csharp\n{len(messages)}\n```"
+    await streaming_file_processor.process()
+
+    output = streaming_file_processor.output_file_path.read_text()
+    assert output == "5\n7\n9\n11"
+    assert not streaming_file_processor.partial_output_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_streaming_shows_progress_in_partial_output_file(
+    streaming_file_processor, mock_open_router
+):
+    partial_contents = []
+
+    def reply(messages):
+        partial_contents.append(
+            streaming_file_processor.partial_output_path.read_text()
+        )
+        return f"chunk {len(partial_contents)}"
+
+    mock_open_router.reply = reply
+    await streaming_file_processor.process()
+
+    assert partial_contents == [
+        "",
+        "",
+        "chunk 2\n",
+        "chunk 2\nchunk 3\n",
+        "chunk 2\nchunk 3\nchunk 4\n",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stalled_stream_leaves_no_output(
+    streaming_file_processor, mock_open_router
+):
+    mock_open_router.stall_after = 1
+    await streaming_file_processor.process()
+
+    assert not streaming_file_processor.output_file_path.exists()
+    assert not streaming_file_processor.partial_output_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_process_records_metrics_for_each_request(file_processor_stub):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.metrics = RunMetrics()
+    await file_processor_stub.process()
+
+    stats = file_processor_stub.metrics.stats[("meta/llama", "java", "csharp")]
+    assert stats.requests == 5
+    assert stats.estimated_token_requests == 5
+    assert stats.prompt_tokens > 0
+    slowest = file_processor_stub.metrics.summary()["slowest_requests"]
+    assert sorted(r["chunk_index"] for r in slowest) == [-1, 0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_synthesized_acknowledgement_sends_no_request(file_processor_stub):
+    file_processor_stub.ack_mode = "synthesize"
+    await file_processor_stub.process()
+
+    sent_messages = file_processor_stub.llm_provider.sent_messages
+    assert len(sent_messages) == 1
+    assert sent_messages[0][1] == Message("assistant", "I understand!")
+    assert file_processor_stub.output_file_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_cached_acknowledgement_is_requested_once(
+    file_processor_stub, tmp_path
+):
+    other_file = tmp_path / "other_file.java"
+    other_file.write_text(FILE_PROCESSOR_TEST_TExT)
+    file_processor_stub.ack_mode = "cache"
+    other_processor = evolve(file_processor_stub, file_path=other_file)
+    await asyncio.gather(file_processor_stub.process(), other_processor.process())
+
+    sent_messages = file_processor_stub.llm_provider.sent_messages
+    assert [len(messages) for messages in sent_messages] == [1, 5, 5]
+    assert other_processor.output_file_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_prompt_caching_marks_initial_prompt_and_end_of_prefix(
+    file_processor_stub,
+):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.prompt_caching = True
+    await file_processor_stub.process()
+
+    sent_messages = file_processor_stub.llm_provider.sent_messages
+    for messages in sent_messages[1:]:
+        # The acknowledgement differs between files, so the initial prompt
+        # before it is marked as well.
+        assert [m.cache for m in messages[:5]] == [True, False, False, True, False]
+
+
+@define
+class FlakyProvider(LlmProviderSpy):
+    """Fail the requests with the given (0-based) numbers."""
+
+    failures: dict[int, Exception] = Factory(dict)
+    num_requests: int = 0
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        self.num_requests += 1
+        if (error := self.failures.get(self.num_requests - 1)) is not None:
+            raise error
+        return await super().send_message(messages, model)
+
+
+@pytest.mark.asyncio
+async def test_transient_failure_is_retried_for_the_failed_chunk(
+    file_processor_stub,
+):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.chunk_retry_delay = 0.01
+    file_processor_stub.llm_provider = FlakyProvider(
+        failures={
+            2: RetryableProviderError("Bad gateway", 502),
+            3: asyncio.TimeoutError(),
+        }
+    )
+    await file_processor_stub.process()
+
+    # Acknowledgement, 4 chunks and 2 retries of the second chunk.
+    assert file_processor_stub.llm_provider.num_requests == 7
+    assert len(file_processor_stub.llm_provider.sent_messages) == 5
+    assert file_processor_stub.output_file_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_errors_retried_by_the_provider_are_not_retried_per_chunk(
+    file_processor_stub,
+):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.chunk_retry_delay = 0.01
+    flaky = FlakyProvider(
+        failures={
+            i: RetryableProviderError("Service unavailable", 503) for i in range(1, 4)
+        }
+    )
+    file_processor_stub.llm_provider = RateLimitedProvider(
+        flaky, max_retries=2, base_delay=0.001
+    )
+    await file_processor_stub.process()
+
+    # The provider sends the first chunk three times and gives up; the
+    # chunk is not sent again.
+    assert flaky.num_requests == 4
+    assert not file_processor_stub.output_file_path.exists()
+
+    # A timeout is not retried by the provider, so the chunk is retried.
+    flaky.failures = {5: asyncio.TimeoutError()}
+    await file_processor_stub.process()
+    assert file_processor_stub.output_file_path.exists()
+    # Four chunks and one retry of the second chunk.
+    assert flaky.num_requests == 4 + 4 + 1
+
+
+@pytest.mark.asyncio
+async def test_permanent_failure_is_not_retried(file_processor_stub):
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.llm_provider = FlakyProvider(
+        failures={2: LlmProviderError("Invalid request", 400)}
+    )
+    await file_processor_stub.process()
+
+    assert file_processor_stub.llm_provider.num_requests == 3
+    assert not file_processor_stub.output_file_path.exists()
+    # The acknowledgement and the first chunk are kept for the next run.
+    assert sorted(file_processor_stub.load_chunk_checkpoints()) == [-1, 0]
+
+
+@define
+class TruncatingProvider(LlmProviderSpy):
+    """Cut off replies to messages longer than `max_reply_length`."""
+
+    max_reply_length: int = 60
+
+    async def complete(
+        self, messages, model, on_delta=None, max_tokens=None
+    ) -> Completion:
+        self.sent_messages.append(list(messages))
+        content = messages[-1].content
+        if len(content) > self.max_reply_length:
+            return Completion(content[: self.max_reply_length], finish_reason="length")
+        return Completion(content, finish_reason="stop")
+
+
+@pytest.mark.asyncio
+async def test_truncated_reply_splits_chunk_and_lowers_chunk_size(
+    file_processor_stub,
+):
+    file_processor_stub.max_chunk_size = 200
+    file_processor_stub.llm_provider = TruncatingProvider(max_reply_length=80)
+    await file_processor_stub.process()
+
+    output = file_processor_stub.output_file_path.read_text()
+    assert output.replace("\n", "").replace("convert ", "") == (
+        FILE_PROCESSOR_TEST_TExT.replace("\n", "")
+    )
+    limit = file_processor_stub.chunk_size_limits["meta/llama"]
+    assert 200 / 16 <= limit < 100
+    assert len(file_processor_stub.split_into_chunks(FILE_PROCESSOR_TEST_TExT)) > 1
+
+
+@pytest.mark.asyncio
+async def test_truncated_reply_for_single_cell_fails_file(file_processor_stub):
+    file_processor_stub.file_path.write_text("// %%\n" + "x = 1;\n" * 20)
+    file_processor_stub.llm_provider = TruncatingProvider()
+    await file_processor_stub.process()
+
+    assert not file_processor_stub.output_file_path.exists()
+    # The cell cannot be split, so later files keep their chunk size.
+    assert file_processor_stub.chunk_size_limits == {}
+
+
+@define
+class MaxTokensSpy(LlmProviderSpy):
+    max_tokens: list[int | None] = Factory(list)
+
+    async def complete(
+        self, messages, model, on_delta=None, max_tokens=None
+    ) -> Completion:
+        self.max_tokens.append(max_tokens)
+        return await super().complete(messages, model, on_delta)
+
+
+@pytest.mark.asyncio
+async def test_profile_limits_chunks_and_replies_and_prices_requests(
+    file_processor_stub,
+):
+    file_processor_stub.llm_provider = MaxTokensSpy()
+    file_processor_stub.metrics = RunMetrics()
+    file_processor_stub.profile = ModelProfile(
+        max_output_tokens=20,
+        reply_ratio=1.0,
+        min_reply_tokens=10,
+        prompt_price=1.0,
+        completion_price=1.0,
+    )
+    assert file_processor_stub.max_chunk_size_for_model == 80
+    await file_processor_stub.process()
+
+    max_tokens = file_processor_stub.llm_provider.max_tokens
+    assert len(max_tokens) > 2
+    assert max_tokens[0] == 10
+    assert all(10 <= n <= 20 for n in max_tokens)
+    stats = file_processor_stub.metrics.stats[("meta/llama", "java", "csharp")]
+    assert stats.requests_without_cost == 0
+    assert stats.cost == pytest.approx(
+        (stats.prompt_tokens + stats.completion_tokens) / 1_000_000
+    )
+
+
+@define
+class ConcurrentEchoProvider(LlmProviderSpy):
+    """Echo the chunk of each request; later requests finish first."""
+
+    in_flight: int = 0
+    peak: int = 0
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        self.sent_messages.append(list(messages))
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.05 / len(self.sent_messages))
+        self.in_flight -= 1
+        return messages[-1].content.rsplit("convert ", 1)[-1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("streaming", [False, True])
+async def test_independent_chunks_are_converted_concurrently_in_order(
+    file_processor_stub, streaming
+):
+    file_processor_stub.llm_provider = ConcurrentEchoProvider()
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.independent_chunks = True
+    file_processor_stub.chunk_concurrency = 3
+    file_processor_stub.streaming = streaming
+    await file_processor_stub.process()
+
+    output = file_processor_stub.output_file_path.read_text()
+    assert output.replace("\n", "") == FILE_PROCESSOR_TEST_TExT.replace("\n", "")
+    provider = file_processor_stub.llm_provider
+    assert provider.peak == 3
+    chunk_requests = provider.sent_messages[1:]
+    assert len(chunk_requests) == 4
+    assert {len(messages) for messages in chunk_requests} == {5}
+    # Later chunks are told about the classes declared before them.
+    [your_class_request] = [
+        m[-1].content
+        for m in chunk_requests
+        if "class YourClass" in m[-1].content.rsplit("convert ", 1)[-1]
+    ]
+    assert "Java types and functions" in your_class_request
+    assert "\nclass MyClass\n" in your_class_request
+    assert not file_processor_stub.partial_output_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_independent_chunks_take_further_requests_from_global_slots(
+    file_processor_stub,
+):
+    file_processor_stub.llm_provider = ConcurrentEchoProvider()
+    file_processor_stub.max_chunk_size = 40
+    file_processor_stub.independent_chunks = True
+    file_processor_stub.chunk_concurrency = 3
+    slots = FairSlots(2)
+    file_processor_stub.request_slots = slots
+    # The job itself holds one of the two slots while it runs.
+    async with slots.slot(file_processor_stub.model.id):
+        await file_processor_stub.process()
+
+    assert file_processor_stub.output_file_path.exists()
+    assert file_processor_stub.llm_provider.peak == 2
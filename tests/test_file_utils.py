@@ -1,6 +1,12 @@
 import pytest
 
-from plc.file_utils import split_into_chunks
+from plc.file_utils import (
+    Chunks,
+    cell_spans,
+    mapped_file,
+    span_text,
+    split_into_chunks,
+)
 
 
 def test_single_small_chunk():
@@ -68,3 +74,57 @@ def test_different_max_chunk_sizes(max_chunk_size, expected):
     content = "# %%\nSmall\n# %%\nChunk\n# %%\nAnother"
     result = split_into_chunks(content, max_chunk_size=max_chunk_size)
     assert result == expected
+
+
+def test_size_function_determines_chunk_size():
+    content = "# %%\nSmall\n# %%\nChunk\n# %%\nAnother"
+    # Count newlines instead of characters.
+    result = split_into_chunks(
+        content, max_chunk_size=4, size_function=lambda c: c.count("\n")
+    )
+    assert result == ["# %%\nSmall\n# %%\nChunk\n", "# %%\nAnother"]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "",
+        "No markers here\nJust plain text",
+        "Header\n# %%\nPython\n  // %%\nJavaScript\n",
+        "# %%\r\nWindows\r\n# %%\r\nLine endings",
+        "# %%\nA\x0c# %%\nForm feed\u2028# %%\nLine separator",
+        "x = '# %%'\n# %%\ny",
+    ],
+)
+def test_cell_spans_match_lines_of_content(content):
+    expected = []
+    current = ""
+    for line in content.splitlines(keepends=True):
+        if line.strip().startswith(("# %%", "// %%")) and current:
+            expected.append(current)
+            current = ""
+        current += line
+    if current:
+        expected.append(current)
+
+    assert [content[start:end] for start, end in cell_spans(content)] == expected
+    encoded = content.encode("utf-8")
+    assert [span_text(encoded, span) for span in cell_spans(encoded)] == expected
+
+
+def test_chunks_over_mapped_file(tmp_path):
+    content = "# %%\nSmall\n# %%\nChünk\n# %%\nAnother"
+    path = tmp_path / "notebook.py"
+    path.write_bytes(content.encode("utf-8"))
+
+    with mapped_file(path) as mapped:
+        chunks = Chunks.split(mapped, max_chunk_size=30)
+        assert list(chunks) == split_into_chunks(content, max_chunk_size=30)
+
+
+def test_chunks_of_empty_mapped_file(tmp_path):
+    path = tmp_path / "empty.py"
+    path.touch()
+
+    with mapped_file(path) as mapped:
+        assert list(Chunks.split(mapped)) == []
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+from attrs import Factory, define
+
+from plc.completion import Completion
+from plc.errors import RateLimitError, RetryableProviderError
+from plc.hedging import HedgingProvider
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.metrics import RunMetrics
+from plc.model import Model
+from plc.rate_limiter import AdaptiveRateLimiter
+from plc.token_estimator import estimate_message_tokens
+
+MODEL = Model("meta/llama", "llama")
+FALLBACK_MODEL = Model("qwen/qwen", "qwen")
+MESSAGES = [Message("user", "Hello")]
+
+
+@define
+class ScriptedProvider(LlmProvider):
+    """Reply after the next scripted delay; negative delays fail after their
+    absolute value."""
+
+    delays: list[float] = Factory(list)
+    requests: list[str] = Factory(list)
+    cancelled: int = 0
+    # Reject every request but the first one with a rate limit.
+    rate_limited: bool = False
+
+    async def complete(
+        self, messages, model, on_delta=None, max_tokens=None
+    ) -> Completion:
+        self.requests.append(model.id)
+        if self.rate_limited and len(self.requests) > 1:
+            raise RateLimitError("Too many requests", 429)
+        delay = self.delays.pop(0) if self.delays else 0.0
+        try:
+            await asyncio.sleep(abs(delay))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if delay < 0:
+            raise RetryableProviderError("Service unavailable", 503)
+        return Completion(f"{model.slug} after {delay}")
+
+
+def hedging_provider(delays, **kwargs):
+    provider = HedgingProvider(
+        ScriptedProvider(delays),
+        quantile=0.9,
+        min_samples=5,
+        min_delay=0.01,
+        metrics=RunMetrics(),
+        **kwargs,
+    )
+    for _ in range(5):
+        provider.observe(MODEL, 0.02)
+    return provider
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_before_enough_latencies_are_known():
+    provider = HedgingProvider(ScriptedProvider([0.05]), min_delay=0.0)
+    completion = await provider.complete(MESSAGES, MODEL)
+    assert completion.content == "llama after 0.05"
+    assert provider.provider.requests == [MODEL.id]
+
+
+@pytest.mark.asyncio
+async def test_fast_requests_are_not_hedged():
+    provider = hedging_provider([0.0])
+    await provider.complete(MESSAGES, MODEL)
+    assert provider.provider.requests == [MODEL.id]
+    assert provider.metrics.hedges == {}
+
+
+@pytest.mark.asyncio
+async def test_hedge_to_fallback_model_wins_against_straggler():
+    provider = hedging_provider(
+        [1.0, 0.01], fallback_models={MODEL.id: FALLBACK_MODEL}
+    )
+    # A slow request in the tail, from which the saved time is estimated.
+    for latency in [0.02] * 10 + [2.0]:
+        provider.observe(MODEL, latency)
+    completion = await provider.complete(MESSAGES, MODEL)
+    await asyncio.sleep(0)
+
+    assert completion.content == "qwen after 0.01"
+    assert provider.provider.requests == [MODEL.id, FALLBACK_MODEL.id]
+    assert provider.provider.cancelled == 1
+    stats = provider.metrics.hedges[MODEL.id]
+    assert (stats.hedges, stats.won) == (1, 1)
+    assert 1.8 < stats.seconds_saved < 1.98
+    # The cancelled request's latency is unknown, the hedge's is observed.
+    assert len(provider._latencies[MODEL.id]) == 16
+    assert len(provider._latencies[FALLBACK_MODEL.id]) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_request_is_answered_by_its_hedge():
+    provider = hedging_provider([-0.1, 0.2])
+    completion = await provider.complete(MESSAGES, MODEL)
+
+    assert completion.content == "llama after 0.2"
+    assert provider.provider.cancelled == 0
+    assert provider.metrics.hedges[MODEL.id].won == 1
+
+
+@pytest.mark.asyncio
+async def test_original_reply_wins_if_it_arrives_first():
+    provider = hedging_provider([0.05, 0.5])
+    completion = await provider.complete(MESSAGES, MODEL)
+    await asyncio.sleep(0)
+
+    assert completion.content == "llama after 0.05"
+    assert provider.provider.cancelled == 1
+    stats = provider.metrics.hedges[MODEL.id]
+    assert (stats.hedges, stats.won, stats.seconds_saved) == (1, 0, 0.0)
+
+
+@pytest.mark.asyncio
+async def test_hedge_takes_budget_from_limiter_of_its_model():
+    limiters = {}
+
+    def limiter_for(model):
+        return limiters.setdefault(
+            model.id, AdaptiveRateLimiter(tokens_per_minute=6000, clock=lambda: 0.0)
+        )
+
+    provider = hedging_provider(
+        [1.0, 0.01],
+        fallback_models={MODEL.id: FALLBACK_MODEL},
+        limiter_for=limiter_for,
+    )
+    completion = await provider.complete(MESSAGES, MODEL)
+
+    assert completion.model == FALLBACK_MODEL
+    bucket = limiters[FALLBACK_MODEL.id].token_bucket
+    assert bucket.tokens == bucket.capacity - estimate_message_tokens(MESSAGES)
+    # The primary request took its budget above the hedging provider.
+    assert MODEL.id not in limiters
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_hedge_slows_down_its_limiter():
+    limiter = AdaptiveRateLimiter(requests_per_minute=60, clock=lambda: 0.0)
+    provider = hedging_provider([0.05, 0.0], limiter_for=lambda model: limiter)
+    provider.provider.rate_limited = True
+    completion = await provider.complete(MESSAGES, MODEL)
+
+    assert completion.content == "llama after 0.05"
+    assert completion.model is None
+    assert limiter.factor == 0.5
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from plc.metrics import Histogram, RequestRecord, RunMetrics
+
+
+def make_record(**kwargs) -> RequestRecord:
+    return RequestRecord(
+        **{
+            "model": "m",
+            "from_lang": "java",
+            "to_lang": "csharp",
+            "file_name": "a.java",
+            "chunk_index": 0,
+            "latency": 1.0,
+            "prompt_tokens": 100,
+            "completion_tokens": 50,
+            **kwargs,
+        }
+    )
+
+
+def test_histogram_estimates_quantiles_within_buckets():
+    histogram = Histogram((1, 2, 4))
+    for value in [0.5, 1.5, 1.5, 3.0]:
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1.0) == pytest.approx(4.0)
+    assert Histogram((1,)).quantile(0.5) is None
+
+
+def test_run_metrics_aggregates_by_model_and_language_pair():
+    metrics = RunMetrics()
+    metrics.record(make_record(cost=0.01, retries=2))
+    metrics.record(make_record(chunk_index=1, latency=3.0, cost=0.02))
+    metrics.record(make_record(model="other", succeeded=False))
+
+    summary = metrics.summary()
+    assert summary["requests"] == 3
+    assert summary["cost_usd"] == pytest.approx(0.03)
+    by_model = {entry["model"]: entry for entry in summary["by_model"]}
+    assert by_model["m"]["prompt_tokens"] == 200
+    assert by_model["m"]["retries"] == 2
+    assert by_model["other"]["failures"] == 1
+    assert by_model["other"]["prompt_tokens"] == 0
+    assert summary["slowest_requests"][0]["chunk_index"] == 1
+
+
+def test_run_metrics_writes_json_and_prometheus_files(tmp_path):
+    metrics = RunMetrics(
+        json_path=tmp_path / "metrics.json", prometheus_path=tmp_path / "plc.prom"
+    )
+    metrics.record(make_record(latency=0.2, cost=0.5))
+    metrics.record_hedge("m", True, 3.0)
+    metrics.write()
+
+    assert json.loads((tmp_path / "metrics.json").read_text())["requests"] == 1
+    prometheus_text = (tmp_path / "plc.prom").read_text()
+    labels = 'model="m",from_lang="java",to_lang="csharp"'
+    assert f"plc_requests_total{{{labels}}} 1\n" in prometheus_text
+    assert f"plc_cost_usd_total{{{labels}}} 0.5\n" in prometheus_text
+    assert (
+        f'plc_request_duration_seconds_bucket{{{labels},le="0.25"}} 1\n'
+        in prometheus_text
+    )
+    assert f"plc_request_duration_seconds_count{{{labels}}} 1\n" in prometheus_text
+    assert 'plc_hedge_seconds_saved_total{model="m"} 3\n' in prometheus_text
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,75 @@
+import pytest
+
+from plc.defaults import all_models
+from plc.model import Model
+from plc.model_profile import ModelProfile, ModelProfiles, default_model_profiles
+from plc.scheduler import Scheduler
+
+CLAUDE, QWEN = all_models[0], all_models[1]
+UNKNOWN_MODEL = Model("meta/llama", "llama")
+
+PROFILES_TOML = """
+[default]
+max_output_tokens = 2048
+
+[models."anthropic/claude-3.5-sonnet:beta"]
+concurrency = 2
+
+[models."meta/llama"]
+context_window = 8192
+prompt_price = 0.1
+"""
+
+
+def test_all_models_have_builtin_profiles():
+    profiles = ModelProfiles()
+    for model in all_models:
+        assert profiles.for_model(model) == default_model_profiles[model.id]
+    assert profiles.for_model(UNKNOWN_MODEL) is None
+
+
+def test_load_overrides_only_the_given_values(tmp_path):
+    path = tmp_path / "profiles.toml"
+    path.write_text(PROFILES_TOML)
+    profiles = ModelProfiles.load(path)
+
+    claude = profiles.for_model(CLAUDE)
+    assert claude.concurrency == 2
+    assert claude.context_window == default_model_profiles[CLAUDE.id].context_window
+    llama = profiles.for_model(UNKNOWN_MODEL)
+    assert (llama.context_window, llama.prompt_price) == (8192, 0.1)
+    assert llama.max_output_tokens == 2048
+    assert profiles.for_model(Model("other/model", "other")) is None
+
+
+def test_load_rejects_unknown_settings(tmp_path):
+    path = tmp_path / "profiles.toml"
+    path.write_text('[models."meta/llama"]\nmax_tokens = 10\n')
+    with pytest.raises(ValueError, match="max_tokens"):
+        ModelProfiles.load(path)
+
+
+def test_reply_tokens_grow_with_input_up_to_output_limit():
+    profile = ModelProfile(max_output_tokens=4096, min_reply_tokens=512)
+    assert profile.max_reply_tokens(10) == 512
+    assert profile.max_reply_tokens(1000) == 2000
+    assert profile.max_reply_tokens(5000) == 4096
+    assert profile.max_chunk_tokens == 2048
+    assert ModelProfile(context_window=4000).max_chunk_tokens == 1000
+
+
+def test_cost_uses_prices_per_million_tokens():
+    profile = ModelProfile(prompt_price=3.0, completion_price=15.0)
+    assert profile.cost(1_000_000, 100_000) == pytest.approx(4.5)
+
+
+def test_profile_concurrency_limits_workers_of_model():
+    profiles = ModelProfiles()
+    profiles.profiles[CLAUDE.id] = ModelProfile(concurrency=2)
+    scheduler = Scheduler(concurrency=8, model_profiles=profiles)
+
+    assert scheduler.workers_for_model(CLAUDE) == 2
+    assert scheduler.workers_for_model(QWEN) == 8
+    assert scheduler.workers_for_model(UNKNOWN_MODEL) == 8
+    scheduler.per_model_concurrency = 1
+    assert scheduler.workers_for_model(CLAUDE) == 1
@@ -0,0 +1,229 @@
+import json
+
+import pytest
+
+from plc import open_router_provider
+from plc.errors import RateLimitError, RetryableProviderError, StreamStalledError
+from plc.message import Message
+from plc.model import Model
+from plc.open_router_provider import (
+    OpenRouterProvider,
+    message_json,
+    parse_retry_after,
+)
+
+MODEL = Model("meta/llama", "llama")
+
+
+@pytest.mark.asyncio
+async def test_send_message_returns_reply_content(mock_open_router):
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    reply = await provider.send_message([Message("user", "Hello")], MODEL)
+    assert reply == "Hello"
+
+
+@pytest.mark.asyncio
+async def test_open_provider_reuses_connections(mock_open_router):
+    async with OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url
+    ) as provider:
+        for i in range(5):
+            await provider.send_message([Message("user", f"Message {i}")], MODEL)
+
+    assert mock_open_router.requests_served == 5
+    assert len(mock_open_router.client_connections) == 1
+
+
+@pytest.mark.asyncio
+async def test_unopened_provider_uses_one_connection_per_request(mock_open_router):
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    for i in range(3):
+        await provider.send_message([Message("user", f"Message {i}")], MODEL)
+
+    assert len(mock_open_router.client_connections) == 3
+
+
+@pytest.mark.asyncio
+async def test_close_releases_session(mock_open_router):
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    await provider.open()
+    assert provider.is_open
+    await provider.close()
+    assert not provider.is_open
+
+
+@pytest.mark.asyncio
+async def test_warm_up_opens_connections(mock_open_router):
+    provider = OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url, warm_up_connections=2
+    )
+    async with provider:
+        assert mock_open_router.head_requests == 2
+        assert len(mock_open_router.client_connections) == 2
+        await provider.send_message([Message("user", "Hello")], MODEL)
+
+    assert mock_open_router.requests_served == 1
+    # The request reuses one of the warmed-up connections.
+    assert len(mock_open_router.client_connections) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_request_raises_runtime_error(mock_open_router):
+    provider = OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url + "/missing"
+    )
+    with pytest.raises(RuntimeError):
+        await provider.send_message([Message("user", "Hello")], MODEL)
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_request_raises_rate_limit_error(mock_open_router):
+    mock_open_router.error_statuses = [429]
+    mock_open_router.retry_after = 7
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    with pytest.raises(RateLimitError) as exc_info:
+        await provider.send_message([Message("user", "Hello")], MODEL)
+    assert exc_info.value.status == 429
+    assert exc_info.value.retry_after == 7
+
+
+@pytest.mark.asyncio
+async def test_server_error_raises_retryable_error(mock_open_router):
+    mock_open_router.error_statuses = [503]
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    with pytest.raises(RetryableProviderError) as exc_info:
+        await provider.send_message([Message("user", "Hello")], MODEL)
+    assert exc_info.value.retry_after is None
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(None, None), ("12", 12.0), ("0.5", 0.5), ("-3", 0.0), ("soon", None)],
+)
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_accepts_http_dates():
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+@pytest.mark.asyncio
+async def test_stream_message_reports_deltas(mock_open_router):
+    mock_open_router.stream_chunk_size = 4
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    deltas = []
+    reply = await provider.stream_message(
+        [Message("user", "Hello, streaming world!")], MODEL, deltas.append
+    )
+    assert reply == "Hello, streaming world!"
+    assert deltas == ["Hell", "o, s", "trea", "ming", " wor", "ld!"]
+
+
+@pytest.mark.asyncio
+async def test_stalled_stream_raises_stream_stalled_error(mock_open_router):
+    mock_open_router.stream_chunk_size = 4
+    mock_open_router.stall_after = 2
+    provider = OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url, stream_idle_timeout=0.1
+    )
+    deltas = []
+    with pytest.raises(StreamStalledError):
+        await provider.stream_message(
+            [Message("user", "Hello, streaming world!")], MODEL, deltas.append
+        )
+    assert deltas == ["Hell", "o, s"]
+
+
+@pytest.mark.asyncio
+async def test_stream_message_raises_error_for_failed_request(mock_open_router):
+    mock_open_router.error_statuses = [429]
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    with pytest.raises(RateLimitError):
+        await provider.stream_message([Message("user", "Hello")], MODEL, print)
+
+
+@pytest.mark.asyncio
+async def test_mock_server_fails_requests_at_error_rate(mock_open_router):
+    mock_open_router.error_rate = 1.0
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    with pytest.raises(RetryableProviderError) as exc_info:
+        await provider.send_message([Message("user", "Hello")], MODEL)
+    assert exc_info.value.status == 503
+
+
+@pytest.mark.asyncio
+async def test_mock_server_rejects_requests_during_rate_limit_burst(
+    mock_open_router,
+):
+    mock_open_router.rate_limit_burst_interval = 60
+    mock_open_router.rate_limit_burst_duration = 60
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    with pytest.raises(RateLimitError) as exc_info:
+        await provider.send_message([Message("user", "Hello")], MODEL)
+    assert 0 < exc_info.value.retry_after <= 60
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_complete_reports_usage_and_finish_reason(mock_open_router, stream):
+    mock_open_router.cost_per_1k_tokens = 2.0
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    on_delta = (lambda delta: None) if stream else None
+    completion = await provider.complete(
+        [Message("user", "Hello, world!")], MODEL, on_delta
+    )
+    assert completion.content == "Hello, world!"
+    assert completion.finish_reason == "stop"
+    assert completion.usage.prompt_tokens == 4
+    assert completion.usage.completion_tokens == 4
+    assert completion.usage.cost == pytest.approx(0.016)
+
+
+@pytest.mark.asyncio
+async def test_cached_prefix_is_reported_in_usage(mock_open_router):
+    provider = OpenRouterProvider(api_key="test-key", api_url=mock_open_router.url)
+    prefix = [Message("user", "Convert code."), Message("assistant", "OK", cache=True)]
+    data = json.loads(provider.build_request_data(prefix, MODEL))
+    assert data["messages"][0] == {"role": "user", "content": "Convert code."}
+    assert data["messages"][1]["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+    first = await provider.complete([*prefix, Message("user", "one")], MODEL)
+    second = await provider.complete([*prefix, Message("user", "two")], MODEL)
+    assert first.usage.cached_prompt_tokens == 0
+    assert second.usage.cached_prompt_tokens > 0
+    assert second.content == "two"
+
+
+def test_request_data_encodes_each_message_once(monkeypatch):
+    encoded = []
+    monkeypatch.setattr(
+        open_router_provider,
+        "encode_message",
+        lambda m: encoded.append(m.content) or json.dumps(message_json(m)).encode(),
+    )
+    messages = [Message("user", "Hello"), Message("assistant", "Hi")]
+    OpenRouterProvider.build_request_data(messages, MODEL)
+    messages.append(Message("user", "Bye"))
+    data = json.loads(
+        OpenRouterProvider.build_request_data(messages, MODEL, stream=True)
+    )
+
+    assert encoded == ["Hello", "Hi", "Bye"]
+    assert data == {
+        "model": MODEL.id,
+        "usage": {"include": True},
+        "stream": True,
+        "messages": [message_json(m) for m in messages],
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_compressed_requests_are_accepted(mock_open_router, stream):
+    provider = OpenRouterProvider(
+        api_key="test-key", api_url=mock_open_router.url, compress_requests=True
+    )
+    on_delta = (lambda delta: None) if stream else None
+    completion = await provider.complete([Message("user", "Hello")], MODEL, on_delta)
+    assert completion.content == "Hello"
@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+from conftest import FILE_PROCESSOR_TEST_TExT
+from plc.context_policy import ContextPolicy
+from plc.file_utils import split_into_chunks
+from plc.model import Model
+from plc.planner import ConversionPlanner
+from plc.polyglot_language_converter import PolyglotLanguageConverter
+
+
+def make_converter(llm_provider, directory, **kwargs):
+    return PolyglotLanguageConverter(
+        llm_provider=llm_provider,
+        models=[Model(id="model1", slug="gpt"), Model(id="model2", slug="llama")],
+        directory_path=directory,
+        max_chunk_size=60,
+        **kwargs,
+    )
+
+
+def test_plan_counts_requests_of_every_job(llm_provider_spy, tmp_path):
+    for index in range(3):
+        (tmp_path / f"file{index}.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    converter = make_converter(llm_provider_spy, tmp_path)
+
+    plan = ConversionPlanner(converter).plan()
+
+    num_chunks = len(split_into_chunks(FILE_PROCESSOR_TEST_TExT, 60))
+    assert len(plan.jobs) == 6
+    assert {job.requests for job in plan.jobs} == {num_chunks + 1}
+    assert plan.requests == 6 * (num_chunks + 1)
+    assert plan.models["model1"].files == 3
+    assert llm_provider_spy.sent_messages == []
+    assert list(tmp_path.glob("*.cs")) == []
+
+
+def test_cost_of_models_without_profile_is_unknown(llm_provider_spy, tmp_path):
+    (tmp_path / "file.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    plan = ConversionPlanner(make_converter(llm_provider_spy, tmp_path)).plan()
+
+    assert plan.models["model1"].cost is None
+    assert plan.cost is None
+    assert "unknown" in plan.format()
+    # Without a profile, requests do not limit the length of the reply.
+    converter = make_converter(llm_provider_spy, tmp_path)
+    job = next(converter.iterate_jobs())
+    assert converter.create_file_processor(job, None).max_reply_tokens() is None
+
+
+def test_plan_counts_resent_history(llm_provider_spy, tmp_path):
+    (tmp_path / "file.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    full = ConversionPlanner(make_converter(llm_provider_spy, tmp_path)).plan()
+    limited = ConversionPlanner(
+        make_converter(
+            llm_provider_spy, tmp_path, context_policy=ContextPolicy(max_exchanges=0)
+        )
+    ).plan()
+
+    assert full.requests == limited.requests
+    assert full.completion_tokens == limited.completion_tokens
+    assert full.prompt_tokens > limited.prompt_tokens
+
+
+@pytest.mark.asyncio
+async def test_plan_skips_converted_files_without_writing(llm_provider_spy, tmp_path):
+    db_path = tmp_path / "files.sqlite3"
+    (tmp_path / "file1.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    converter = make_converter(llm_provider_spy, tmp_path, db_path=db_path)
+    await converter.process_files()
+    (tmp_path / "file2.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    with sqlite3.connect(db_path) as conn:
+        num_rows = conn.execute("SELECT COUNT(*) FROM converted_files").fetchone()
+
+    plan = ConversionPlanner(converter).plan()
+
+    assert [job.file_path.name for job in plan.jobs] == ["file2.java"] * 2
+    assert plan.models["model1"].skipped_files == 1
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM converted_files").fetchone() == (
+            num_rows
+        )
+
+
+def test_projected_wall_time_depends_on_concurrency(llm_provider_spy, tmp_path):
+    for index in range(4):
+        (tmp_path / f"file{index}.java").write_text(FILE_PROCESSOR_TEST_TExT)
+
+    def wall_time(**kwargs):
+        converter = make_converter(llm_provider_spy, tmp_path, **kwargs)
+        return ConversionPlanner(converter, request_overhead=1.0).plan().wall_time
+
+    serial = wall_time(concurrency=1)
+    assert wall_time(concurrency=8) == pytest.approx(serial / 8)
+    assert wall_time(concurrency=8, per_model_concurrency=2) == pytest.approx(
+        serial / 4
+    )
+
+
+def test_independent_chunks_send_less_history_in_less_time(
+    llm_provider_spy, tmp_path
+):
+    (tmp_path / "file.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    sequential = ConversionPlanner(make_converter(llm_provider_spy, tmp_path)).plan()
+    independent = ConversionPlanner(
+        make_converter(
+            llm_provider_spy, tmp_path, independent_chunks=True, chunk_concurrency=8
+        )
+    ).plan()
+
+    assert independent.requests == sequential.requests
+    assert independent.prompt_tokens < sequential.prompt_tokens
+    assert independent.wall_time < sequential.wall_time
+
+
+def test_rate_limits_bound_the_wall_time(llm_provider_spy, tmp_path):
+    (tmp_path / "file.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    converter = make_converter(llm_provider_spy, tmp_path)
+
+    plan = ConversionPlanner(converter, requests_per_minute=1).plan()
+
+    assert plan.wall_time == pytest.approx(plan.models["model1"].requests * 60)
+    assert "Projected wall time" in plan.format()
+
+
+def test_plan_counts_duplicate_chunks_once_with_translation_memory(
+    llm_provider_spy, tmp_path
+):
+    for index in range(3):
+        (tmp_path / f"file{index}.java").write_text(FILE_PROCESSOR_TEST_TExT)
+    without_memory = ConversionPlanner(make_converter(llm_provider_spy, tmp_path))
+    with_memory = ConversionPlanner(
+        make_converter(llm_provider_spy, tmp_path, use_translation_memory=True)
+    )
+
+    num_chunks = len(split_into_chunks(FILE_PROCESSOR_TEST_TExT, 60))
+    assert without_memory.plan().requests == 6 * (num_chunks + 1)
+    assert with_memory.plan().requests == 6 + 2 * num_chunks
@@ -1,3 +1,4 @@
+import asyncio
 from pathlib import Path
 
 import pytest
@@ -70,3 +71,115 @@ def test_skip_file_because_of_name(llm_provider_spy):
         == True
     )
     assert converter.skip_file_because_of_name(Path("normal_file.java")) == False
+
+
+def test_iterate_file_paths_walks_tree_in_order(llm_provider_spy, tmp_path):
+    for relative_path in [
+        "b/file2.java",
+        "a/file1.java",
+        "a/notes.txt",
+        "file0.java",
+        "old/file3.java",
+        "a/backup_file.java",
+    ]:
+        (tmp_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / relative_path).write_text("// %%")
+    converter = PolyglotLanguageConverter(
+        llm_provider=llm_provider_spy, directory_path=tmp_path
+    )
+
+    assert [p.relative_to(tmp_path) for p in converter.iterate_file_paths()] == [
+        Path("file0.java"),
+        Path("a/file1.java"),
+        Path("b/file2.java"),
+    ]
+    assert len(list(converter.iterate_file_paths(max_files=2))) == 2
+
+
+@pytest.mark.asyncio
+async def test_prefetch_jobs_prepares_limited_number_of_files(
+    llm_provider_spy, in_memory_db, tmp_path, monkeypatch
+):
+    for file_index in range(6):
+        (tmp_path / f"file{file_index}.java").write_text(f"// %%\nFile {file_index}")
+    converter = PolyglotLanguageConverter(
+        llm_provider=llm_provider_spy,
+        models=[Model(id="model1", slug="gpt"), Model(id="model2", slug="llama")],
+        directory_path=tmp_path,
+        prefetch_files=2,
+    )
+    prepared_files = []
+    prepare_jobs = PolyglotLanguageConverter.prepare_jobs
+
+    def record_prepare_jobs(self, file_path, *args):
+        prepared_files.append(file_path)
+        return prepare_jobs(self, file_path, *args)
+
+    monkeypatch.setattr(PolyglotLanguageConverter, "prepare_jobs", record_prepare_jobs)
+    jobs = converter.prefetch_jobs(in_memory_db)
+
+    first_job = await anext(jobs)
+    await asyncio.sleep(0.05)
+    assert len(prepared_files) == 2
+    assert first_job.file_path.name == "file0.java"
+    assert list(first_job.processor.chunks) == ["// %%\nFile 0"]
+
+    remaining_jobs = [job async for job in jobs]
+    assert len(remaining_jobs) == 11
+    assert len(prepared_files) == 6
+
+
+@pytest.mark.asyncio
+async def test_converted_files_are_remembered_across_runs(llm_provider_spy, tmp_path):
+    source_dir = tmp_path / "src"
+    source_dir.mkdir()
+    for file_index in range(3):
+        (source_dir / f"file{file_index}.java").write_text(f"File {file_index}")
+
+    def make_converter():
+        return PolyglotLanguageConverter(
+            llm_provider=llm_provider_spy,
+            models=[Model(id="model1", slug="gpt")],
+            db_path=tmp_path / "processed.sqlite3",
+            directory_path=source_dir,
+        )
+
+    await make_converter().process_files()
+    num_requests = len(llm_provider_spy.sent_messages)
+    assert num_requests == 6
+
+    await make_converter().process_files()
+    assert len(llm_provider_spy.sent_messages) == num_requests
+
+
+@pytest.mark.asyncio
+async def test_process_files_converts_into_every_target(llm_provider_spy, tmp_path):
+    for file_index in range(2):
+        (tmp_path / f"file{file_index}.java").write_text(f"// %%\nFile {file_index}")
+    converter = PolyglotLanguageConverter(
+        llm_provider=llm_provider_spy,
+        models=[Model(id="model1", slug="gpt"), Model(id="model2", slug="llama")],
+        directory_path=tmp_path,
+        to_slugs=["csharp", "python"],
+    )
+    read_files = []
+    read_text = Path.read_text
+
+    def record_read_text(path, *args, **kwargs):
+        read_files.append(path.name)
+        return read_text(path, *args, **kwargs)
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(Path, "read_text", record_read_text)
+        await converter.process_files()
+
+    assert sorted(read_files) == ["file0.java", "file1.java"]
+    assert sorted(path.name for path in tmp_path.glob("file0.*.*")) == [
+        "file0.gpt.cs",
+        "file0.gpt.py",
+        "file0.llama.cs",
+        "file0.llama.py",
+    ]
+    sent_messages = llm_provider_spy.sent_messages
+    assert len({messages[0].content for messages in sent_messages}) == 2
+    assert converter.to_slug == "csharp"
@@ -0,0 +1,191 @@
+import pytest
+from attrs import Factory, define
+
+from plc.errors import LlmProviderError, RateLimitError, RetryableProviderError
+from plc.llm_provider import LlmProvider
+from plc.message import Message
+from plc.model import Model
+from plc.rate_limiter import (
+    AdaptiveRateLimiter,
+    RateLimitedProvider,
+    TokenBucket,
+    backoff_delay,
+)
+
+MODEL = Model("meta/llama", "llama")
+MESSAGES = [Message("user", "Hello")]
+
+
+@define
+class FlakyProvider(LlmProvider):
+    errors: list[Exception] = Factory(list)
+    num_calls: int = 0
+
+    async def send_message(self, messages: list[Message], model: Model) -> str:
+        self.num_calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "Converted"
+
+
+@define
+class FakeClock:
+    now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    bucket.consume(4)
+    assert bucket.time_until_available(2, now=0.0) == pytest.approx(1.0)
+    assert bucket.time_until_available(2, now=1.0) == 0.0
+    bucket.refill(now=100.0)
+    assert bucket.tokens == 4.0
+
+
+def test_token_bucket_lets_oversized_requests_drain_it():
+    bucket = TokenBucket(rate=1.0, capacity=10.0)
+    assert bucket.time_until_available(50, now=0.0) == 0.0
+
+
+def test_limiter_decreases_multiplicatively_and_increases_additively():
+    limiter = AdaptiveRateLimiter(requests_per_minute=600, clock=FakeClock())
+    limiter.on_rate_limited()
+    limiter.on_rate_limited()
+    assert limiter.factor == pytest.approx(0.25)
+    assert limiter.request_bucket.rate == pytest.approx(2.5)
+
+    limiter.on_success()
+    assert limiter.factor == pytest.approx(0.3)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.factor == 1.0
+
+
+def test_limiter_honours_retry_after():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock)
+    limiter.on_rate_limited(retry_after=5)
+    assert limiter.time_until_available(0) == 5
+    clock.now = 5
+    assert limiter.time_until_available(0) == 0
+
+
+def test_limiter_limits_tokens_per_minute():
+    limiter = AdaptiveRateLimiter(tokens_per_minute=600, clock=FakeClock())
+    assert limiter.time_until_available(100) == 0
+    limiter.token_bucket.consume(100)
+    assert limiter.time_until_available(100) == pytest.approx(10.0)
+
+
+def test_backoff_delay_grows_exponentially_with_jitter():
+    for attempt in range(5):
+        delay = backoff_delay(attempt, base_delay=1.0, max_delay=8.0)
+        expected = min(8.0, 2**attempt)
+        assert expected / 2 <= delay <= expected
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_provider_retries_retryable_errors():
+    inner = FlakyProvider(
+        errors=[RateLimitError("429", 429, 0.0), RetryableProviderError("503", 503)]
+    )
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    assert await provider.send_message(MESSAGES, MODEL) == "Converted"
+    assert inner.num_calls == 3
+    assert provider.limiter_for(MODEL).factor < 1.0
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_provider_gives_up_after_max_retries():
+    inner = FlakyProvider(errors=[RetryableProviderError("503", 503)] * 3)
+    provider = RateLimitedProvider(inner, max_retries=2, base_delay=0.001)
+    with pytest.raises(RetryableProviderError):
+        await provider.send_message(MESSAGES, MODEL)
+    assert inner.num_calls == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_provider_does_not_retry_permanent_errors():
+    inner = FlakyProvider(errors=[LlmProviderError("401", 401)])
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    with pytest.raises(LlmProviderError):
+        await provider.send_message(MESSAGES, MODEL)
+    assert inner.num_calls == 1
+
+
+@define
+class StreamingFlakyProvider(FlakyProvider):
+    deltas_before_error: list[str] = Factory(list)
+
+    async def stream_message(self, messages, model, on_delta) -> str:
+        for delta in self.deltas_before_error:
+            on_delta(delta)
+        return await self.send_message(messages, model)
+
+
+@pytest.mark.asyncio
+async def test_stream_is_retried_before_first_delta():
+    inner = StreamingFlakyProvider(errors=[RetryableProviderError("503", 503)])
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    assert await provider.stream_message(MESSAGES, MODEL, print) == "Converted"
+    assert inner.num_calls == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_is_not_retried_after_first_delta():
+    inner = StreamingFlakyProvider(
+        errors=[RetryableProviderError("503", 503)], deltas_before_error=["Con"]
+    )
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    deltas = []
+    with pytest.raises(RetryableProviderError):
+        await provider.stream_message(MESSAGES, MODEL, deltas.append)
+    assert deltas == ["Con"]
+    assert inner.num_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_completion_reports_number_of_retries():
+    inner = FlakyProvider(errors=[RetryableProviderError("503", 503)] * 2)
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    completion = await provider.complete(MESSAGES, MODEL)
+    assert completion.content == "Converted"
+    assert completion.retries == 2
+
+
+@pytest.mark.asyncio
+async def test_limiter_without_limits_learns_request_rate_from_rate_limit():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(clock=clock)
+    for _ in range(20):
+        await limiter.acquire()
+        clock.now += 0.5
+    assert limiter.request_bucket is None
+
+    limiter.on_rate_limited()
+
+    # 20 requests in 10 seconds, halved after the rate limit.
+    assert limiter.requests_per_minute == pytest.approx(120)
+    assert limiter.request_bucket.rate == pytest.approx(1.0)
+    assert limiter.time_until_available(0) == pytest.approx(1.0)
+    limiter.on_success()
+    assert limiter.request_bucket.rate == pytest.approx(1.1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_provider_without_limits_adapts_to_rate_limits():
+    inner = FlakyProvider()
+    provider = RateLimitedProvider(inner, base_delay=0.001)
+    for _ in range(10):
+        await provider.send_message(MESSAGES, MODEL)
+    assert provider.limiter_for(MODEL).request_bucket is None
+
+    inner.errors = [RateLimitError("429", 429, 0.0)]
+    await provider.send_message(MESSAGES, MODEL)
+
+    limiter = provider.limiter_for(MODEL)
+    assert limiter.request_bucket is not None
+    assert limiter.factor < 1.0
@@ -0,0 +1,175 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from attrs import evolve
+
+from plc.model import Model
+from plc.scheduler import ConversionJob, Scheduler
+
+FAST_MODEL = Model("fast/model", "fast")
+SLOW_MODEL = Model("slow/model", "slow")
+
+
+def prepared(job: ConversionJob) -> ConversionJob:
+    # The scheduler only counts whether a job has a processor, not its type.
+    return evolve(job, processor=object())
+
+
+def make_jobs(num_files: int, models: list[Model]) -> list[ConversionJob]:
+    return [
+        ConversionJob(file_path=Path(f"file{i}.java"), model=model)
+        for i in range(num_files)
+        for model in models
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_processes_all_jobs():
+    jobs = make_jobs(10, [FAST_MODEL, SLOW_MODEL])
+    processed = []
+
+    async def handle(job):
+        processed.append(job)
+
+    await Scheduler(concurrency=4).run(jobs, handle)
+    assert sorted(processed, key=str) == sorted(jobs, key=str)
+
+
+@pytest.mark.asyncio
+async def test_run_respects_global_and_per_model_limits():
+    in_flight: dict[str, int] = {"total": 0, "fast": 0, "slow": 0}
+    peak: dict[str, int] = {"total": 0, "fast": 0, "slow": 0}
+
+    async def handle(job):
+        for key in ("total", job.model.slug):
+            in_flight[key] += 1
+            peak[key] = max(peak[key], in_flight[key])
+        await asyncio.sleep(0.01)
+        for key in ("total", job.model.slug):
+            in_flight[key] -= 1
+
+    scheduler = Scheduler(concurrency=5, per_model_concurrency=3)
+    await scheduler.run(make_jobs(20, [FAST_MODEL, SLOW_MODEL]), handle)
+
+    assert peak["total"] == 5
+    assert peak["fast"] == 3
+    assert peak["slow"] == 3
+
+
+@pytest.mark.asyncio
+async def test_slow_model_does_not_stall_other_models():
+    finished: list[ConversionJob] = []
+
+    async def handle(job):
+        await asyncio.sleep(0.2 if job.model == SLOW_MODEL else 0.001)
+        finished.append(job)
+
+    scheduler = Scheduler(concurrency=4, per_model_concurrency=2)
+    await scheduler.run(make_jobs(10, [SLOW_MODEL, FAST_MODEL]), handle)
+
+    first_ten = finished[:10]
+    assert all(job.model == FAST_MODEL for job in first_ten)
+
+
+@pytest.mark.asyncio
+async def test_failing_job_does_not_stop_other_jobs():
+    processed = []
+
+    async def handle(job):
+        if job.file_path.name == "file1.java":
+            raise RuntimeError("Boom")
+        processed.append(job)
+
+    await Scheduler(concurrency=2).run(make_jobs(4, [FAST_MODEL]), handle)
+    assert len(processed) == 3
+
+
+@pytest.mark.asyncio
+async def test_run_accepts_async_iterables():
+    async def jobs():
+        for job in make_jobs(3, [FAST_MODEL]):
+            yield job
+
+    processed = []
+
+    async def handle(job):
+        processed.append(job)
+
+    await Scheduler(concurrency=2).run(jobs(), handle)
+    assert len(processed) == 3
+
+
+@pytest.mark.asyncio
+async def test_full_queue_stops_taking_jobs_from_source():
+    num_taken = 0
+    release = asyncio.Event()
+
+    async def jobs():
+        nonlocal num_taken
+        for job in make_jobs(10, [FAST_MODEL]):
+            num_taken += 1
+            yield prepared(job)
+
+    async def handle(job):
+        await release.wait()
+
+    run = asyncio.create_task(
+        Scheduler(concurrency=2, queue_size=3).run(jobs(), handle)
+    )
+    await asyncio.sleep(0.05)
+    # Two running jobs, three queued jobs and one waiting to be queued.
+    assert num_taken == 6
+    release.set()
+    await run
+    assert num_taken == 10
+
+
+@pytest.mark.asyncio
+async def test_slow_model_with_full_queue_does_not_stall_other_models():
+    finished: dict[str, float] = {}
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    reread = []
+
+    async def handle(job):
+        if job.processor is None:
+            reread.append(job)
+        await asyncio.sleep(0.1 if job.model == SLOW_MODEL else 0.001)
+        finished[job.model.slug] = loop.time() - start
+
+    jobs = [prepared(job) for job in make_jobs(20, [SLOW_MODEL, FAST_MODEL])]
+    scheduler = Scheduler(concurrency=4, per_model_concurrency=2, queue_size=4)
+    await scheduler.run(jobs, handle)
+
+    assert finished["fast"] < 0.3
+    assert finished["slow"] >= 1.0
+    # Only jobs queued once all prepared jobs were waiting are read again.
+    assert 0 < len(reread) < 40 - 4
+
+
+@pytest.mark.asyncio
+async def test_model_with_deep_backlog_does_not_hold_all_slots():
+    running = {"fast": 0, "slow": 0}
+    num_fast_started = num_fast_done = 0
+    slow_peak = 0
+
+    async def handle(job):
+        nonlocal num_fast_started, num_fast_done, slow_peak
+        running[job.model.slug] += 1
+        if job.model == FAST_MODEL:
+            num_fast_started += 1
+        elif 0 < num_fast_started and num_fast_done < 20:
+            # A slow job started while the fast model had jobs waiting.
+            slow_peak = max(slow_peak, running["slow"])
+        await asyncio.sleep(0.05 if job.model == SLOW_MODEL else 0.01)
+        running[job.model.slug] -= 1
+        if job.model == FAST_MODEL:
+            num_fast_done += 1
+
+    # All slow jobs come first, so the slow model starts with every slot.
+    jobs = make_jobs(20, [SLOW_MODEL]) + make_jobs(20, [FAST_MODEL])
+    await Scheduler(concurrency=4).run(jobs, handle)
+
+    assert num_fast_done == 20
+    assert slow_peak <= 2
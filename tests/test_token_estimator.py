@@ -0,0 +1,53 @@
+import pytest
+
+from plc.model import Model
+from plc.token_estimator import (
+    DEFAULT_ESTIMATOR,
+    MODEL_FAMILY_ESTIMATORS,
+    TokenEstimator,
+    estimator_for_model,
+)
+
+JAVA_CODE = """// %%
+public static void sayHi(String name) {
+    System.out.println("Hello, " + name);
+}
+"""
+GERMAN_MARKDOWN = """// %% [markdown] lang="de"
+//
+// Da Java eine statisch getypte Sprache ist, müssen wir bei der Definition
+// einer Funktion Typen für ihre Parameter und ihr Ergebnis angeben.
+"""
+
+
+@pytest.mark.parametrize("accurate", [False, True])
+def test_empty_text_has_no_tokens(accurate):
+    assert TokenEstimator(accurate=accurate)("") == 0
+
+
+@pytest.mark.parametrize("accurate", [False, True])
+def test_estimates_grow_with_text(accurate):
+    estimator = TokenEstimator(accurate=accurate)
+    assert 0 < estimator(JAVA_CODE) < estimator(JAVA_CODE * 2)
+
+
+def test_fast_estimate_charges_extra_for_non_ascii_text():
+    estimator = TokenEstimator()
+    assert estimator("müssen für") > estimator("mussen fur")
+
+
+@pytest.mark.parametrize("text", [JAVA_CODE, GERMAN_MARKDOWN])
+def test_fast_and_accurate_estimates_are_of_same_magnitude(text):
+    fast = TokenEstimator()(text)
+    accurate = TokenEstimator(accurate=True)(text)
+    assert 0.5 < fast / accurate < 2
+
+
+def test_estimator_for_model_uses_model_family():
+    claude = Model("anthropic/claude-3.5-sonnet:beta", "claude")
+    assert estimator_for_model(claude) == MODEL_FAMILY_ESTIMATORS["anthropic"]
+    assert estimator_for_model(claude, accurate=True).accurate
+
+
+def test_estimator_for_unknown_model_uses_default():
+    assert estimator_for_model(Model("acme/model", "acme")) == DEFAULT_ESTIMATOR
@@ -0,0 +1,73 @@
+import pytest
+
+from conftest import LlmProviderSpy
+from plc.database import ConversionDatabase
+from plc.model import Model
+from plc.polyglot_language_converter import PolyglotLanguageConverter
+from plc.translation_memory import TranslationMemory, chunk_hash
+
+SHARED_CELL = "// %%\nimport java.util.List;\n"
+
+
+def make_converter(directory, **kwargs):
+    return PolyglotLanguageConverter(
+        llm_provider=LlmProviderSpy(),
+        models=[Model(id="model1", slug="gpt")],
+        directory_path=directory,
+        max_chunk_size=10,
+        ack_mode="synthesize",
+        use_translation_memory=True,
+        **kwargs,
+    )
+
+
+def chunk_requests(converter):
+    return [messages[-1].content for messages in converter.llm_provider.sent_messages]
+
+
+def test_chunk_hash_ignores_line_endings_and_trailing_whitespace():
+    assert chunk_hash("// %%\r\nint x;  \r\n") == chunk_hash("\n// %%\nint x;\n\n")
+    assert chunk_hash("// %%\nint x;\n") != chunk_hash("// %%\nint y;\n")
+
+
+@pytest.mark.asyncio
+async def test_duplicate_chunks_are_converted_once_per_run(tmp_path):
+    for index in range(3):
+        (tmp_path / f"file{index}.java").write_text(
+            f"{SHARED_CELL}// %%\nclass Class{index} {{}}\n"
+        )
+    converter = make_converter(tmp_path)
+    await converter.process_files()
+
+    requests = chunk_requests(converter)
+    assert len(requests) == 4
+    assert sum("import java.util.List" in request for request in requests) == 1
+    assert len(list(tmp_path.glob("*.cs"))) == 3
+    assert (tmp_path / "file2.gpt.cs").read_text().startswith("Received")
+
+
+@pytest.mark.asyncio
+async def test_translations_are_remembered_across_runs(tmp_path):
+    db_path = tmp_path / "files.sqlite3"
+    (tmp_path / "first.java").write_text(SHARED_CELL)
+    await make_converter(tmp_path, db_path=db_path).process_files()
+
+    (tmp_path / "second.java").write_text(SHARED_CELL + "// %%\nclass Second {}\n")
+    converter = make_converter(tmp_path, db_path=db_path)
+    await converter.process_files()
+
+    requests = chunk_requests(converter)
+    assert len(requests) == 1
+    assert "class Second" in requests[0]
+    assert (tmp_path / "second.gpt.cs").exists()
+
+
+@pytest.mark.asyncio
+async def test_reply_of_another_model_is_stored_for_that_model(in_memory_db):
+    memory = TranslationMemory(ConversionDatabase.load(in_memory_db))
+    key = ("hash", "model1", "java", "cs", "prompt")
+    assert await memory.lookup(key) is None
+    memory.finish(key, "reply", model_id="fallback")
+
+    assert memory.stored_reply(key) is None
+    assert memory.stored_reply(("hash", "fallback", "java", "cs", "prompt")) == "reply"